@@ -1,6 +1,11 @@
-import numpy as np
-from sb3_contrib import MaskablePPO
+import argparse
+
+from belief import best_action
 from logic import SpiderEnv
+from numpy_policy import NumpyPolicy
+from planner import MCTSPlanner, policy_evaluator
+from recorder import TrajectoryWriter
+from speculator import Speculator
 
 
 def translate(v: int) -> str:
@@ -8,15 +13,6 @@ def translate(v: int) -> str:
     return mapping.get(v, str(v))
 
 
-def build_obs(columns):
-    obs = np.zeros((10, 30, 2), dtype=np.int8)
-    for i, col in enumerate(columns):
-        for j, card in enumerate(col[:30]):
-            obs[i, j, 0] = card["val"] if card["face_up"] else -1
-            obs[i, j, 1] = 1 if card["face_up"] else 0
-    return obs.flatten()
-
-
 def remove_complete_sequence(columns, col_idx):
     """
     永远返回 (removed, flipped_needed)
@@ -54,14 +50,19 @@ def remove_complete_sequence(columns, col_idx):
 
 
 
-def require_int(prompt: str):
-    """强制输入整数（不允许空）"""
+def require_int(prompt: str, lo=None, hi=None):
+    """强制输入整数（不允许空）；给了 lo / hi 时还必须在范围内"""
     while True:
         s = input(prompt).strip()
         try:
-            return int(s)
+            v = int(s)
         except ValueError:
             print("⚠️ 请输入整数。")
+            continue
+        if (lo is not None and v < lo) or (hi is not None and v > hi):
+            print(f"⚠️ 请输入 {lo}-{hi} 之间的整数。")
+            continue
+        return v
 
 
 def optional_int(prompt: str):
@@ -76,6 +77,25 @@ def optional_int(prompt: str):
         return None
 
 
+def fix_column(columns):
+    """可选地手动修正某列顶牌；返回 False 表示用户要退出"""
+    fix = input("如需手动修正某列顶牌，输入列号(0-9)，否则回车继续；q退出: ").strip().lower()
+    if fix == "q":
+        return False
+    if fix.isdigit():
+        idx = int(fix)
+        if 0 <= idx <= 9:
+            v = require_int(f"请输入 第 {idx} 列当前顶牌点数(0=空): ", 0, 13)
+            if v == 0:
+                columns[idx] = []
+            else:
+                if columns[idx]:
+                    columns[idx][-1] = {"val": v, "suit": 0, "face_up": True}
+                else:
+                    columns[idx].append({"val": v, "suit": 0, "face_up": True})
+    return True
+
+
 def print_top(columns):
     tops = []
     for i in range(10):
@@ -87,15 +107,22 @@ def print_top(columns):
     print("当前各列顶牌：", " | ".join([f"{i}:{t}" for i, t in enumerate(tops)]))
 
 
-def live_test():
-    model = MaskablePPO.load("marcuspider_v1_new.zip")
+def live_test(plan_ms=None, npz=None, writer=None, belief=None, belief_depth=3):
+    # 给了 .npz 就用纯 NumPy 推理（不加载 torch，启动快），否则加载完整的 MaskablePPO
+    if npz:
+        model = NumpyPolicy.load(npz)
+        evaluate = model.evaluate
+    else:
+        from sb3_contrib import MaskablePPO
+        model = MaskablePPO.load("marcuspider_v1_new.zip")
+        evaluate = policy_evaluator(model) if plan_ms or belief else None
     columns = [[] for _ in range(10)]
 
     print("\n=== Marcuspider 智能同步助手 V3（单花色） ===")
     print("初始化：请输入每列“可见的顶牌点数”。若该列看不到牌/为空请输入 0。\n")
 
     for i in range(10):
-        val = require_int(f"第 {i} 列可见点数(0=空): ")
+        val = require_int(f"第 {i} 列可见点数(0=空): ", 0, 13)
         if val > 0:
             # 单花色蜘蛛：初始每列总牌数 前4列6张、后6列5张，顶牌翻开 => 盖牌数分别为5和4
             cover_count = 5 if i < 4 else 4
@@ -103,37 +130,63 @@ def live_test():
                 columns[i].append({"val": -1, "suit": 0, "face_up": False})
             columns[i].append({"val": val, "suit": 0, "face_up": True})
     # 单花色蜘蛛：通常总共 5 次发牌
-    deals_left = int(
-        input("还剩几次可以发牌？(单花色通常=5，已发过就减；默认5): ").strip() or "5"
-    )
+    while True:
+        s = input("还剩几次可以发牌？(单花色通常=5，已发过就减；默认5): ").strip() or "5"
+        if s.isdigit() and 0 <= int(s) <= 5:
+            deals_left = int(s)
+            break
+        print("⚠️ 剩余发牌次数只能是 0-5。")
 
     temp_env = SpiderEnv()
-    temp_env.columns = columns
+    # 规划模式：用策略网络做先验 / 估值的 MCTS，每步最多想 plan_ms 毫秒
+    planner = MCTSPlanner(evaluate, budget_ms=plan_ms) if plan_ms else None
+
+    def decide(env):
+        if planner is not None:
+            return planner.plan(env)
+        if belief:
+            # 记牌模式：按剩余牌数随机补全盖牌和牌堆 belief 次，选期望回报最高的动作
+            try:
+                return best_action(env, evaluate, belief, belief_depth)
+            except ValueError:
+                # 输入的牌数对不上整副牌时退回直接用策略
+                pass
+        action, _ = model.predict(env._get_obs(copy=True), action_masks=env.action_masks(), deterministic=True)
+        return int(action)
+
+    # 等你输入翻开的牌时，后台线程先把每种可能点数下的推荐动作算好
+    speculator = Speculator(decide)
+    # 记录模式：每一步的局面、掩码和 AI 的动作写进轨迹文件（真实牌局不知道奖励，记 0）
+    if writer is not None:
+        writer.begin_episode()
 
     while True:
         print("\n" + "-" * 60)
         print_top(columns)
 
-        # 构建观察并拿 mask
-        obs = build_obs(columns)
-        temp_env.columns = columns
+        # 把真实牌局载入环境，观察与 mask 都由环境给出
+        # （剩余发牌次数为 0 或有空列时，环境自己会禁掉发牌）
+        try:
+            temp_env.set_state(columns, deals_left)
+        except ValueError as e:
+            # 多半是某张牌输错了：提示后回到修正顶牌，已经输入的牌局不丢
+            print(f"⚠️ 当前牌局不合法：{e}")
+            if not fix_column(columns):
+                break
+            continue
         action_masks = temp_env.action_masks()
 
-        # 1) 先按真实游戏状态修正“发牌是否可用”
-        if deals_left <= 0:
-            action_masks[100] = False
-
-        # （可选）空列禁发：更贴近很多蜘蛛版本
-        if any(len(col) == 0 for col in columns):
-            action_masks[100] = False
-
-        # 2) 修正后再判断是否死局
+        # 1) 判断是否死局
         if not any(action_masks):
             print("🟥 当前没有任何合法动作（也无法发牌）—— 判定为死局 / Game Over.")
             break
 
-        # 3) 最后再让模型预测
-        action, _ = model.predict(obs, action_masks=action_masks, deterministic=True)
+        # 2) 再让模型预测（规划模式下由 MCTS 决定）；后台已经算好这个局面时直接用
+        action = speculator.take(temp_env.state_key)
+        if action is None:
+            action = decide(temp_env)
+        if writer is not None:
+            writer.record(temp_env, int(action), 0.0, action_masks)
 
         # 发牌
         if action == 100:
@@ -142,7 +195,7 @@ def live_test():
             print(f"✅ 发牌完成，剩余发牌次数: {deals_left}")
 
             for i in range(10):
-                new_v = require_int(f"第 {i} 列发出的新牌点数: ")
+                new_v = require_int(f"第 {i} 列发出的新牌点数: ", 1, 13)
                 columns[i].append({"val": new_v, "suit": 0, "face_up": True})
 
             # 发牌后也可能立刻形成 A-K（少见但可处理）
@@ -151,14 +204,13 @@ def live_test():
                 if removed:
                     print(f"✅ 第 {i} 列完成 A-K 序列，已自动收走 13 张。")
                     if flipped:
-                        v = require_int(f"第 {i} 列收走后翻开了新牌，请输入点数: ")
+                        v = require_int(f"第 {i} 列收走后翻开了新牌，请输入点数: ", 1, 13)
                         columns[i][-1] = {"val": v, "suit": 0, "face_up": True}
             continue
 
         # 移动动作
         src, dest = action // 10, action % 10
-        temp_env.columns = columns
-        is_valid, movable_seq = temp_env._check_move(src, dest)
+        is_valid, num_to_move = temp_env._check_move(src, dest)
 
         if not is_valid:
             print("\n⚠️ AI 给了非法动作（理论上不该发生，除非内存不同步）。")
@@ -166,7 +218,7 @@ def live_test():
             if cmd == "q":
                 break
             if cmd == "s":
-                v = require_int(f"请手动输入 第 {src} 列当前顶牌点数(0=空): ")
+                v = require_int(f"请手动输入 第 {src} 列当前顶牌点数(0=空): ", 0, 13)
                 if v == 0:
                     columns[src] = []
                 else:
@@ -176,7 +228,7 @@ def live_test():
                         columns[src].append({"val": v, "suit": 0, "face_up": True})
             continue
 
-        num_to_move = len(movable_seq)
+        movable_seq = columns[src][-num_to_move:]
         head_val = movable_seq[0]["val"] if movable_seq else -1
         print(f"\n>>> AI 指令：将 第{src}列 从 [{translate(head_val)}] 开始的 {num_to_move} 张牌 移到 第{dest}列")
 
@@ -184,11 +236,11 @@ def live_test():
         columns[src] = columns[src][:-num_to_move]
         columns[dest].extend(movable_seq)
 
-        # 2) 源列翻牌同步：若源列顶部现在是盖牌，真实游戏会翻开，需要你输入点数
+        # 2) 源列翻牌同步：若源列顶部现在是盖牌，真实游戏会翻开，点数稍后由你输入
+        reveal_cols = []
         if columns[src] and not columns[src][-1]["face_up"]:
             columns[src][-1]["face_up"] = True
-            v = require_int(f"第 {src} 列翻开了新牌，请输入点数: ")
-            columns[src][-1] = {"val": v, "suit": 0, "face_up": True}
+            reveal_cols.append(src)
         elif not columns[src]:
             print(f"ℹ️ 第 {src} 列已空。")
 
@@ -198,25 +250,31 @@ def live_test():
             if removed:
                 print(f"✅ 第 {dest} 列完成 A-K 序列，已自动收走 13 张。")
                 if flipped:
-                    v = require_int(f"第 {dest} 列收走后翻开了新牌，请输入点数: ")
-                    columns[dest][-1] = {"val": v, "suit": 0, "face_up": True}
+                    reveal_cols.append(dest)
 
-        # 4) 允许你可选地“纠正”源列顶牌（有些情况下你操作时可能发生叠放/自动变化）
-        fix = input("如需手动修正某列顶牌，输入列号(0-9)，否则回车继续；q退出: ").strip().lower()
-        if fix == "q":
+        # 4) 输入翻开的牌（后台同时在按每种可能的点数预先推演下一步）
+        speculator.start(columns, deals_left, reveal_cols)
+        for col_idx in reveal_cols:
+            what = "翻开了新牌" if col_idx == src else "收走后翻开了新牌"
+            v = require_int(f"第 {col_idx} 列{what}，请输入点数: ", 1, 13)
+            columns[col_idx][-1] = {"val": v, "suit": 0, "face_up": True}
+
+        # 5) 允许你可选地“纠正”源列顶牌（有些情况下你操作时可能发生叠放/自动变化）
+        if not fix_column(columns):
             break
-        if fix.isdigit():
-            idx = int(fix)
-            if 0 <= idx <= 9:
-                v = require_int(f"请输入 第 {idx} 列当前顶牌点数(0=空): ")
-                if v == 0:
-                    columns[idx] = []
-                else:
-                    if columns[idx]:
-                        columns[idx][-1] = {"val": v, "suit": 0, "face_up": True}
-                    else:
-                        columns[idx].append({"val": v, "suit": 0, "face_up": True})
 
 
 if __name__ == "__main__":
-    live_test()
+    parser = argparse.ArgumentParser(description="Marcuspider 实时助手")
+    parser.add_argument("--plan-ms", type=int, default=None, help="开启 MCTS 规划，每步的思考时间（毫秒）")
+    parser.add_argument("--npz", default=None, help="numpy_policy.py 导出的权重，给定时不加载 torch")
+    parser.add_argument("--record", default=None, help="把本局每一步追加写进这个轨迹文件")
+    parser.add_argument("--belief", type=int, default=None, help="记牌模式：每步对盖牌 / 牌堆随机补全的次数")
+    parser.add_argument("--belief-depth", type=int, default=3, help="记牌模式下每种补全再按策略推演的步数")
+    args = parser.parse_args()
+    writer = TrajectoryWriter(args.record) if args.record else None
+    try:
+        live_test(args.plan_ms, args.npz, writer, args.belief, args.belief_depth)
+    finally:
+        if writer is not None:
+            writer.close()
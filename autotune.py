@@ -0,0 +1,183 @@
+"""
+train.py 吞吐自动调参
+
+在本机上用 train.py 同款 MaskablePPO 做一系列短时试跑，每次只跑一两轮 rollout + update，
+测 rollout 的 env steps/s 和一次 update 的耗时，把最快的组合写成配置文件交给 train.py --config。
+
+分两段搜索，避免把所有组合的乘积都跑一遍：
+1. 向量环境后端 × 环境数：用短 rollout 只比 rollout 吞吐（env 推进 + 策略前向都随环境数变化）
+2. 固定第 1 段的最佳后端与环境数，再比 rollout 长度 × minibatch 大小，按 rollout + update 的整体吞吐排序
+
+没有可用的 GPU 时自动在 CPU 上试跑，写出的配置里 device 也是 cpu。
+
+用法:
+    python autotune.py --out autotune.json
+    python autotune.py --vec-envs dummy shm --n-envs 8 16 32 --n-steps 1024 2048 --batch-sizes 512 1024
+    python train.py --config autotune.json
+"""
+import argparse
+import json
+import platform
+import time
+
+import torch
+from stable_baselines3.common.callbacks import BaseCallback
+
+import train
+
+# train.py 当前的默认设置，作为对照
+BASELINE = dict(vec_env="dummy", n_envs=8, n_steps=4096, batch_size=1024)
+
+
+class _IterationTimer(BaseCallback):
+    """记录每轮 rollout 的用时，两轮 rollout 之间的间隔就是 update 的用时"""
+
+    def __init__(self):
+        super().__init__()
+        self.rollouts = []
+        self.updates = []
+        self._rollout_start = None
+        self._rollout_end = None
+
+    def _on_rollout_start(self):
+        now = time.perf_counter()
+        if self._rollout_end is not None:
+            self.updates.append(now - self._rollout_end)
+        self._rollout_start = now
+
+    def _on_rollout_end(self):
+        self._rollout_end = time.perf_counter()
+        self.rollouts.append(self._rollout_end - self._rollout_start)
+
+    def _on_step(self):
+        return True
+
+    def _on_training_end(self):
+        # 最后一轮 update 之后不会再有 rollout 开始
+        self.updates.append(time.perf_counter() - self._rollout_end)
+
+
+def run_trial(vec_env, n_envs, n_steps, batch_size, device, workers=None, iterations=2, num_suits=1):
+    """
+    按给定设置建环境和模型，跑 iterations 轮 rollout + update，返回测量结果
+    多于一轮时丢掉第一轮（包含进程启动、内存分配等一次性开销）
+    """
+    args = argparse.Namespace(vec_env=vec_env, n_envs=n_envs, workers=workers, n_steps=n_steps,
+                              batch_size=batch_size, device=device, repeat_penalty=0.0, stall_limit=None,
+                              obs_mode="full", profile_env=False, record_dir=None, corpus=None, curriculum=None,
+                              macro=None, features="mlp", num_suits=num_suits)
+    env = train.build_env(args)
+    try:
+        model = train.build_model(args, env, verbose=0, tensorboard_log=None, seed=0)
+        timer = _IterationTimer()
+        model.learn(total_timesteps=n_envs * n_steps * iterations, callback=timer)
+    finally:
+        env.close()
+    skip = 1 if iterations > 1 else 0
+    rollout = sum(timer.rollouts[skip:]) / len(timer.rollouts[skip:])
+    update = sum(timer.updates[skip:]) / len(timer.updates[skip:])
+    steps = n_envs * n_steps
+    return {
+        "vec_env": vec_env,
+        "n_envs": n_envs,
+        "n_steps": n_steps,
+        "batch_size": batch_size,
+        "rollout_steps_per_sec": steps / rollout,
+        "update_sec": update,
+        "steps_per_sec": steps / (rollout + update),
+    }
+
+
+def _print_trial(result):
+    print(f"{result['vec_env']:<6} n_envs={result['n_envs']:<4} n_steps={result['n_steps']:<5} "
+          f"batch={result['batch_size']:<5} rollout {result['rollout_steps_per_sec']:>8.0f} steps/s  "
+          f"update {result['update_sec']:>6.2f}s  整体 {result['steps_per_sec']:>8.0f} steps/s")
+
+
+def autotune(vec_envs, n_envs_grid, n_steps_grid, batch_sizes, device, workers=None,
+             probe_steps=256, max_rollout=131072, iterations=2, compare_baseline=True, num_suits=1):
+    """两段搜索，返回 (最佳配置, 最佳那次试跑, 全部试跑结果, 对照组结果)"""
+    trials = []
+
+    def trial(vec_env, n_envs, n_steps, batch_size):
+        try:
+            result = run_trial(vec_env, n_envs, n_steps, batch_size, device, workers, iterations, num_suits)
+        except Exception as e:
+            # 某个后端在这台机器上跑不起来（比如进程数受限）不影响其它组合
+            print(f"{vec_env:<6} n_envs={n_envs:<4} 试跑失败: {e}")
+            return None
+        _print_trial(result)
+        trials.append(result)
+        return result
+
+    print("== 第 1 段：向量环境后端 × 环境数（只看 rollout 吞吐）")
+    stage1 = [r for r in (trial(v, n, probe_steps, min(batch_sizes)) for v in vec_envs for n in n_envs_grid) if r]
+    if not stage1:
+        raise RuntimeError("所有后端都试跑失败")
+    best_env = max(stage1, key=lambda r: r["rollout_steps_per_sec"])
+
+    print(f"\n== 第 2 段：{best_env['vec_env']} × {best_env['n_envs']} 个环境，rollout 长度 × minibatch")
+    stage2 = []
+    for n_steps in n_steps_grid:
+        rollout = best_env["n_envs"] * n_steps
+        for batch_size in batch_sizes:
+            if rollout > max_rollout or batch_size > rollout or rollout % batch_size:
+                continue
+            result = trial(best_env["vec_env"], best_env["n_envs"], n_steps, batch_size)
+            if result:
+                stage2.append(result)
+    best = max(stage2 or stage1, key=lambda r: r["steps_per_sec"])
+
+    baseline = None
+    if compare_baseline:
+        print("\n== 对照：train.py 原默认设置")
+        baseline = trial(**BASELINE)
+
+    config = {key: best[key] for key in ("vec_env", "n_envs", "n_steps", "batch_size")}
+    config["device"] = device
+    config["num_suits"] = num_suits
+    if best["vec_env"] == "shm":
+        config["workers"] = workers
+    return config, best, trials, baseline
+
+
+def main():
+    parser = argparse.ArgumentParser(description="为 train.py 自动选择吞吐最高的并行 / rollout 设置")
+    parser.add_argument("--out", default="autotune.json")
+    parser.add_argument("--vec-envs", nargs="+", choices=["dummy", "native", "shm"], default=["dummy", "shm", "native"])
+    parser.add_argument("--n-envs", type=int, nargs="+", default=[4, 8, 16, 32])
+    parser.add_argument("--n-steps", type=int, nargs="+", default=[512, 1024, 2048, 4096])
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[256, 512, 1024, 2048])
+    parser.add_argument("--workers", type=int, default=None, help="shm 模式的工作进程数，默认为 CPU 核数")
+    parser.add_argument("--device", default="auto", help="auto / cpu / cuda；没有 GPU 时自动用 CPU")
+    parser.add_argument("--probe-steps", type=int, default=256, help="第 1 段每个环境的 rollout 长度")
+    parser.add_argument("--max-rollout", type=int, default=131072, help="第 2 段单轮 rollout 的最大总步数")
+    parser.add_argument("--iterations", type=int, default=2, help="每次试跑的 rollout + update 轮数")
+    parser.add_argument("--no-baseline", action="store_true", help="不试跑 train.py 原默认设置做对照")
+    parser.add_argument("--num-suits", type=int, choices=(1, 2, 4), default=1, help="试跑用的花色数，与训练时一致")
+    args = parser.parse_args()
+
+    device = train.resolve_device(args.device)
+    print(f"试跑设备: {device}\n")
+    config, best, trials, baseline = autotune(args.vec_envs, args.n_envs, args.n_steps, args.batch_sizes, device,
+                                              args.workers, args.probe_steps, args.max_rollout, args.iterations,
+                                              not args.no_baseline, args.num_suits)
+    meta = {
+        "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "machine": platform.platform(),
+        "torch": torch.__version__,
+        "cuda": torch.cuda.get_device_name(0) if device.startswith("cuda") else None,
+    }
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump({"meta": meta, "config": config, "baseline": baseline, "trials": trials},
+                  f, indent=2, ensure_ascii=False)
+
+    print(f"\n最佳配置: {config}")
+    if baseline:
+        print(f"整体吞吐 {best['steps_per_sec']:.0f} steps/s，原默认设置 {baseline['steps_per_sec']:.0f} steps/s "
+              f"({best['steps_per_sec'] / baseline['steps_per_sec']:.2f}x)")
+    print(f"已写入 {args.out}，用 python train.py --config {args.out} 开始训练")
+
+
+if __name__ == "__main__":
+    main()
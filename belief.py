@@ -0,0 +1,191 @@
+"""
+记牌与随机补全（determinization）
+
+实时助手只看得到正面牌，盖牌和牌堆在环境里都是 0 占位。但整副牌的构成是固定的
+（单花色每种点数正好 8 张），露面的牌越多，剩下的牌就越确定：
+- BeliefState 从局面数出还没露面的牌（多重集合），以及它们可能在的位置（各列盖牌 + 牌堆）
+- sample 一次抽出成千上万种与已知信息一致的补全，都是 NumPy 数组
+- expected_values 在这些补全上批量推演每个候选动作（走一步，可选再按策略走几步），
+  用价值网络估值后取平均，得到每个动作的期望结果，而不是只看占位牌下的一次估值
+
+用法:
+    belief = BeliefState.from_env(env)
+    hidden_cards, stock = belief.sample(4096)
+    values = expected_values(env, evaluate, num_samples=256)   # {动作: (均值, 标准差)}
+"""
+import numpy as np
+
+from cards import SUIT_SHIFT, standard_deck
+from logic import _CARD_KEYS, MAX_DEPTH
+from planner import move_reward
+
+_SLOTS = np.arange(MAX_DEPTH)
+
+
+class BeliefState:
+    """
+    unseen[b] 是卡牌字节 b 还有几张没露面；这些牌按列序填满各列的盖牌（从底到顶），剩下的是牌堆
+    """
+
+    def __init__(self, unseen, hidden, deck_size):
+        self.unseen = np.asarray(unseen)
+        self.hidden = list(hidden)
+        self.deck_size = deck_size
+        self.pool = np.repeat(np.arange(_CARD_KEYS, dtype=np.int8), self.unseen)
+        if len(self.pool) != sum(self.hidden) + deck_size:
+            raise ValueError(f"没露面的牌有 {len(self.pool)} 张，未知位置有 {sum(self.hidden) + deck_size} 个")
+
+    @classmethod
+    def from_env(cls, env, completed_suits=None):
+        """
+        从 env 的正面牌推出信念（盖牌与牌堆的真实内容一概不看）
+        已收走的套数由总张数推出；多花色时收走的是哪个花色需要通过 completed_suits 给出
+        """
+        counts = np.bincount(standard_deck(env.num_suits), minlength=_CARD_KEYS)
+        for i in range(10):
+            counts -= np.bincount(env.cards[i, env.hidden[i]:env.lengths[i]], minlength=_CARD_KEYS)
+        removed = 104 - sum(env.lengths) - env.deck_size
+        if removed % 13:
+            raise ValueError(f"桌面和牌堆共缺 {removed} 张，不是整套 K-A 的倍数")
+        if completed_suits is None:
+            if env.num_suits != 1 and removed:
+                raise ValueError("多花色时需要给出已收走各套的花色")
+            completed_suits = [0] * (removed // 13)
+        if len(completed_suits) != removed // 13:
+            raise ValueError(f"已收走 {removed // 13} 套，给出了 {len(completed_suits)} 个花色")
+        for suit in completed_suits:
+            counts[np.arange(1, 14) | (suit << SUIT_SHIFT)] -= 1
+        if (counts < 0).any():
+            raise ValueError("露面的牌超出了整副牌的张数")
+        return cls(counts, env.hidden, env.deck_size)
+
+    def reveal_probabilities(self):
+        """下一张翻开的牌是各卡牌字节的概率"""
+        return self.unseen / max(self.unseen.sum(), 1)
+
+    def sample(self, n, rng=None):
+        """
+        抽 n 种一致的补全：返回 (hidden_cards, stock)
+        hidden_cards 形状 (n, 盖牌总数)，按列序、每列从底到顶；stock 形状 (n, 牌堆张数)
+        """
+        rng = rng or np.random.default_rng()
+        draws = rng.permuted(np.tile(self.pool, (n, 1)), axis=1)
+        split = sum(self.hidden)
+        return draws[:, :split], draws[:, split:]
+
+
+def determinize(env, hidden_cards, stock):
+    """把一种补全写进 env：各列盖牌换成 hidden_cards，牌堆换成 stock"""
+    env.cards[_SLOTS < np.array(env.hidden)[:, None]] = hidden_cards
+    # 牌堆整体替换而不原地修改：snapshot 里引用的旧牌堆保持不变
+    deck = np.zeros(104, dtype=np.int8)
+    deck[:env.deck_size] = stock
+    env.deck = deck
+    env._hash = env._compute_hash()
+    env._obs_dirty = [0] * 10
+
+
+def _won(env):
+    return env.deck_size == 0 and not any(env.lengths)
+
+
+def expected_values(env, evaluate, num_samples=256, rollout_steps=0, gamma=0.99, rng=None, belief=None):
+    """
+    每个合法动作在 num_samples 种补全下的期望回报，返回 {动作: (均值, 标准差)}
+    - 回报 = 这一步的奖励 + 之后 rollout_steps 步按策略先验取最大的动作的折扣奖励 + 折扣后的价值估计
+    - evaluate(obs, masks) -> (priors, values)，与 planner 相同，所有补全的局面攒成一批调用
+    - 不翻牌、不发牌的动作结果与补全无关，rollout_steps=0 时只算一次
+    env 在返回前恢复原状
+    """
+    belief = belief or BeliefState.from_env(env)
+    hidden_cards, stock = belief.sample(num_samples, rng)
+    legal = np.flatnonzero(env.action_masks()).tolist()
+    blob = env.snapshot()
+
+    returns = np.zeros((len(legal), num_samples))
+    # 每条还在推演的线：(动作下标, 补全下标, 局面快照, 观察, 掩码)
+    live = []
+    shared = set()
+    for s in range(num_samples):
+        determinize(env, hidden_cards[s], stock[s])
+        for k, action in enumerate(legal):
+            if k in shared:
+                continue
+            dest_len = env.lengths[action % 10] if action < 100 else 0
+            undo = env.make_move(action)
+            returns[k, s] = move_reward(env, undo, dest_len)
+            if rollout_steps == 0 and action != 100 and not (undo[2] or undo[4]):
+                # 没有翻开任何未知的牌：所有补全下都一样
+                shared.add(k)
+            mask = env.action_masks()
+            if not _won(env) and mask.any():
+                live.append((k, s, env.snapshot(), env._get_obs(copy=True), mask))
+            env.unmake_move(undo)
+
+    discount = gamma
+    for _ in range(rollout_steps):
+        if not live:
+            break
+        priors, _ = evaluate(np.stack([x[3] for x in live]), np.stack([x[4] for x in live]))
+        still = []
+        for (k, s, state, _, _), p in zip(live, priors):
+            env.restore(state)
+            action = int(np.argmax(p))
+            dest_len = env.lengths[action % 10] if action < 100 else 0
+            undo = env.make_move(action)
+            returns[k, s] += discount * move_reward(env, undo, dest_len)
+            mask = env.action_masks()
+            if not _won(env) and mask.any():
+                still.append((k, s, env.snapshot(), env._get_obs(copy=True), mask))
+        live = still
+        discount *= gamma
+
+    if live:
+        _, values = evaluate(np.stack([x[3] for x in live]), np.stack([x[4] for x in live]))
+        for (k, s, _, _, _), v in zip(live, values):
+            returns[k, s] += discount * v
+    env.restore(blob)
+
+    result = {}
+    for k, action in enumerate(legal):
+        row = returns[k, :1] if k in shared else returns[k]
+        result[action] = (float(row.mean()), float(row.std()))
+    return result
+
+
+def best_action(env, evaluate, num_samples=256, rollout_steps=0, rng=None):
+    """期望回报最高的动作（没有合法动作时返回 None）"""
+    values = expected_values(env, evaluate, num_samples, rollout_steps, rng=rng)
+    if not values:
+        return None
+    return max(values, key=lambda a: values[a][0])
+
+
+if __name__ == "__main__":
+    from logic import SpiderEnv, decode_variable, encode_variable
+    from recorder import tokens_to_columns
+
+    # 抽样是否与真实牌局一致：把真实对局的正面信息抹成未知，再看补全里每种牌的张数
+    env = SpiderEnv()
+    env.reset(seed=0)
+    rng = np.random.default_rng(0)
+    for _ in range(40):
+        legal = np.flatnonzero(env.action_masks())
+        env.step(int(rng.choice(legal)))
+    cards, lengths, hidden = decode_variable(encode_variable(env.cards, env.lengths, env.hidden))
+    view = SpiderEnv()
+    view.set_state(tokens_to_columns(cards, lengths, hidden), env.deck_size // 10)
+    belief = BeliefState.from_env(view)
+    hidden_cards, stock = belief.sample(5000, rng)
+    full = np.concatenate([hidden_cards, stock], axis=1)
+    assert (np.apply_along_axis(np.bincount, 1, full, minlength=_CARD_KEYS) == belief.unseen).all()
+    print(f"未知位置 {full.shape[1]} 个，抽样 {len(full)} 种补全，每种都与剩余牌数一致")
+
+    def uniform(obs, masks):
+        return masks / masks.sum(axis=1, keepdims=True), np.zeros(len(obs))
+
+    before = view.state_key
+    values = expected_values(view, uniform, num_samples=64, rollout_steps=3, rng=rng)
+    assert view.state_key == before
+    for action, (mean, std) in sorted(values.items(), key=lambda kv: -kv[1][0]):
+        print(f"动作 {action:>3}: 期望 {mean:8.2f}  标准差 {std:7.2f}")
@@ -0,0 +1,241 @@
+"""
+SpiderEnv 性能基准
+
+在固定的一组种子牌局（或语料中固定的 deal id）上测量：
+- 微基准：reset / step / action_masks / _check_move / _get_obs / encode_obs 的单次耗时
+- 整局：随机合法走法的 games/sec、env steps/sec
+- 端到端：train.py 同款 MaskablePPO（CPU）rollout + update 的吞吐
+
+结果写成 JSON，传 --compare 旧结果即可逐项对比，变慢超过阈值时以非零状态退出。
+
+用法:
+    python bench.py --out bench.json
+    python bench.py --out new.json --compare bench.json --threshold 0.1
+    python bench.py --corpus deals.npy
+"""
+import argparse
+import json
+import platform
+import subprocess
+import time
+
+import numpy as np
+
+import logic
+
+# 种子同时作为语料模式下的 deal id
+SEEDS = list(range(32))
+MAX_GAME_STEPS = 1000
+
+
+def _seeded_reset(env, seed):
+    if env.deal_corpus is not None:
+        return env.reset(seed=seed, options={"deal_id": seed})
+    return env.reset(seed=seed)
+
+
+def _record_games(env, seeds):
+    """在每个种子牌局上用固定随机数走随机合法步，记录动作序列"""
+    games = []
+    for seed in seeds:
+        _seeded_reset(env, seed)
+        rng = np.random.default_rng(seed)
+        actions = []
+        for _ in range(MAX_GAME_STEPS):
+            legal = np.flatnonzero(env.action_masks())
+            if len(legal) == 0:
+                break
+            action = int(rng.choice(legal))
+            actions.append(action)
+            _, _, terminated, truncated, _ = env.step(action)
+            if terminated or truncated:
+                break
+        games.append((seed, actions))
+    return games
+
+
+def _replay(env, games, on_state=None):
+    """重放录好的对局，返回 step 的总耗时与步数；on_state 在每个局面上被调用"""
+    elapsed, steps = 0.0, 0
+    for seed, actions in games:
+        _seeded_reset(env, seed)
+        for action in actions:
+            if on_state is not None:
+                on_state(env)
+            start = time.perf_counter()
+            env.step(action)
+            elapsed += time.perf_counter() - start
+            steps += 1
+    return elapsed, steps
+
+
+def bench_reset(env, seeds):
+    start = time.perf_counter()
+    for seed in seeds:
+        _seeded_reset(env, seed)
+    return (time.perf_counter() - start) / len(seeds) * 1e6
+
+
+def bench_step(env, games):
+    elapsed, steps = _replay(env, games)
+    return elapsed / steps * 1e6
+
+
+def _per_state(env, games, fn, reps):
+    """在对局经过的每个局面上重复调用 fn，返回单次平均耗时 (us)"""
+    total = [0.0, 0]
+
+    def on_state(e):
+        start = time.perf_counter()
+        for _ in range(reps):
+            fn(e)
+        total[0] += time.perf_counter() - start
+        total[1] += reps
+
+    _replay(env, games, on_state)
+    return total[0] / total[1] * 1e6
+
+
+def _check_all_pairs(env):
+    for src in range(10):
+        for dest in range(10):
+            env._check_move(src, dest)
+
+
+def bench_games(env, seeds):
+    """随机合法走法打完整局（无路可走、获胜或截断为止）"""
+    start = time.perf_counter()
+    steps = 0
+    for seed in seeds:
+        _seeded_reset(env, seed)
+        rng = np.random.default_rng(seed)
+        for _ in range(MAX_GAME_STEPS):
+            legal = np.flatnonzero(env.action_masks())
+            if len(legal) == 0:
+                break
+            _, _, terminated, truncated, _ = env.step(int(rng.choice(legal)))
+            steps += 1
+            if terminated or truncated:
+                break
+    elapsed = time.perf_counter() - start
+    return len(seeds) / elapsed, steps / elapsed
+
+
+def bench_ppo(total_timesteps, n_envs=8, n_steps=256):
+    """train.py 同款网络与超参（缩短 rollout），在 CPU 上测 rollout + update 吞吐"""
+    import torch
+    from sb3_contrib import MaskablePPO
+    from stable_baselines3.common.env_util import make_vec_env
+
+    torch.manual_seed(0)
+    env = make_vec_env(logic.SpiderEnv, n_envs=n_envs, seed=0)
+    model = MaskablePPO(
+        "MlpPolicy",
+        env,
+        device="cpu",
+        learning_rate=2e-4,
+        n_steps=n_steps,
+        batch_size=1024,
+        ent_coef=0.01,
+        policy_kwargs=dict(net_arch=[256, 256, 256]),
+        seed=0,
+        verbose=0,
+    )
+    start = time.perf_counter()
+    model.learn(total_timesteps=total_timesteps)
+    elapsed = time.perf_counter() - start
+    env.close()
+    return model.num_timesteps / elapsed
+
+
+def run(args):
+    env = logic.SpiderEnv(deal_corpus=args.corpus)
+    games = _record_games(env, SEEDS)
+    results = {}
+
+    def record(name, value, unit, higher_is_better):
+        results[name] = {"value": value, "unit": unit, "higher_is_better": higher_is_better}
+        print(f"{name:<24} {value:>14.3f} {unit}")
+
+    def median(fn):
+        return float(np.median([fn() for _ in range(args.repeat)]))
+
+    record("reset", median(lambda: bench_reset(env, SEEDS)), "us/call", False)
+    record("step", median(lambda: bench_step(env, games)), "us/call", False)
+    record("action_masks", median(lambda: _per_state(env, games, lambda e: e.action_masks(), 5)), "us/call", False)
+    record("check_move_x100", median(lambda: _per_state(env, games, _check_all_pairs, 1)), "us/call", False)
+    record("get_obs", median(lambda: _per_state(env, games, lambda e: e._get_obs(), 5)), "us/call", False)
+    record("encode_obs", median(lambda: _per_state(
+        env, games, lambda e: logic.encode_obs(e.cards, e.lengths, e.hidden), 5)), "us/call", False)
+
+    games_per_sec, steps_per_sec = zip(*[bench_games(env, SEEDS) for _ in range(args.repeat)])
+    record("random_games", float(np.median(games_per_sec)), "games/s", True)
+    record("random_game_steps", float(np.median(steps_per_sec)), "steps/s", True)
+
+    if not args.skip_ppo:
+        record("ppo_cpu", bench_ppo(args.ppo_timesteps), "steps/s", True)
+    return results
+
+
+def _metadata(corpus):
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+                                capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.platform(),
+        "seeds": len(SEEDS),
+        "corpus": corpus,
+    }
+
+
+def compare(results, baseline, threshold):
+    """逐项对比，返回变慢超过阈值的指标"""
+    regressions = []
+    print(f"\n{'metric':<24} {'baseline':>12} {'current':>12} {'change':>9}")
+    for name, cur in results.items():
+        if name not in baseline:
+            continue
+        old = baseline[name]["value"]
+        # 统一成“越大越好”的比例：>1 表示变快
+        speedup = cur["value"] / old if cur["higher_is_better"] else old / cur["value"]
+        flag = ""
+        if speedup < 1 - threshold:
+            flag = "  <-- 变慢"
+            regressions.append(name)
+        print(f"{name:<24} {old:>12.3f} {cur['value']:>12.3f} {speedup:>8.2f}x{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SpiderEnv 性能基准")
+    parser.add_argument("--out", default="bench.json", help="结果 JSON 路径")
+    parser.add_argument("--compare", default=None, help="对比用的旧结果 JSON")
+    parser.add_argument("--threshold", type=float, default=0.10, help="判定变慢的相对阈值")
+    parser.add_argument("--repeat", type=int, default=3, help="每项重复次数（取中位数）")
+    parser.add_argument("--skip-ppo", action="store_true", help="跳过端到端 PPO 基准")
+    parser.add_argument("--corpus", default=None, help="牌局语料路径，给定时按 deal id 取局")
+    parser.add_argument("--ppo-timesteps", type=int, default=8 * 256 * 2)
+    args = parser.parse_args()
+
+    results = run(args)
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump({"meta": _metadata(args.corpus), "results": results}, f, indent=2, ensure_ascii=False)
+    print(f"\n结果已写入 {args.out}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n变慢超过 {args.threshold:.0%} 的指标: {', '.join(regressions)}")
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
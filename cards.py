@@ -0,0 +1,35 @@
+import numpy as np
+
+# 卡牌字节编码：低 4 位是点数(1-13)，高位是花色(suit << 4)，0 表示空位
+# 同花色且点数连续 <=> 字节值相差 1，判定连续序列时可以直接比较字节
+# 四花色时最大字节为 13 | (3 << 4) = 61，放得进 int8
+VAL_MASK = 0x0F
+SUIT_SHIFT = 4
+
+SUIT_SYMBOLS = "♠♥♣♦"
+
+
+def max_card_byte(num_suits):
+    """给定花色数时卡牌字节的最大值（观察空间的上界）"""
+    return 13 | ((num_suits - 1) << SUIT_SHIFT)
+
+
+def standard_deck(num_suits=1):
+    """
+    未洗的一副牌：13 个点数 * 8 组，共 104 张
+    8 组平均分给各花色：单花色 8 组、双花色各 4 组、四花色各 2 组
+    """
+    if num_suits not in (1, 2, 4):
+        raise ValueError(f"num_suits 只能是 1、2 或 4，收到 {num_suits}")
+    suits = np.arange(8, dtype=np.int8) % num_suits
+    return (np.arange(1, 14, dtype=np.int8)[None, :] | (suits[:, None] << SUIT_SHIFT)).reshape(-1)
+
+
+def shuffled_decks(rng, count, num_suits=1):
+    """用给定的 Generator 一次洗出 count 副牌"""
+    return rng.permuted(np.tile(standard_deck(num_suits), (count, 1)), axis=1)
+
+
+def deck_num_suits(deck):
+    """从一副牌里出现的最大花色推断花色数"""
+    return (int(np.max(deck)) >> SUIT_SHIFT) + 1
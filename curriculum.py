@@ -0,0 +1,156 @@
+"""
+牌局难度索引与课程抽局
+
+给牌局语料里的每一局算一个 0-1 的难度分，按从易到难的顺序抽局：
+- 盖牌里压着的 K 越多越难（K 只能挪到空列，压在下面的牌很难翻出来）
+- 开局 10 张正面牌之间可走的叠放越多越容易
+- 随机合法走法试玩几次，平均翻开的盖牌越多越容易（可选，最慢的一项）
+各特征先换算成语料内的分位数（并列取中间分位），再取平均作为难度。
+
+训练时 SpiderEnv(deal_corpus=..., curriculum=索引路径) 只从最容易的 level 比例的牌局里抽，
+train.py 的 CurriculumCallback 根据最近若干局的收牌情况调高 / 调低 level（env_method 下发到每个环境）。
+
+用法:
+    python curriculum.py deals.npy --out deals_difficulty.npz --rollouts 2 --workers 8
+    python train.py --corpus deals.npy --curriculum deals_difficulty.npz
+"""
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from cards import VAL_MASK
+from deals import load_corpus
+
+FEATURES = ("hidden_kings", "initial_moves", "rollout_revealed")
+# 难度随特征值增大的方向：+1 越大越难，-1 越大越容易
+_DIRECTIONS = np.array([1.0, -1.0, -1.0])
+
+
+def _initial_layout():
+    """开局时牌堆位置到 (列, 深度) 的对应：返回盖牌位置与 10 张正面牌的位置（与 SpiderEnv._load_deck 一致）"""
+    hidden, face_up = [], []
+    top = 104
+    for i in range(10):
+        n = 6 if i < 4 else 5
+        # 第 i 列从底到顶依次是 deck[top-1], deck[top-2], ..., deck[top-n]
+        positions = list(range(top - 1, top - n - 1, -1))
+        hidden.extend(positions[:-1])
+        face_up.append(positions[-1])
+        top -= n
+    return np.array(hidden), np.array(face_up)
+
+
+_HIDDEN_POS, _FACE_UP_POS = _initial_layout()
+
+
+def layout_features(decks):
+    """一批牌局 (N, 104) 的静态特征：盖牌中的 K 数、开局可走的叠放数"""
+    values = np.asarray(decks) & VAL_MASK
+    hidden_kings = (values[:, _HIDDEN_POS] == 13).sum(axis=1)
+    tops = values[:, _FACE_UP_POS]
+    # 正面牌 a 能叠到 b 上 <=> b = a + 1（不限花色）
+    initial_moves = (tops[:, :, None] + 1 == tops[:, None, :]).sum(axis=(1, 2))
+    return hidden_kings, initial_moves
+
+
+def rollout_revealed(env, deal_id, rollouts, max_steps, rng):
+    """在 deal_id 这一局上走 rollouts 次随机合法走法，返回平均翻开的盖牌比例"""
+    total = 0.0
+    for _ in range(rollouts):
+        env.reset(options={"deal_id": deal_id})
+        for _ in range(max_steps):
+            legal = np.flatnonzero(env.action_masks())
+            if len(legal) == 0:
+                break
+            _, _, terminated, truncated, _ = env.step(int(rng.choice(legal)))
+            if terminated or truncated:
+                break
+        total += env.episode_stats()["revealed"] / max(env._start_hidden, 1)
+    return total / rollouts
+
+
+def _rollout_chunk(job):
+    corpus, lo, hi, rollouts, max_steps = job
+    from logic import SpiderEnv
+
+    env = SpiderEnv(num_suits=corpus.num_suits, deal_corpus=corpus)
+    rng = np.random.default_rng(lo)
+    return lo, np.array([rollout_revealed(env, k, rollouts, max_steps, rng) for k in range(lo, hi)])
+
+
+def _percentile(x):
+    """语料内的分位数，并列的值取它们的中间分位"""
+    _, inverse, counts = np.unique(x, return_inverse=True, return_counts=True)
+    mid = (np.cumsum(counts) - counts / 2) / len(x)
+    return mid[inverse]
+
+
+def build_index(corpus, rollouts=2, max_steps=100, workers=None, chunk_size=1024):
+    """算出整份语料的特征与难度，返回 (difficulty, features)；rollouts=0 时跳过试玩"""
+    corpus = load_corpus(corpus)
+    n = len(corpus)
+    features = np.zeros((n, len(FEATURES)), dtype=np.float32)
+    for lo in range(0, n, 65536):
+        hi = min(lo + 65536, n)
+        features[lo:hi, 0], features[lo:hi, 1] = layout_features(corpus.decks[lo:hi])
+    if rollouts:
+        jobs = [(corpus, lo, min(lo + chunk_size, n), rollouts, max_steps) for lo in range(0, n, chunk_size)]
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+            for lo, revealed in pool.map(_rollout_chunk, jobs):
+                features[lo:lo + len(revealed), 2] = revealed
+    used = [k for k in range(len(FEATURES)) if rollouts or FEATURES[k] != "rollout_revealed"]
+    # 越难的局在每个特征上的分位越高，取平均
+    scores = [_percentile(features[:, k]) if _DIRECTIONS[k] > 0 else 1 - _percentile(features[:, k]) for k in used]
+    difficulty = np.mean(scores, axis=0).astype(np.float32)
+    return difficulty, features
+
+
+def load_difficulty(path):
+    return np.load(path)["difficulty"]
+
+
+class CurriculumSampler:
+    """
+    按难度从易到难抽 deal id：只在最容易的 level 比例（0-1）的牌局里均匀抽
+    另有 explore 的概率在整份语料里均匀抽，训练早期也能见到难局，后期不会忘掉易局之外的局面
+    """
+
+    def __init__(self, difficulty, level=0.1, explore=0.1):
+        if isinstance(difficulty, str):
+            difficulty = load_difficulty(difficulty)
+        self.order = np.argsort(difficulty, kind="stable")
+        self.level = level
+        self.explore = explore
+
+    def __len__(self):
+        return len(self.order)
+
+    def sample(self, rng):
+        if rng.random() < self.explore:
+            return int(rng.integers(len(self.order)))
+        hi = min(max(int(self.level * len(self.order)), 1), len(self.order))
+        return int(self.order[rng.integers(hi)])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="计算牌局语料的难度索引")
+    parser.add_argument("corpus", help="deals.py 生成的牌局语料")
+    parser.add_argument("--out", default=None, help="默认与语料同名的 _difficulty.npz")
+    parser.add_argument("--rollouts", type=int, default=2, help="每局随机试玩次数（0 表示只用静态特征）")
+    parser.add_argument("--rollout-steps", type=int, default=100, help="每次试玩最多走的步数")
+    parser.add_argument("--workers", type=int, default=None, help="进程数，默认为 CPU 核数")
+    args = parser.parse_args()
+
+    difficulty, features = build_index(args.corpus, args.rollouts, args.rollout_steps, args.workers)
+    out = args.out or args.corpus.removesuffix(".npy") + "_difficulty.npz"
+    np.savez(out, difficulty=difficulty, features=features, feature_names=np.array(FEATURES))
+    print(f"{len(difficulty)} 局的难度索引 -> {out}")
+    for k, name in enumerate(FEATURES):
+        print(f"  {name:<18} 均值 {features[:, k].mean():.3f}  与难度的相关 "
+              f"{np.corrcoef(features[:, k], difficulty)[0, 1] if features[:, k].std() else 0:+.2f}")
+
+
+if __name__ == "__main__":
+    main()
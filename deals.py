@@ -0,0 +1,80 @@
+"""
+预生成的牌局语料
+
+语料是 N 副洗好的牌，形状 (N, 104) 的 int8（卡牌字节编码见 cards.py，花色已打包进字节），
+存成 .npy 后以内存映射方式打开，按 deal id 取牌：几百万局也几乎不占加载时间和内存。
+SpiderEnv / SpiderVecEnv 可以从语料里抽局，也可以通过 reset(options={"deal_id": k}) 指定某一局，
+评估和基准因此能在完全相同的牌局上进行。
+
+用法:
+    python deals.py --out deals.npy --num 1000000 --seed 0
+    python deals.py --out deals_4suit.npy --suits 4
+"""
+import argparse
+
+import numpy as np
+
+from cards import shuffled_decks, deck_num_suits
+
+DECK_SIZE = 104
+
+
+class DealCorpus:
+    """内存映射的牌局语料，corpus[deal_id] 返回一副牌（只读视图）"""
+
+    def __init__(self, path):
+        self.path = path
+        self.decks = np.load(path, mmap_mode="r")
+        if self.decks.dtype != np.int8 or self.decks.ndim != 2 or self.decks.shape[1] != DECK_SIZE:
+            raise ValueError(f"{path} 不是牌局语料：需要 (N, {DECK_SIZE}) 的 int8 数组")
+        self.num_suits = deck_num_suits(self.decks[0]) if len(self.decks) else 1
+
+    def __len__(self):
+        return len(self.decks)
+
+    def __getitem__(self, deal_id):
+        if not 0 <= deal_id < len(self.decks):
+            raise IndexError(f"deal id {deal_id} 超出语料范围 [0, {len(self.decks)})")
+        return self.decks[deal_id]
+
+    def __getstate__(self):
+        # 传给子进程时只带路径，到对面重新映射，不复制整份数据
+        return {"path": self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"])
+
+
+def build_corpus(path, num_deals, seed=0, num_suits=1, chunk_size=65536):
+    """分块洗牌并直接写入内存映射文件，内存占用与语料大小无关"""
+    out = np.lib.format.open_memmap(path, mode="w+", dtype=np.int8, shape=(num_deals, DECK_SIZE))
+    rng = np.random.default_rng(seed)
+    for lo in range(0, num_deals, chunk_size):
+        hi = min(lo + chunk_size, num_deals)
+        out[lo:hi] = shuffled_decks(rng, hi - lo, num_suits)
+    out.flush()
+    del out
+    return DealCorpus(path)
+
+
+def load_corpus(corpus):
+    """接受路径或 DealCorpus，统一返回 DealCorpus（None 原样返回）"""
+    if corpus is None or isinstance(corpus, DealCorpus):
+        return corpus
+    return DealCorpus(corpus)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="生成内存映射的牌局语料")
+    parser.add_argument("--out", default="deals.npy")
+    parser.add_argument("--num", type=int, default=1_000_000, help="牌局数量")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--suits", type=int, choices=[1, 2, 4], default=1)
+    args = parser.parse_args()
+
+    corpus = build_corpus(args.out, args.num, seed=args.seed, num_suits=args.suits)
+    print(f"已生成 {len(corpus)} 局 -> {args.out}")
+
+
+if __name__ == "__main__":
+    main()
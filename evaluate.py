@@ -0,0 +1,265 @@
+"""
+策略评估
+
+在一组固定种子的牌局上用带掩码的策略逐局打完（默认确定性走法），统计胜率、收牌套数、每局步数。
+同一组种子每次发出的牌局都相同，不同检查点的结果可以直接比较。
+
+EvalWorker 把评估放到单独的进程里：训练时每存一个检查点就交给它，
+结果由子进程直接写进同一个 TensorBoard 目录，学习进程的 rollout / update 不受影响。
+
+命令行：一次比较多个检查点（MaskablePPO 的 .zip 或 numpy_policy 导出的 .npz），
+每个检查点在同一组种子牌局上用进程池并行打完，输出胜率、收牌、步数、非法动作数、每秒局数及 95% 置信区间（JSON）。
+    python evaluate.py marcuspider_v1_new.zip marcuspider_v2_final --games 5000 --workers 16 --out eval.json
+    python evaluate.py models/marcuspider_*.zip --games 2000 --stochastic
+"""
+import argparse
+import json
+import multiprocessing as mp
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import logic
+
+
+def play_game(env, policy, seed, deterministic=True):
+    """用 policy（有 predict(obs, action_masks=..., deterministic=...) 即可）打一局，返回本局结果"""
+    if env.deal_corpus is not None:
+        obs, _ = env.reset(seed=seed, options={"deal_id": seed})
+    else:
+        obs, _ = env.reset(seed=seed)
+    won = False
+    total_reward = 0.0
+    illegal = 0
+    while True:
+        masks = env.action_masks()
+        if not masks.any():
+            # 无路可走（不能发牌也没有合法移动），算输
+            break
+        action, _ = policy.predict(obs, action_masks=masks, deterministic=deterministic)
+        # 掩码生效时不该出现；照常交给环境（扣分、计步），只记下次数
+        if not masks[int(action)]:
+            illegal += 1
+        obs, reward, terminated, truncated, _ = env.step(int(action))
+        total_reward += reward
+        if terminated or truncated:
+            won = terminated
+            break
+    result = env.episode_stats()
+    result.update(seed=seed, won=won, reward=total_reward, illegal=illegal)
+    return result
+
+
+def evaluate(policy, seeds, deterministic=True, **env_kwargs):
+    """在每个种子牌局上打一局，返回逐局结果列表；env_kwargs 交给 SpiderEnv（花色、语料、观察编码）"""
+    env = logic.SpiderEnv(**env_kwargs)
+    return [play_game(env, policy, seed, deterministic) for seed in seeds]
+
+
+def wilson_interval(wins, n, z=1.96):
+    """胜率的 Wilson 置信区间（局数少或胜率接近 0 / 1 时也不会越界）"""
+    if n == 0:
+        return 0.0, 0.0
+    p = wins / n
+    center = (p + z * z / (2 * n)) / (1 + z * z / n)
+    half = z * np.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / (1 + z * z / n)
+    return max(float(center - half), 0.0), min(float(center + half), 1.0)
+
+
+def mean_interval(x, z=1.96):
+    """均值的正态近似置信区间"""
+    x = np.asarray(x, dtype=np.float64)
+    half = z * x.std(ddof=1) / np.sqrt(len(x)) if len(x) > 1 else 0.0
+    return float(x.mean() - half), float(x.mean() + half)
+
+
+def summarize(results):
+    """逐局结果汇总成胜率与各项均值，附 95% 置信区间"""
+    wins = sum(r["won"] for r in results)
+    return {
+        "games": len(results),
+        "win_rate": float(np.mean([r["won"] for r in results])),
+        "sequences": float(np.mean([r["sequences"] for r in results])),
+        "steps": float(np.mean([r["steps"] for r in results])),
+        "revealed": float(np.mean([r["revealed"] for r in results])),
+        "reward": float(np.mean([r["reward"] for r in results])),
+        "illegal": int(sum(r.get("illegal", 0) for r in results)),
+        "win_rate_ci": wilson_interval(wins, len(results)),
+        "sequences_ci": mean_interval([r["sequences"] for r in results]),
+        "steps_ci": mean_interval([r["steps"] for r in results]),
+    }
+
+
+def _eval_loop(jobs, log_dir, seeds, env_kwargs):
+    """评估进程：依次取出 (检查点路径, 训练步数) 评估，结果写进 TensorBoard"""
+    import torch
+    from sb3_contrib import MaskablePPO
+
+    # 只占一个核，尽量不和学习进程抢 CPU
+    torch.set_num_threads(1)
+    writer = None
+    if log_dir:
+        from torch.utils.tensorboard import SummaryWriter
+        writer = SummaryWriter(log_dir)
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        model_path, step = job
+        model = MaskablePPO.load(model_path, device="cpu")
+        summary = summarize(evaluate(model, seeds, **env_kwargs))
+        print(f"[eval] {model_path}: 胜率 {summary['win_rate']:.1%}  收牌 {summary['sequences']:.2f}  "
+              f"步数 {summary['steps']:.0f}（{summary['games']} 局）")
+        if writer is not None:
+            for name in ("win_rate", "sequences", "steps", "revealed", "reward"):
+                writer.add_scalar(f"eval/{name}", summary[name], step)
+            writer.flush()
+    if writer is not None:
+        writer.close()
+
+
+class EvalWorker:
+    """
+    后台评估进程：submit 只是把检查点路径放进队列，立即返回
+    多个检查点排队时依次评估；close 等队列里的都评估完再退出
+    """
+
+    def __init__(self, log_dir, seeds, **env_kwargs):
+        # spawn：不把学习进程的 torch / CUDA 状态 fork 进子进程
+        ctx = mp.get_context("spawn")
+        self._jobs = ctx.Queue()
+        self._process = ctx.Process(target=_eval_loop, args=(self._jobs, log_dir, list(seeds), env_kwargs),
+                                    daemon=True)
+        self._process.start()
+
+    def submit(self, model_path, step):
+        self._jobs.put((model_path, step))
+
+    def close(self):
+        self._jobs.put(None)
+        self._process.join()
+
+
+def load_policy(path):
+    """.npz 用纯 NumPy 推理，其余按 MaskablePPO 检查点载入（CPU）"""
+    if path.endswith(".npz"):
+        from numpy_policy import NumpyPolicy
+        return NumpyPolicy.load(path)
+    from sb3_contrib import MaskablePPO
+    return MaskablePPO.load(path, device="cpu")
+
+
+def infer_obs_mode(policy, num_suits=1):
+    """按策略网络的输入维度找出它训练时用的观察编码（各编码的维度互不相同）"""
+    if hasattr(policy, "observation_space"):
+        size = int(np.prod(policy.observation_space.shape))
+    else:
+        size = policy.pi_layers[0][0].shape[0]
+    for mode in logic.OBS_MODES:
+        if int(np.prod(logic.observation_space(mode, num_suits).shape)) == size:
+            return mode
+    raise ValueError(f"策略输入是 {size} 维，和哪种观察编码都对不上")
+
+
+# 进程池里每个工作进程各载入一份策略
+_policy = None
+_obs_mode = None
+
+
+def _init_worker(model_path, num_suits):
+    global _policy, _obs_mode
+    try:
+        import torch
+        # 并行靠多进程，每个进程只用一个线程，避免互相抢核
+        torch.set_num_threads(1)
+    except ImportError:
+        pass
+    _policy = load_policy(model_path)
+    _obs_mode = infer_obs_mode(_policy, num_suits)
+
+
+def _play_chunk(job):
+    seeds, deterministic, env_kwargs = job
+    if not deterministic:
+        # 随机走法也按种子复现：每块用第一个种子设定采样的随机数
+        np.random.seed(seeds[0])
+        try:
+            import torch
+            torch.manual_seed(seeds[0])
+        except ImportError:
+            pass
+    env_kwargs = dict(env_kwargs)
+    if env_kwargs.get("obs_mode") is None:
+        env_kwargs["obs_mode"] = _obs_mode
+    return evaluate(_policy, seeds, deterministic, **env_kwargs)
+
+
+def evaluate_checkpoint(model_path, seeds, deterministic=True, workers=None, chunk_size=50, **env_kwargs):
+    """
+    在进程池里把 seeds 分块打完，返回 (逐局结果, 耗时秒数)
+    env_kwargs 里不给 obs_mode 时按检查点的输入维度自动选
+    """
+    seeds = list(seeds)
+    jobs = [(seeds[i:i + chunk_size], deterministic, env_kwargs) for i in range(0, len(seeds), chunk_size)]
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count(), initializer=_init_worker,
+                             initargs=(model_path, env_kwargs.get("num_suits", 1))) as pool:
+        results = [r for chunk in pool.map(_play_chunk, jobs) for r in chunk]
+    return results, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="在固定种子牌局上并行评估并比较检查点")
+    parser.add_argument("models", nargs="+", help="MaskablePPO 检查点（.zip，可省略扩展名）或 numpy_policy 导出的 .npz")
+    parser.add_argument("--games", type=int, default=1000, help="每个检查点打的局数")
+    parser.add_argument("--seed-start", type=int, default=0, help="种子从这个数开始连续取 --games 个")
+    parser.add_argument("--stochastic", action="store_true", help="按策略分布采样（默认取概率最大的动作）")
+    parser.add_argument("--workers", type=int, default=None, help="进程数，默认为 CPU 核数")
+    parser.add_argument("--chunk-size", type=int, default=50, help="每个任务打的局数")
+    parser.add_argument("--num-suits", type=int, default=1, choices=(1, 2, 4))
+    parser.add_argument("--obs-mode", choices=logic.OBS_MODES, default=None, help="默认按检查点的输入维度自动选")
+    parser.add_argument("--macro", nargs="*", choices=logic.MACRO_RULES, default=None,
+                        help="在 step 里自动走强制 / 占优走法；不跟规则名时启用全部规则")
+    parser.add_argument("--corpus", default=None, help="牌局语料路径，种子即 deal id")
+    parser.add_argument("--out", default=None, help="结果 JSON 的路径，默认只打印")
+    args = parser.parse_args()
+    if args.macro == []:
+        args.macro = logic.MACRO_RULES
+
+    seeds = range(args.seed_start, args.seed_start + args.games)
+    env_kwargs = dict(num_suits=args.num_suits, obs_mode=args.obs_mode, macro=args.macro, deal_corpus=args.corpus)
+    report = {
+        "games": args.games,
+        "seed_start": args.seed_start,
+        "deterministic": not args.stochastic,
+        "env": {k: v for k, v in env_kwargs.items() if v is not None},
+        "checkpoints": {},
+    }
+    for path in args.models:
+        results, seconds = evaluate_checkpoint(path, seeds, not args.stochastic, args.workers, args.chunk_size,
+                                               **env_kwargs)
+        summary = summarize(results)
+        summary.update(seconds=seconds, games_per_sec=len(results) / seconds)
+        report["checkpoints"][path] = summary
+        lo, hi = summary["win_rate_ci"]
+        print(f"{path}: 胜率 {summary['win_rate']:.1%} [{lo:.1%}, {hi:.1%}]  收牌 {summary['sequences']:.2f}  "
+              f"步数 {summary['steps']:.0f}  非法 {summary['illegal']}  {summary['games_per_sec']:.1f} 局/秒")
+
+    if len(args.models) > 1:
+        print("\n按胜率排名（同一组种子，收牌数作为次序）：")
+        ranked = sorted(report["checkpoints"].items(), key=lambda kv: (-kv[1]["win_rate"], -kv[1]["sequences"]))
+        for rank, (path, summary) in enumerate(ranked, 1):
+            print(f"  {rank}. {path}  {summary['win_rate']:.1%}  {summary['sequences']:.2f}")
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
+        print(f"结果 -> {args.out}")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+卡牌嵌入特征提取器
+
+默认的 MlpPolicy 把 600 个 int8 观察当成浮点数直接喂全连接层，牌的身份只能从原始数值里学。
+CardEmbeddingExtractor 换成 SB3 的自定义特征提取器：
+- 观察在 rollout buffer 里保持 int8（SB3 按观察空间的 dtype 存），搬到设备上的是 int8 张量，
+  在设备上才转成牌符号（0 空位，1 盖牌，正面牌为卡牌字节 + 1），与 obs_mode="index" 的编码一致
+- 每个槽位 = 牌符号嵌入 + 深度嵌入；10 列共用同一个列编码器（各列的规则完全相同），
+  再附上列长、盖牌数，按列号顺序拼起来（动作的 src / dest 就是列号，不能打乱）
+后面的策略 / 价值网络缩到 [128, 128]，整个策略的参数约为默认 [256, 256, 256] MLP 的 40%；
+列编码器在 10 列上共享，每一列的经验都在训练同一组权重。
+
+用法:
+    python train.py --features embed                    # full 观察
+    python train.py --features embed --obs-mode index   # 直接用牌符号观察
+"""
+import torch
+from gymnasium import spaces
+from stable_baselines3.common.torch_layers import BaseFeaturesExtractor
+from torch import nn
+
+from logic import OBS_DEPTH, TOKEN_HIDDEN, TOKEN_PAD, TOKEN_SEP
+
+# 支持的观察编码：都是每列 OBS_DEPTH 个槽位
+EMBED_OBS_MODES = ("full", "index")
+
+
+def to_tokens(obs, obs_mode):
+    """(B, 600) 或 (B, 300) 的观察（任意数值类型）转成 (B, 10, OBS_DEPTH) 的牌符号"""
+    obs = obs.long()
+    if obs_mode == "index":
+        return obs.view(-1, 10, OBS_DEPTH)
+    obs = obs.view(-1, 10, OBS_DEPTH, 2)
+    card, face_up = obs[..., 0], obs[..., 1]
+    # 正面牌 -> 卡牌字节 + 1；盖牌的卡牌字节是 -1 -> 1；空位是 0 -> 0
+    return torch.where(face_up > 0, card + 1, -card)
+
+
+class CardEmbeddingExtractor(BaseFeaturesExtractor):
+    """
+    observation_space 是 SpiderEnv 的 full 或 index 观察空间
+    card_dim: 牌符号 / 深度嵌入的维度；column_dim: 每列编码后的维度，输出 10 * column_dim 维特征
+    """
+
+    def __init__(self, observation_space: spaces.Box, obs_mode="full", card_dim=16, column_dim=64):
+        if obs_mode not in EMBED_OBS_MODES:
+            raise ValueError(f"卡牌嵌入只支持 {', '.join(EMBED_OBS_MODES)} 观察，收到 {obs_mode!r}")
+        super().__init__(observation_space, features_dim=10 * column_dim)
+        self.obs_mode = obs_mode
+        self.cards = nn.Embedding(TOKEN_SEP + 1, card_dim, padding_idx=TOKEN_PAD)
+        self.depth = nn.Parameter(torch.zeros(OBS_DEPTH, card_dim))
+        nn.init.normal_(self.depth, std=0.02)
+        # 列编码器：整列槽位展平 + 列长 / 盖牌数两项结构特征
+        self.column = nn.Sequential(
+            nn.Linear(OBS_DEPTH * card_dim + 2, column_dim),
+            nn.ReLU(),
+            nn.Linear(column_dim, column_dim),
+            nn.ReLU(),
+        )
+
+    def forward(self, observations):
+        tokens = to_tokens(observations, self.obs_mode)
+        occupied = tokens != TOKEN_PAD
+        # 空位不加深度嵌入，整列为空时输入全 0
+        slots = self.cards(tokens) + self.depth * occupied.unsqueeze(-1)
+        structure = torch.stack([occupied.sum(-1), (tokens == TOKEN_HIDDEN).sum(-1)], dim=-1) / OBS_DEPTH
+        columns = self.column(torch.cat([slots.flatten(2), structure], dim=-1))
+        return columns.flatten(1)
+
+
+def policy_kwargs(obs_mode, net_arch=(128, 128)):
+    """MaskablePPO 用卡牌嵌入时的 policy_kwargs"""
+    return dict(
+        features_extractor_class=CardEmbeddingExtractor,
+        features_extractor_kwargs=dict(obs_mode=obs_mode),
+        net_arch=list(net_arch),
+    )
+
+
+if __name__ == "__main__":
+    import numpy as np
+
+    from logic import SpiderEnv, encode_index
+
+    # full 观察在设备上转出的牌符号与 index 编码逐位相同
+    env = SpiderEnv()
+    env.reset(seed=0)
+    rng = np.random.default_rng(0)
+    batch = []
+    for _ in range(50):
+        batch.append((env._get_obs(copy=True), encode_index(env.cards, env.lengths, env.hidden)))
+        legal = np.flatnonzero(env.action_masks())
+        if len(legal) == 0:
+            break
+        env.step(int(rng.choice(legal)))
+    full = torch.as_tensor(np.stack([b[0] for b in batch]))
+    index = torch.as_tensor(np.stack([b[1] for b in batch]))
+    assert torch.equal(to_tokens(full, "full"), to_tokens(index, "index"))
+
+    extractor = CardEmbeddingExtractor(env.observation_space)
+    features = extractor(full.float())
+    params = sum(p.numel() for p in extractor.parameters())
+    print(f"{len(batch)} 个局面的牌符号一致；特征 {tuple(features.shape)}，提取器参数 {params}")
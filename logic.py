@@ -1,23 +1,278 @@
 import gymnasium as gym
 from gymnasium import spaces
 import numpy as np
-import random
+
+from cards import VAL_MASK, SUIT_SHIFT, SUIT_SYMBOLS, max_card_byte, standard_deck
+from curriculum import CurriculumSampler
+from deals import load_corpus
+from profiler import PhaseProfiler
+
+# 每列最大深度：104 张牌全叠在一列也放得下
+MAX_DEPTH = 104
+# 观察里每列保留的深度
+OBS_DEPTH = 30
+
+# Zobrist 键表：每个 (列, 深度, 卡牌字节) 的正面牌 / 盖牌各一个随机 64 位键，
+# 牌堆里每个 (位置, 卡牌字节) 一个键；局面哈希是所有在位牌的键异或。
+# 用固定种子生成，同一局面在任何进程、任何一次运行里的哈希都相同。
+# 存成扁平的 Python 列表，按 (列 * MAX_DEPTH + 深度) * _CARD_KEYS + 字节 取键，标量异或比 NumPy 快
+# 卡牌字节 点数 | 花色 << SUIT_SHIFT 的取值范围：4 种花色各占 1 << SUIT_SHIFT 个值
+_CARD_KEYS = 4 << SUIT_SHIFT
+
+
+def _zobrist_tables(seed=0x5B1D3E):
+    rng = np.random.default_rng(seed)
+    up = rng.integers(0, 2**64, size=(10, MAX_DEPTH + 1, _CARD_KEYS), dtype=np.uint64)
+    up[:, MAX_DEPTH] = 0
+    down = rng.integers(0, 2**64, size=(10, MAX_DEPTH, _CARD_KEYS), dtype=np.uint64)
+    stock = rng.integers(0, 2**64, size=(104, _CARD_KEYS), dtype=np.uint64)
+    # 连续序列沿对角线 (深度 +1, 字节 -1) 排布，预先求出对角线上的后缀异或：
+    # run[i, d, c] = up[i, d, c] ^ up[i, d+1, c-1] ^ ...，
+    # 于是从 (d, c) 起长 k 的序列的键 = run[i, d, c] ^ run[i, d+k, c-k]，搬动 / 收牌都是 O(1)
+    run = up.copy()
+    for d in range(MAX_DEPTH - 1, -1, -1):
+        run[:, d, 1:] ^= run[:, d + 1, :-1]
+    return (up[:, :MAX_DEPTH].reshape(-1).tolist(), down.reshape(-1).tolist(),
+            stock.reshape(-1).tolist(), run.reshape(-1).tolist())
+
+
+_Z_UP, _Z_DOWN, _Z_STOCK, _Z_RUN = _zobrist_tables()
+# _Z_RUN 多留一行深度 (MAX_DEPTH) 作为全零的哨兵
+_RUN_STRIDE = (MAX_DEPTH + 1) * _CARD_KEYS
+
+
+def _run_key(col_idx, depth, head, length):
+    """第 col_idx 列从 depth 起、首牌字节为 head 的连续序列的 Zobrist 键"""
+    base = col_idx * _RUN_STRIDE
+    return _Z_RUN[base + depth * _CARD_KEYS + head] ^ _Z_RUN[base + (depth + length) * _CARD_KEYS + head - length]
+
+
+def encode_column(out, cards, length, hidden, start=0, stop=OBS_DEPTH):
+    """
+    把一列牌的 [start, stop) 槽位写进观察切片 out（形状 (OBS_DEPTH, 2)）
+    特征: [卡牌字节(点数 | 花色 << 4，盖牌为 -1), 是否正面]，超出列长的槽位清零
+    单花色时卡牌字节就是点数，与旧观察完全一致
+    """
+    n = min(length, stop)
+    h = min(hidden, n)
+    if start < h:
+        out[start:h, 0] = -1
+        out[start:h, 1] = 0
+    lo = max(start, h)
+    if lo < n:
+        out[lo:n, 0] = cards[lo:n]
+        out[lo:n, 1] = 1
+    hi = max(start, n)
+    if hi < stop:
+        out[hi:stop] = 0
+
+
+def encode_obs(cards, lengths, hidden, out=None):
+    """把紧凑牌局编码成长度 600 的观察向量（SpiderEnv 与验证脚本共用）"""
+    if out is None:
+        out = np.zeros((10, OBS_DEPTH, 2), dtype=np.int8)
+    for i in range(10):
+        encode_column(out[i], cards[i], lengths[i], hidden[i])
+    return out.reshape(-1)
+
+
+# 可选的观察编码（SpiderEnv(obs_mode=...)）：
+# - full: 上面的 10x30x2，默认
+# - compact: 每列一行摘要 + 全局两项，共 62 个数
+# - index: 10x30 的牌符号，可以直接喂 Embedding
+# - variable: 所有牌依次排开、列与列之间插分隔符的 114 个符号，不截断任何一列
+OBS_MODES = ("full", "compact", "index", "variable")
+
+# 牌符号：0 空位，1 盖牌，正面牌为 卡牌字节 + 1，列分隔符取最大卡牌字节之后的下一个值
+TOKEN_PAD = 0
+TOKEN_HIDDEN = 1
+TOKEN_SEP = max_card_byte(4) + 2
+# 每列摘要：列长、盖牌数、列顶序列长度、顶牌字节、序列首牌字节、序列下面那张牌的字节（盖牌 -1，没有 0）
+COMPACT_FEATURES = 6
+COMPACT_SIZE = 10 * COMPACT_FEATURES + 2
+# 104 张牌 + 10 个分隔符
+VARIABLE_SIZE = 104 + 10
+# 宏动作规则（SpiderEnv(macro=...)）：
+# - forced: 只剩一个合法动作
+# - complete: 能凑成 K-A 并收走的叠放
+# - reveal: 把列顶整段序列同花色接到别的列上、翻开下面盖牌的移动（不占空列，叠放也不变差）
+MACRO_RULES = ("forced", "complete", "reveal")
+# 一次 step 里最多自动走的子步数，防止只剩来回两步时在 step 里空转
+MACRO_LIMIT = 100
+_SLOTS = np.arange(MAX_DEPTH + 1)
+_ROWS = np.arange(10)
+
+
+def run_length(row, n, h):
+    """
+    一列牌（卡牌字节 row，列长 n，盖牌数 h）列顶同花色连续递减、全部正面的序列长度
+    卡牌字节是 点数 | 花色 << 4，同花色且点数小 1 <=> 字节正好小 1
+    """
+    if n == 0:
+        return 0
+    j = n - 1
+    prev = row[j]
+    while j > h:
+        card = row[j - 1]
+        if card != prev + 1:
+            break
+        prev = card
+        j -= 1
+    return n - j
+
+
+def encode_compact(cards, lengths, hidden, runs, deck_size):
+    """每列 6 项摘要，再加剩余发牌次数与已收走的套数"""
+    # 先攒成 Python 列表再一次性转成数组，比逐段写 NumPy 切片快
+    values = []
+    for i in range(10):
+        n, h, run = lengths[i], hidden[i], runs[i]
+        if n == 0:
+            values.extend((0,) * COMPACT_FEATURES)
+            continue
+        row = cards[i]
+        rest = n - run
+        under = row[rest - 1] if rest > h else (-1 if rest > 0 else 0)
+        values.extend((n, h, run, row[n - 1], row[rest], under))
+    values.append(deck_size // 10)
+    values.append((104 - sum(lengths) - deck_size) // 13)
+    return np.array(values, dtype=np.int8)
+
+
+def encode_index(cards, lengths, hidden):
+    """每列前 OBS_DEPTH 个槽位的牌符号，形状 (10 * OBS_DEPTH,)"""
+    tokens = cards[:, :OBS_DEPTH] + np.int8(1)
+    tokens[_SLOTS[:OBS_DEPTH] >= np.array(lengths)[:, None]] = TOKEN_PAD
+    tokens[_SLOTS[:OBS_DEPTH] < np.array(hidden)[:, None]] = TOKEN_HIDDEN
+    return tokens.reshape(-1)
+
+
+def encode_variable(cards, lengths, hidden):
+    """按列依次写出全部牌符号，每列后接一个分隔符，末尾补 0 到定长"""
+    # 多留一个槽位放分隔符，按行优先取出“槽位 <= 列长”的格子就是按列排好的序列
+    lengths = np.array(lengths)
+    tokens = np.zeros((10, MAX_DEPTH + 1), dtype=np.int8)
+    tokens[:, :MAX_DEPTH] = cards + np.int8(1)
+    tokens[_SLOTS < np.array(hidden)[:, None]] = TOKEN_HIDDEN
+    tokens[_ROWS, lengths] = TOKEN_SEP
+    sequence = tokens[_SLOTS <= lengths[:, None]]
+    out = np.zeros(VARIABLE_SIZE, dtype=np.int8)
+    out[:len(sequence)] = sequence
+    return out
+
+
+def decode_variable(tokens):
+    """encode_variable 的逆过程：返回 (cards, lengths, hidden)，盖牌的点数未知记为 0"""
+    cards = np.zeros((10, MAX_DEPTH), dtype=np.int8)
+    lengths, hidden = [0] * 10, [0] * 10
+    tokens = np.asarray(tokens)
+    seps = np.flatnonzero(tokens == TOKEN_SEP)
+    start = 0
+    for i, stop in enumerate(seps[:10].tolist()):
+        column = tokens[start:stop]
+        h = int(np.count_nonzero(column == TOKEN_HIDDEN))
+        cards[i, h:len(column)] = column[h:] - 1
+        lengths[i], hidden[i] = len(column), h
+        start = stop + 1
+    return cards, lengths, hidden
+
+
+def observation_space(obs_mode, num_suits=1):
+    """各观察编码对应的观察空间"""
+    if obs_mode == "full":
+        return spaces.Box(low=-1, high=max_card_byte(num_suits), shape=(10 * OBS_DEPTH * 2,), dtype=np.int8)
+    if obs_mode == "compact":
+        return spaces.Box(low=-1, high=104, shape=(COMPACT_SIZE,), dtype=np.int8)
+    if obs_mode == "index":
+        return spaces.Box(low=TOKEN_PAD, high=max_card_byte(num_suits) + 1, shape=(10 * OBS_DEPTH,), dtype=np.int8)
+    if obs_mode == "variable":
+        return spaces.Box(low=TOKEN_PAD, high=TOKEN_SEP, shape=(VARIABLE_SIZE,), dtype=np.int8)
+    raise ValueError(f"obs_mode 只能是 {', '.join(OBS_MODES)} 之一，收到 {obs_mode!r}")
 
 
 class SpiderEnv(gym.Env):
-    def __init__(self, num_suits=1):
+    def __init__(self, num_suits=1, deal_corpus=None, repeat_penalty=0.0, stall_limit=None, obs_mode="full",
+                 profile=False, curriculum=None, macro=None):
         super(SpiderEnv, self).__init__()
 
         self.num_suits = num_suits
+        # 循环检测（默认关闭，奖励与旧版一致）：
+        # - repeat_penalty: 走回本局已出现过的局面时额外扣的分
+        # - stall_limit: 连续这么多步都只走到旧局面时截断对局，不再把步数预算耗在死循环上
+        self.repeat_penalty = repeat_penalty
+        self.stall_limit = stall_limit
+        # 牌局语料（路径或 DealCorpus）：给定后每局从语料中抽取，否则用本环境的随机数洗牌
+        self.deal_corpus = load_corpus(deal_corpus)
+        if self.deal_corpus is not None and self.deal_corpus.num_suits != num_suits:
+            raise ValueError(f"牌局语料是 {self.deal_corpus.num_suits} 花色，环境是 {num_suits} 花色")
+        self.deal_id = None
+        # 课程抽局（难度索引路径或 CurriculumSampler）：只从语料里最容易的一部分牌局抽，比例由 set_curriculum_level 调
+        self.curriculum = None
+        if curriculum is not None:
+            if self.deal_corpus is None:
+                raise ValueError("课程抽局需要先给环境配置 deal_corpus")
+            self.curriculum = curriculum if isinstance(curriculum, CurriculumSampler) else CurriculumSampler(curriculum)
+            if len(self.curriculum) != len(self.deal_corpus):
+                raise ValueError(f"难度索引有 {len(self.curriculum)} 局，牌局语料有 {len(self.deal_corpus)} 局")
+        # 宏动作（默认关闭）：step 走完智能体的动作后，继续自动走 macro 规则认定的强制 / 占优走法，
+        # 直到出现真正需要决策的局面；macro=True 表示启用全部规则，也可以给规则名的列表
+        if macro is True:
+            macro = MACRO_RULES
+        self.macro = tuple(macro or ())
+        unknown = set(self.macro) - set(MACRO_RULES)
+        if unknown:
+            raise ValueError(f"未知的宏动作规则: {', '.join(sorted(unknown))}，可选 {', '.join(MACRO_RULES)}")
         # 10列，每列假设最大堆叠30张（保险起见）
-        # Observation: (列, 深度, 特征) -> 特征包括: [点数, 是否正面]
-        self.observation_space = spaces.Box(
-            low=-1, high=13, shape=(600,), dtype=np.int8
-        )
+        # Observation: (列, 深度, 特征) -> 特征包括: [卡牌字节(点数 | 花色 << 4), 是否正面]
+        # obs_mode 可以换成更紧凑的编码，见 OBS_MODES
+        self.obs_mode = obs_mode
+        self.observation_space = observation_space(obs_mode, num_suits)
 
         # 动作空间：从 i 列移动到 j 列 (10*10=100) + 发牌 (1)
         self.action_space = spaces.Discrete(101)
 
+        # 紧凑牌局状态：
+        # - cards[i, :lengths[i]] 是第 i 列从底到顶的牌，lengths / hidden 是普通列表，标量读写更快
+        # - 盖牌总是压在列的最底部，所以每列只需记录盖牌数 hidden[i]
+        # - deck 是整副洗好的牌，前 deck_size 张是尚未发出的牌堆（从末尾取牌）
+        self.cards = np.zeros((10, MAX_DEPTH), dtype=np.int8)
+        self.lengths = [0] * 10
+        self.hidden = [0] * 10
+        self.deck = np.zeros(104, dtype=np.int8)
+        self.deck_size = 0
+
+        # 走法生成缓存（每列一份，只在该列被改动时刷新）：
+        # 顶牌点数、列顶可移动序列的长度、序列首牌点数
+        self._tops = [0] * 10
+        self._runs = [0] * 10
+        self._heads = [0] * 10
+
+        # 常驻观察缓冲区：只重写发生变化的列切片
+        # _obs_dirty[i] 是第 i 列需要重写的起始槽位（OBS_DEPTH 表示无需重写），
+        # _obs_written[i] 是缓冲区里该列上次写入的长度
+        self._obs = np.zeros((10, OBS_DEPTH, 2), dtype=np.int8)
+        self._obs_flat = self._obs.reshape(-1)
+        self._obs_dirty = [0] * 10
+        self._obs_written = [0] * 10
+
+        # 局面的 Zobrist 哈希（随每次改动增量更新）与本局访问过的局面计数
+        self._hash = 0
+        self._visited = {}
+        self._stall = 0
+
+        # 本局统计（对局结束时放进 info["episode_stats"]）：
+        # 收牌数与退回次数逐步累计，翻牌数 / 发牌数在结束时由开局时的盖牌数、牌堆大小相减得到
+        self._ep_sequences = 0
+        self._ep_back_forth = 0
+        self._start_hidden = 0
+        self._start_deals = 0
+
+        # 分阶段计时（默认关闭；关闭时不挂任何计时代码），对局结束时放进 info["profile"]
+        self.profiler = None
+        if profile:
+            self.profiler = PhaseProfiler()
+            self.profiler.attach(self)
+
         self.reset()
 
     def get_action_mask(self):
@@ -25,61 +280,321 @@ class SpiderEnv(gym.Env):
         返回一个长度为 101 的布尔数组
         True 代表合法，False 代表非法
         """
-        mask = np.zeros(101, dtype=bool)
-
-        # 检查 100 种移动组合 (0-99)
-        for action in range(100):
-            src_idx = action // 10
-            dest_idx = action % 10
-            is_valid, _ = self._check_move(src_idx, dest_idx)
-            if is_valid:
-                mask[action] = True
-
-        # 检查发牌动作 (100)
-        if self._can_deal():
-            mask[100] = True
-
-        return mask
+        return self.action_masks()
 
     def _create_deck(self):
-        # 蜘蛛纸牌共104张牌
-        # 单花色：13个点数 * 8组
-        deck = []
-        full_set = list(range(1, 14)) * 8
-        for val in full_set:
-            deck.append({'val': val, 'suit': 0, 'face_up': False})
-        random.shuffle(deck)
-        return deck
+        # 蜘蛛纸牌共104张牌：13个点数 * 8组，8组平均分给各花色
+        # 用 gym 为每个环境维护的 np_random 洗牌，reset(seed=...) 后对局可复现
+        return self.np_random.permutation(standard_deck(self.num_suits))
 
     def reset(self, seed=None, options=None):
+        """options 可带 deal_id，从牌局语料中取指定的一局"""
         super().reset(seed=seed)
         self.current_step = 0
-        self.deck = self._create_deck()
-        self.columns = [[] for _ in range(10)]
+
+        deal_id = (options or {}).get("deal_id")
+        if deal_id is None and self.curriculum is not None:
+            deal_id = self.curriculum.sample(self.np_random)
+        if deal_id is None and self.deal_corpus is not None:
+            deal_id = int(self.np_random.integers(len(self.deal_corpus)))
+        if deal_id is None:
+            self.deal_id = None
+            self._load_deck(self._create_deck())
+        else:
+            if self.deal_corpus is None:
+                raise ValueError("指定 deal_id 需要先给环境配置 deal_corpus")
+            self.deal_id = deal_id
+            self._load_deck(self.deal_corpus[deal_id])
+        self.last_action = None  # 新增：记录上一个动作
+        self._visited = {self._hash: 1}
+        self._stall = 0
+        self._reset_episode_stats()
+
+        return self._get_obs(), {"deal_id": self.deal_id}
+
+    def set_curriculum_level(self, level):
+        """课程抽局的难度上限：只抽最容易的 level 比例（0-1）的牌局"""
+        self.curriculum.level = level
+
+    def _load_deck(self, deck):
+        """用一副洗好的牌布置初始牌局（与逐张 pop 的发牌顺序一致）"""
+        self.deck = deck
+        self.deck_size = len(deck)
+        self.cards.fill(0)
 
         # 初始发牌：前4列每列6张，后6列每列5张
         for i in range(10):
             num_cards = 6 if i < 4 else 5
-            for _ in range(num_cards):
-                card = self.deck.pop()
-                self.columns[i].append(card)
+            top = self.deck_size
+            # 依次 pop 出 deck[top-1], deck[top-2], ... 放到列上
+            self.cards[i, :num_cards] = deck[top - num_cards:top][::-1]
+            self.deck_size -= num_cards
+            self.lengths[i] = num_cards
             # 每列最后一张翻开
-            self.columns[i][-1]['face_up'] = True
-        self.last_action = None  # 新增：记录上一个动作
+            self.hidden[i] = num_cards - 1
+        self._refresh_all()
+        self._obs_dirty = [0] * 10
+        self._hash = self._compute_hash()
+
+    @property
+    def columns(self):
+        """以 {'val','suit','face_up'} 字典列表的形式导出牌局（调试 / 兼容旧脚本用）"""
+        columns = []
+        for i in range(10):
+            n, h = self.lengths[i], self.hidden[i]
+            columns.append([
+                {'val': c & VAL_MASK, 'suit': c >> SUIT_SHIFT, 'face_up': j >= h}
+                for j, c in enumerate(self.cards[i, :n].tolist())
+            ])
+        return columns
+
+    @columns.setter
+    def columns(self, columns):
+        """从字典列表载入牌局（牌堆不变）；盖牌点数未知时可以写 -1"""
+        self._load_columns(columns, self._hidden_counts(columns))
+
+    @staticmethod
+    def _hidden_counts(columns):
+        """各列底部的盖牌数；列太长或盖牌不在列底部时抛 ValueError（只检查，不改动牌局）"""
+        counts = []
+        for i, col in enumerate(columns):
+            if len(col) > MAX_DEPTH:
+                raise ValueError(f"第 {i} 列有 {len(col)} 张牌，超过 {MAX_DEPTH} 张")
+            hidden = 0
+            while hidden < len(col) and not col[hidden]['face_up']:
+                hidden += 1
+            if any(not c['face_up'] for c in col[hidden:]):
+                raise ValueError(f"第 {i} 列的盖牌必须全部位于列底部")
+            counts.append(hidden)
+        return counts
+
+    def _load_columns(self, columns, hidden):
+        """按已经检查过的 columns / 盖牌数载入牌局"""
+        self.cards.fill(0)
+        for i, col in enumerate(columns):
+            for j, card in enumerate(col):
+                if card['val'] > 0:
+                    self.cards[i, j] = card['val'] | (card['suit'] << SUIT_SHIFT)
+            self.lengths[i] = len(col)
+            self.hidden[i] = hidden[i]
+        self._refresh_all()
+        self._obs_dirty = [0] * 10
+        self._hash = self._compute_hash()
+
+    def set_state(self, columns, deals_left):
+        """
+        载入一个只部分可见的真实牌局（验证脚本用），返回观察
+        - columns: 10 列 {'val','suit','face_up'} 字典列表，盖牌点数未知时写 -1
+        - deals_left: 还能发几次牌；牌堆内容未知，按 10 * deals_left 张 0 占位
+        会检查列数、盖牌位置、点数 / 花色范围以及每种牌的张数不超过整副牌；
+        全部检查通过后才改动 env，不合法的输入抛 ValueError，原来的牌局保持不变
+        """
+        if len(columns) != 10:
+            raise ValueError(f"需要 10 列，收到 {len(columns)} 列")
+        if not 0 <= deals_left <= 5:
+            raise ValueError(f"剩余发牌次数必须在 0-5 之间，收到 {deals_left}")
+        total = sum(len(col) for col in columns) + 10 * deals_left
+        if total > 104:
+            raise ValueError(f"牌面 {total - 10 * deals_left} 张加牌堆 {10 * deals_left} 张超过了 104 张")
+        hidden = self._hidden_counts(columns)
+        counts = {}
+        for i, col in enumerate(columns):
+            for card in col:
+                val, suit = card['val'], card['suit']
+                if card['face_up'] and not 1 <= val <= 13:
+                    raise ValueError(f"第 {i} 列有点数为 {val} 的正面牌")
+                if val > 13:
+                    raise ValueError(f"第 {i} 列有点数为 {val} 的盖牌")
+                if not 0 <= suit < self.num_suits:
+                    raise ValueError(f"第 {i} 列的花色 {suit} 超出 {self.num_suits} 花色")
+                if val > 0:
+                    key = val | (suit << SUIT_SHIFT)
+                    counts[key] = counts.get(key, 0) + 1
+        copies = 8 // self.num_suits
+        for key, count in counts.items():
+            if count > copies:
+                raise ValueError(f"点数 {key & VAL_MASK} 花色 {key >> SUIT_SHIFT} 出现了 {count} 张，最多 {copies} 张")
+
+        self.deck = np.zeros(104, dtype=np.int8)
+        self.deck_size = 10 * deals_left
+        self._load_columns(columns, hidden)
+        self.deal_id = None
+        self.current_step = 0
+        self.last_action = None
+        self._visited = {self._hash: 1}
+        self._stall = 0
+        self._reset_episode_stats()
+        return self._get_obs()
 
-        return self._get_obs(), {}
+    def snapshot(self):
+        """
+        返回当前对局的快照（牌局、走法缓存、哈希与步数等），可以反复 restore
+        牌堆 deck 只在布局时整体替换、从不原地修改，快照里直接引用
+        """
+        visited = dict(self._visited) if self._tracks_cycles() else None
+        return (self.cards.copy(), tuple(self.lengths), tuple(self.hidden), self.deck, self.deck_size,
+                tuple(self._tops), tuple(self._runs), tuple(self._heads), self._hash,
+                self.current_step, self.last_action, self._stall, visited,
+                self._ep_sequences, self._ep_back_forth)
+
+    def restore(self, blob):
+        """恢复到 snapshot 时的对局"""
+        (cards, lengths, hidden, self.deck, self.deck_size, tops, runs, heads, self._hash,
+         self.current_step, self.last_action, self._stall, visited,
+         self._ep_sequences, self._ep_back_forth) = blob
+        self.cards[:] = cards
+        self.lengths = list(lengths)
+        self.hidden = list(hidden)
+        self._tops, self._runs, self._heads = list(tops), list(runs), list(heads)
+        if visited is not None:
+            self._visited = dict(visited)
+        self._obs_dirty = [0] * 10
+
+    def make_move(self, action):
+        """
+        就地走一步（连同自动翻牌、收牌），不结算奖励、不计步数，返回撤销记录；非法动作返回 None
+        与 unmake_move 成对使用，搜索 / 推演时不必复制环境
+        牌堆未知时（set_state 载入的牌局）发出的是 0 占位牌
+        """
+        if action == 100:
+            if not self._can_deal():
+                return None
+            self._deal_cards()
+            return (100,)
+
+        src_idx, dest_idx = action // 10, action % 10
+        is_valid, num_to_move = self._check_move(src_idx, dest_idx)
+        if not is_valid:
+            return None
+        self._move_cards(src_idx, dest_idx, num_to_move)
+        src_flipped = self._flip_top(src_idx)
+
+        # 记下可能被收走的序列首牌，以及收牌后目标列是否翻了牌
+        n = self.lengths[dest_idx]
+        head = int(self.cards[dest_idx, n - 13]) if n >= 13 else 0
+        hidden = self.hidden[dest_idx]
+        if not self._remove_complete_sequence(dest_idx):
+            head = 0
+        dest_flipped = self.hidden[dest_idx] < hidden
+        return (action, num_to_move, src_flipped, head, dest_flipped)
+
+    def unmake_move(self, undo):
+        """按 make_move 返回的撤销记录倒着还原"""
+        if undo[0] == 100:
+            self._undeal_cards()
+            return
+        action, num_to_move, src_flipped, head, dest_flipped = undo
+        src_idx, dest_idx = action // 10, action % 10
+        if dest_flipped:
+            self._unflip_top(dest_idx)
+        if head:
+            self._restore_sequence(dest_idx, head)
+        if src_flipped:
+            self._unflip_top(src_idx)
+        self._move_cards(dest_idx, src_idx, num_to_move)
+
+    @property
+    def state_key(self):
+        """
+        当前局面（牌面 + 盖牌 + 牌堆）的 64 位 Zobrist 哈希
+        只由局面决定，与走到这里的路径无关，可以直接作为缓存 / 置换表的键
+        """
+        return self._hash
 
-    def _get_obs(self):
-        # 将对象列表转换为 NumPy 矩阵喂给 AI
-        obs = np.zeros((10, 30, 2), dtype=np.int8)
-        for i, col in enumerate(self.columns):
-            for j, card in enumerate(col):
-                if j < 30:
-                    obs[i, j, 0] = card['val'] if card['face_up'] else -1
-                    obs[i, j, 1] = 1 if card['face_up'] else 0
-        return obs.flatten()
+    def _compute_hash(self):
+        """从头计算局面哈希（布局时使用，也用来校验增量哈希）"""
+        h = 0
+        for i in range(10):
+            hidden = self.hidden[i]
+            base = i * MAX_DEPTH * _CARD_KEYS
+            for j, c in enumerate(self.cards[i, :self.lengths[i]].tolist()):
+                h ^= (_Z_DOWN if j < hidden else _Z_UP)[base + j * _CARD_KEYS + c]
+        for j, c in enumerate(self.deck[:self.deck_size].tolist()):
+            h ^= _Z_STOCK[j * _CARD_KEYS + c]
+        return h
+
+    def _tracks_cycles(self):
+        return self.repeat_penalty or self.stall_limit is not None
+
+    def _visit(self):
+        """把当前局面记入本局访问表，返回它之前出现过的次数"""
+        seen = self._visited.get(self._hash, 0)
+        self._visited[self._hash] = seen + 1
+        return seen
+
+    def _reset_episode_stats(self):
+        self._ep_sequences = 0
+        self._ep_back_forth = 0
+        self._start_hidden = sum(self.hidden)
+        self._start_deals = self.deck_size // 10
+
+    def episode_stats(self):
+        """本局到目前为止的统计：收牌套数、翻开的盖牌数、发牌次数、退回次数、步数"""
+        return {
+            "sequences": self._ep_sequences,
+            "revealed": self._start_hidden - sum(self.hidden),
+            "deals": self._start_deals - self.deck_size // 10,
+            "back_forth": self._ep_back_forth,
+            "steps": self.current_step,
+        }
+
+    def _get_obs(self, copy=False):
+        """
+        把改动过的列同步进常驻观察缓冲区，返回其展平视图
+        视图会被下一步覆盖，需要长期保存时传 copy=True
+        其它 obs_mode 每次现算，返回的都是新数组
+        """
+        if self.obs_mode != "full":
+            if self.obs_mode == "compact":
+                return encode_compact(self.cards, self.lengths, self.hidden, self._runs, self.deck_size)
+            if self.obs_mode == "index":
+                return encode_index(self.cards, self.lengths, self.hidden)
+            return encode_variable(self.cards, self.lengths, self.hidden)
+        for i in range(10):
+            start = self._obs_dirty[i]
+            if start < OBS_DEPTH:
+                n = self.lengths[i]
+                stop = min(max(n, self._obs_written[i]), OBS_DEPTH)
+                encode_column(self._obs[i], self.cards[i], n, self.hidden[i], start, stop)
+                self._obs_written[i] = n
+                self._obs_dirty[i] = OBS_DEPTH
+        return self._obs_flat.copy() if copy else self._obs_flat
+
+    def _mark_obs(self, col_idx, start):
+        """记录第 col_idx 列从 start 槽位起需要重写观察"""
+        if start < self._obs_dirty[col_idx]:
+            self._obs_dirty[col_idx] = start
 
     def step(self, action):
+        """
+        走一步；开启 macro 时接着自动走完强制 / 占优的子步，奖励累加成一个，
+        info["macro_steps"] 是自动走的子步数（步数上限、退回惩罚都按子步照常计）
+        """
+        reward, terminated, truncated, info = self._step(action)
+        if self.macro:
+            skipped = 0
+            while not (terminated or truncated) and skipped < MACRO_LIMIT:
+                sub_action = self._macro_action()
+                if sub_action is None:
+                    break
+                sub_reward, terminated, truncated, sub_info = self._step(sub_action)
+                reward += sub_reward
+                skipped += 1
+                if sub_info["msg"]:
+                    info["msg"] = sub_info["msg"]
+            info["macro_steps"] = skipped
+        if terminated or truncated:
+            info["episode_stats"] = self.episode_stats()
+            if self.profiler is not None:
+                # 每局报告一次本局的分阶段耗时，然后清零重新累计
+                info["profile"] = self.profiler.report()
+                self.profiler.reset()
+
+        # 对局结束时返回副本：向量环境会把它存成 terminal_observation 后立刻 reset
+        return self._get_obs(copy=terminated or truncated), reward, terminated, truncated, info
+
+    def _step(self, action):
+        """按规则走一步并结算奖励，返回 (reward, terminated, truncated, info)"""
         # 全局步数税
         # 每一帧都扣除微小分数，逼迫 AI 尽快行动，不磨洋工
         reward = -0.05
@@ -94,15 +609,19 @@ class SpiderEnv(gym.Env):
                 self._deal_cards()
                 reward += 20.0  # 发牌依然是正面反馈
                 self.last_action = 100
+                # 发牌后牌堆变少，一定是新局面
+                if self._tracks_cycles():
+                    self._visit()
+                    self._stall = 0
             else:
                 reward -= 10.0  # 非法发牌重罚
-            return self._get_obs(), reward, terminated, truncated, info
+            return reward, terminated, truncated, info
 
         # 解析移动动作
         src_idx = action // 10
         dest_idx = action % 10
 
-        is_valid, movable_seq = self._check_move(src_idx, dest_idx)
+        is_valid, num_to_move = self._check_move(src_idx, dest_idx)
 
         if is_valid:
             # --- 条件 5：检测退回步数并重罚 ---
@@ -113,13 +632,11 @@ class SpiderEnv(gym.Env):
                 if src_idx == last_dest and dest_idx == last_src:
                     reward -= 15.0  # 给予重罚，打破死循环
                     info["msg"] = "back_forth_penalty"
+                    self._ep_back_forth += 1
 
             # 执行移动
-            num_to_move = len(movable_seq)
-            src_had_hidden = any(not c['face_up'] for c in self.columns[src_idx])
-
-            self.columns[src_idx] = self.columns[src_idx][:-num_to_move]
-            self.columns[dest_idx].extend(movable_seq)
+            src_had_hidden = self.hidden[src_idx] > 0
+            self._move_cards(src_idx, dest_idx, num_to_move)
 
             # 记录有效动作
             self.last_action = action
@@ -128,25 +645,33 @@ class SpiderEnv(gym.Env):
             reward += 1.0  # 基础移动奖
 
             # 核心奖励 1：翻开隐藏牌 (50.0)
-            if self.columns[src_idx] and not self.columns[src_idx][-1]['face_up']:
-                self.columns[src_idx][-1]['face_up'] = True
+            if self._flip_top(src_idx):
                 reward += 50.0
 
             # 核心奖励 2：创造出空列 (30.0)
-            if len(self.columns[src_idx]) == 0 and src_had_hidden:
+            if self.lengths[src_idx] == 0 and src_had_hidden:
                 reward += 30.0
 
             # 核心奖励 3：叠放奖 (5.0)
             # 只有目标列原本有牌时才给，鼓励“连接”而非单纯移动到空位
-            if len(self.columns[dest_idx]) > len(movable_seq):
+            if self.lengths[dest_idx] > num_to_move:
                 reward += 5.0
 
             # 核心奖励 4：完成 A-K 序列 (建议提高到 300)
             if self._remove_complete_sequence(dest_idx):
                 reward += 300.0
-                if all(len(c) == 0 for c in self.columns) and len(self.deck) == 0:
+                self._ep_sequences += 1
+                if not any(self.lengths) and self.deck_size == 0:
                     reward += 1000.0
                     terminated = True
+
+            # 循环检测：走回本局出现过的局面
+            if self._tracks_cycles():
+                if self._visit():
+                    reward -= self.repeat_penalty
+                    self._stall += 1
+                else:
+                    self._stall = 0
         else:
             # 非法动作惩罚 (Action Masking 开启时理论上不会触发)
             reward -= 2.0
@@ -155,96 +680,247 @@ class SpiderEnv(gym.Env):
         self.current_step += 1
         if self.current_step >= 1000:
             truncated = True
-
-        return self._get_obs(), reward, terminated, truncated, info
+        if self.stall_limit is not None and self._stall >= self.stall_limit and not terminated:
+            truncated = True
+            info["msg"] = "stall_truncated"
+        return reward, terminated, truncated, info
+
+    def _macro_action(self):
+        """当前局面按 macro 规则应当自动走的动作；没有时返回 None（需要智能体决策）"""
+        mask = self.action_masks()
+        legal = np.flatnonzero(mask).tolist()
+        if "forced" in self.macro and len(legal) == 1:
+            return legal[0]
+        reveal = None
+        for action in legal:
+            if action == 100:
+                continue
+            src_idx, dest_idx = action // 10, action % 10
+            dest_len = self.lengths[dest_idx]
+            if dest_len == 0:
+                continue
+            rest = self.lengths[src_idx] - self._runs[src_idx]
+            # 同花色接上：目标列顶牌的字节正好比序列首牌大 1
+            if int(self.cards[dest_idx, dest_len - 1]) != int(self.cards[src_idx, rest]) + 1:
+                continue
+            if "complete" in self.macro and self._tops[src_idx] == 1 and self._runs[dest_idx] + self._runs[src_idx] >= 13:
+                return action
+            if reveal is None and "reveal" in self.macro and 0 < rest == self.hidden[src_idx]:
+                reveal = action
+        return reveal
 
     def action_masks(self):
-        # 这里的逻辑就是你之前实现的掩码逻辑
+        # 用每列缓存的顶牌 / 序列首牌生成掩码：
+        # 先按顶牌点数给目标列建索引，每个源列只需查“点数 = 首牌 + 1”的列和空列
+        mask = np.zeros(101, dtype=bool)
+        lengths = self.lengths
+        by_top = [[] for _ in range(15)]
+        empty = []
+        for i in range(10):
+            if lengths[i]:
+                by_top[self._tops[i]].append(i)
+            else:
+                empty.append(i)
+
+        legal = []
+        for src_idx in range(10):
+            if lengths[src_idx] == 0:
+                continue
+            base = src_idx * 10
+            for dest_idx in by_top[self._heads[src_idx] + 1]:
+                legal.append(base + dest_idx)
+            for dest_idx in empty:
+                legal.append(base + dest_idx)
+        mask[legal] = True
+
+        mask[100] = self._can_deal()
+        return mask
+
+    def _scan_action_mask(self):
+        """
+        不走任何缓存、逐对扫描 100 种移动的参考掩码，用来校验 action_masks
+        每一对 (src, dest) 都从 cards / hidden 重新数出源列可移动的序列（与最初 _check_move 的逐张扫描相同），
+        不用 _run_length 和 _runs / _heads / _tops，这些缓存出错时这里能查出来
+        """
         mask = np.zeros(101, dtype=bool)
         for action in range(100):
             src_idx = action // 10
             dest_idx = action % 10
-            # 这里的 _check_move 是你类里的判定函数
-            is_valid, _ = self._check_move(src_idx, dest_idx)
-            mask[action] = is_valid
+            src_len = self.lengths[src_idx]
+            dest_len = self.lengths[dest_idx]
+            if src_idx == dest_idx or src_len == 0:
+                continue
+            if dest_len == 0:
+                mask[action] = True
+                continue
+            # 从列顶往下数：正面、点数依次 +1、同花色
+            row = self.cards[src_idx]
+            j = src_len - 1
+            while j > self.hidden[src_idx]:
+                below, above = int(row[j - 1]), int(row[j])
+                if (below & VAL_MASK) != (above & VAL_MASK) + 1 or (below >> SUIT_SHIFT) != (above >> SUIT_SHIFT):
+                    break
+                j -= 1
+            head = int(row[j]) & VAL_MASK
+            if head == (int(self.cards[dest_idx, dest_len - 1]) & VAL_MASK) - 1:
+                mask[action] = True
 
         mask[100] = self._can_deal()
         return mask
 
+    def _refresh_column(self, col_idx):
+        """列内容变化后刷新该列的走法缓存"""
+        n = self.lengths[col_idx]
+        if n == 0:
+            self._tops[col_idx] = self._runs[col_idx] = self._heads[col_idx] = 0
+            return
+        run = self._run_length(col_idx)
+        self._runs[col_idx] = run
+        self._tops[col_idx] = int(self.cards[col_idx, n - 1]) & VAL_MASK
+        self._heads[col_idx] = int(self.cards[col_idx, n - run]) & VAL_MASK
+
+    def _refresh_all(self):
+        for i in range(10):
+            self._refresh_column(i)
+
+    def _run_length(self, col_idx):
+        """列顶同花色连续递减（且全部正面）序列的长度"""
+        return run_length(self.cards[col_idx], self.lengths[col_idx], self.hidden[col_idx])
+
     def _check_move(self, src_idx, dest_idx):
-        """判断移动合法性并返回可移动的序列"""
-        if src_idx == dest_idx: return False, []
-        src_col = self.columns[src_idx]
-        dest_col = self.columns[dest_idx]
+        """判断移动合法性并返回可移动的张数"""
+        if src_idx == dest_idx: return False, 0
 
-        if not src_col: return False, []
+        if self.lengths[src_idx] == 0: return False, 0
 
-        # 获取源列末尾同花色连续序列
+        # 源列末尾同花色连续序列（缓存）
         # 蜘蛛纸牌规则：只有同花色连续递减序列才能整体移动
-        movable_seq = []
-        for i in range(len(src_col) - 1, -1, -1):
-            card = src_col[i]
-            if not card['face_up']: break
-
-            if not movable_seq:
-                movable_seq.insert(0, card)
-            else:
-                last_added = movable_seq[0]
-                if card['val'] == last_added['val'] + 1 and card['suit'] == last_added['suit']:
-                    movable_seq.insert(0, card)
-                else:
-                    break
+        num_to_move = self._runs[src_idx]
 
         # 目标列检查：
         # 规则：序列的第一张牌必须比目标列最后一张牌小 1（不限花色）
-        if not dest_col:
-            return True, movable_seq  # 目标为空，随便移
+        if self.lengths[dest_idx] == 0:
+            return True, num_to_move  # 目标为空，随便移
         else:
-            if movable_seq[0]['val'] == dest_col[-1]['val'] - 1:
-                return True, movable_seq
+            if self._heads[src_idx] == self._tops[dest_idx] - 1:
+                return True, num_to_move
+
+        return False, 0
+
+    def _move_cards(self, src_idx, dest_idx, num_to_move):
+        """把源列顶部 num_to_move 张牌整体搬到目标列"""
+        src_len = self.lengths[src_idx]
+        dest_len = self.lengths[dest_idx]
+        moved = self.cards[src_idx, src_len - num_to_move:src_len]
+        # 搬动的是一段连续序列：异或掉它在源列的键，异或进它在目标列的键
+        head = int(moved[0])
+        self._hash ^= _run_key(src_idx, src_len - num_to_move, head, num_to_move) \
+            ^ _run_key(dest_idx, dest_len, head, num_to_move)
+        self.cards[dest_idx, dest_len:dest_len + num_to_move] = moved
+        self.cards[src_idx, src_len - num_to_move:src_len] = 0
+        self.lengths[src_idx] = src_len - num_to_move
+        self.lengths[dest_idx] = dest_len + num_to_move
+        self._refresh_column(src_idx)
+        self._refresh_column(dest_idx)
+        self._mark_obs(src_idx, src_len - num_to_move)
+        self._mark_obs(dest_idx, dest_len)
+
+    def _flip_top(self, col_idx):
+        """若列顶是盖牌则翻开，返回是否发生了翻牌"""
+        if self.lengths[col_idx] > 0 and self.hidden[col_idx] == self.lengths[col_idx]:
+            self.hidden[col_idx] -= 1
+            j = self.hidden[col_idx]
+            index = (col_idx * MAX_DEPTH + j) * _CARD_KEYS + int(self.cards[col_idx, j])
+            self._hash ^= _Z_DOWN[index] ^ _Z_UP[index]
+            self._refresh_column(col_idx)
+            self._mark_obs(col_idx, self.hidden[col_idx])
+            return True
+        return False
 
-        return False, []
+    def _unflip_top(self, col_idx):
+        """_flip_top 的逆操作：把列顶正面牌重新盖上"""
+        j = self.hidden[col_idx]
+        index = (col_idx * MAX_DEPTH + j) * _CARD_KEYS + int(self.cards[col_idx, j])
+        self._hash ^= _Z_DOWN[index] ^ _Z_UP[index]
+        self.hidden[col_idx] = j + 1
+        self._refresh_column(col_idx)
+        self._mark_obs(col_idx, j)
 
     def _remove_complete_sequence(self, col_idx):
         """检查并移除 13张连贯同花色的牌"""
-        col = self.columns[col_idx]
-        if len(col) < 13: return False
+        n = self.lengths[col_idx]
+        if n < 13: return False
 
         # 检查最后13张是否是同花色 13, 12, ..., 1
-        if col[-1]['val'] != 1: return False
-
-        count = 1
-        suit = col[-1]['suit']
-        for i in range(len(col) - 2, len(col) - 14, -1):
-            if col[i]['face_up'] and col[i]['val'] == col[i + 1]['val'] + 1 and col[i]['suit'] == suit:
-                count += 1
-            else:
-                break
-
-        if count == 13:
-            self.columns[col_idx] = col[:-13]
+        if self.cards[col_idx, n - 1] & VAL_MASK != 1: return False
+
+        if self._runs[col_idx] == 13:
+            self._hash ^= _run_key(col_idx, n - 13, int(self.cards[col_idx, n - 13]), 13)
+            self.cards[col_idx, n - 13:n] = 0
+            self.lengths[col_idx] = n - 13
+            self._refresh_column(col_idx)
+            self._mark_obs(col_idx, n - 13)
             # 移除后可能需要再次翻牌
-            if self.columns[col_idx] and not self.columns[col_idx][-1]['face_up']:
-                self.columns[col_idx][-1]['face_up'] = True
+            self._flip_top(col_idx)
             return True
         return False
 
+    def _restore_sequence(self, col_idx, head):
+        """_remove_complete_sequence 的逆操作：把首牌字节为 head 的 K-A 放回列顶"""
+        n = self.lengths[col_idx]
+        self.cards[col_idx, n:n + 13] = np.arange(head, head - 13, -1, dtype=np.int8)
+        self._hash ^= _run_key(col_idx, n, head, 13)
+        self.lengths[col_idx] = n + 13
+        self._refresh_column(col_idx)
+        self._mark_obs(col_idx, n)
+
     def _can_deal(self):
         """规则：发牌时所有列不能为空"""
-        return len(self.deck) >= 10 and all(len(c) > 0 for c in self.columns)
+        return self.deck_size >= 10 and all(self.lengths)
 
     def _deal_cards(self):
+        # 依次 pop 出 deck[size-1], deck[size-2], ... 发给第 0-9 列，发出的牌都是正面
+        top = self.deck_size
+        dealt = self.deck[top - 10:top][::-1]
+        self.cards[np.arange(10), self.lengths] = dealt
+        h = self._hash
+        for i, c in enumerate(dealt.tolist()):
+            # 第 i 列拿到的是牌堆位置 top-1-i 的牌
+            h ^= _Z_STOCK[(top - 1 - i) * _CARD_KEYS + c]
+            h ^= _Z_UP[(i * MAX_DEPTH + self.lengths[i]) * _CARD_KEYS + c]
+            self._mark_obs(i, self.lengths[i])
+        self._hash = h
+        self.lengths = [n + 1 for n in self.lengths]
+        self.deck_size -= 10
+        self._refresh_all()
+
+    def _undeal_cards(self):
+        """_deal_cards 的逆操作：把每列顶牌按原顺序放回牌堆"""
+        top = self.deck_size + 10
+        self.lengths = [n - 1 for n in self.lengths]
+        h = self._hash
         for i in range(10):
-            card = self.deck.pop()
-            card['face_up'] = True
-            self.columns[i].append(card)
+            j = self.lengths[i]
+            c = int(self.cards[i, j])
+            h ^= _Z_STOCK[(top - 1 - i) * _CARD_KEYS + c]
+            h ^= _Z_UP[(i * MAX_DEPTH + j) * _CARD_KEYS + c]
+            self.cards[i, j] = 0
+            self._mark_obs(i, j)
+        self._hash = h
+        self.deck_size = top
+        self._refresh_all()
 
     def render(self):
         # 简单的字符界面打印，方便 Debug
-        for i, col in enumerate(self.columns):
-            display = [f"{c['val'] if c['face_up'] else '?'}" for c in col]
+        for i in range(10):
+            n, h = self.lengths[i], self.hidden[i]
+            if self.num_suits == 1:
+                face_up = [str(c & VAL_MASK) for c in self.cards[i, h:n].tolist()]
+            else:
+                face_up = [f"{c & VAL_MASK}{SUIT_SYMBOLS[c >> SUIT_SHIFT]}" for c in self.cards[i, h:n].tolist()]
+            display = ['?'] * h + face_up
             print(f"Col {i}: {' '.join(display)}")
-        print(f"Deck remaining: {len(self.deck)}")
+        print(f"Deck remaining: {self.deck_size}")
 
 
 if __name__ == "__main__":
@@ -270,4 +946,4 @@ if __name__ == "__main__":
 
         if terminated or truncated:
             print("轮次结束")
-            obs, _ = env.reset()
\ No newline at end of file
+            obs, _ = env.reset()
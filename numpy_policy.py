@@ -0,0 +1,166 @@
+"""
+不依赖 torch 的策略推理
+
+实时助手只需要 600 -> 256 -> 256 -> 256 -> 101 这一个 MLP 的前向。把 MaskablePPO 的权重导出成 .npz，
+运行时用 NumPy 直接算，启动不用加载 torch / sb3，内存也小得多。
+NumpyPolicy.predict 与 model.predict 接口一致；evaluate 与 planner 的估值函数接口一致。
+
+用法:
+    python numpy_policy.py export marcuspider_v2_final --out marcuspider_v2_final.npz
+    python numpy_policy.py verify marcuspider_v2_final marcuspider_v2_final.npz --games 20
+"""
+import argparse
+
+import numpy as np
+
+_ACTIVATIONS = {
+    "Tanh": np.tanh,
+    "ReLU": lambda x: np.maximum(x, 0),
+}
+
+
+class NumpyPolicy:
+    """从 export 生成的 .npz 载入策略网络与价值网络"""
+
+    def __init__(self, pi_layers, vf_layers, action_head, value_head, activation="Tanh"):
+        self.pi_layers = pi_layers
+        self.vf_layers = vf_layers
+        self.action_head = action_head
+        self.value_head = value_head
+        self.activation = activation
+        self._act = _ACTIVATIONS[activation]
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+
+        def layers(prefix):
+            out, k = [], 0
+            while f"{prefix}_w{k}" in data:
+                # 存的是 torch 的 (out, in)，转置成 (in, out) 便于 obs @ w
+                out.append((np.ascontiguousarray(data[f"{prefix}_w{k}"].T), data[f"{prefix}_b{k}"]))
+                k += 1
+            return out
+
+        return cls(layers("pi"), layers("vf"),
+                   (np.ascontiguousarray(data["action_w"].T), data["action_b"]),
+                   (np.ascontiguousarray(data["value_w"].T), data["value_b"]),
+                   str(data["activation"]))
+
+    def _forward(self, x, layers):
+        for w, b in layers:
+            x = self._act(x @ w + b)
+        return x
+
+    def logits(self, obs):
+        obs = np.asarray(obs, dtype=np.float32).reshape(-1, self.pi_layers[0][0].shape[0])
+        w, b = self.action_head
+        return self._forward(obs, self.pi_layers) @ w + b
+
+    def values(self, obs):
+        obs = np.asarray(obs, dtype=np.float32).reshape(-1, self.vf_layers[0][0].shape[0])
+        w, b = self.value_head
+        return (self._forward(obs, self.vf_layers) @ w + b)[:, 0]
+
+    def predict(self, obs, action_masks=None, deterministic=True):
+        """
+        与 MaskablePPO.predict 相同的调用方式，返回 (action, None)
+        单个观察返回标量动作，一批观察返回数组；deterministic=False 时按掩码后的分布采样
+        """
+        single = np.ndim(obs) == 1
+        logits = self.logits(obs)
+        if action_masks is not None:
+            logits = np.where(np.reshape(action_masks, logits.shape), logits, -np.inf)
+        if deterministic:
+            actions = logits.argmax(axis=1)
+        else:
+            probs = np.exp(logits - logits.max(axis=1, keepdims=True))
+            probs /= probs.sum(axis=1, keepdims=True)
+            actions = np.array([np.random.choice(len(p), p=p) for p in probs])
+        return (actions[0] if single else actions), None
+
+    def evaluate(self, obs, masks):
+        """planner 用的批量估值：返回按掩码归一的先验与价值"""
+        from planner import masked_softmax
+
+        return masked_softmax(self.logits(obs), masks), self.values(obs)
+
+
+def export(model_path, out_path):
+    """把 MaskablePPO（MlpPolicy）的权重导出成 .npz"""
+    import torch
+    from sb3_contrib import MaskablePPO
+    from stable_baselines3.common.torch_layers import FlattenExtractor
+
+    policy = MaskablePPO.load(model_path, device="cpu").policy
+    if not isinstance(policy.features_extractor, FlattenExtractor):
+        # 自定义特征提取器（如 features.py 的卡牌嵌入）没有对应的 NumPy 实现
+        raise ValueError(f"只支持 MlpPolicy 的默认特征提取器，模型用的是 {type(policy.features_extractor).__name__}")
+    arrays = {}
+    activation = None
+    for prefix, net in (("pi", policy.mlp_extractor.policy_net), ("vf", policy.mlp_extractor.value_net)):
+        linears = [m for m in net if isinstance(m, torch.nn.Linear)]
+        for k, linear in enumerate(linears):
+            arrays[f"{prefix}_w{k}"] = linear.weight.detach().numpy()
+            arrays[f"{prefix}_b{k}"] = linear.bias.detach().numpy()
+        acts = {type(m).__name__ for m in net if not isinstance(m, torch.nn.Linear)}
+        if len(acts) > 1 or not acts <= set(_ACTIVATIONS):
+            raise ValueError(f"不支持的激活函数: {acts}")
+        activation = acts.pop() if acts else activation
+    arrays["action_w"] = policy.action_net.weight.detach().numpy()
+    arrays["action_b"] = policy.action_net.bias.detach().numpy()
+    arrays["value_w"] = policy.value_net.weight.detach().numpy()
+    arrays["value_b"] = policy.value_net.bias.detach().numpy()
+    arrays["activation"] = np.array(activation or "Tanh")
+    np.savez(out_path, **arrays)
+
+
+def verify(model_path, npz_path, games=20, max_steps=300):
+    """在若干局里记录模型走过的局面，逐个比较 model.predict 与 NumpyPolicy.predict 的动作"""
+    from sb3_contrib import MaskablePPO
+
+    from logic import SpiderEnv
+
+    model = MaskablePPO.load(model_path, device="cpu")
+    policy = NumpyPolicy.load(npz_path)
+    env = SpiderEnv()
+    total = same = 0
+    for seed in range(games):
+        obs, _ = env.reset(seed=seed)
+        for _ in range(max_steps):
+            masks = env.action_masks()
+            expected, _ = model.predict(obs, action_masks=masks, deterministic=True)
+            actual, _ = policy.predict(obs, action_masks=masks, deterministic=True)
+            total += 1
+            same += int(expected) == int(actual)
+            obs, _, terminated, truncated, _ = env.step(int(expected))
+            if terminated or truncated:
+                break
+    return same, total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="导出 / 校验 NumPy 推理权重")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_export = sub.add_parser("export", help="把 MaskablePPO 权重导出成 .npz")
+    p_export.add_argument("model")
+    p_export.add_argument("--out", default=None, help="默认与模型同名的 .npz")
+    p_verify = sub.add_parser("verify", help="对比 model.predict 与 NumPy 推理的动作")
+    p_verify.add_argument("model")
+    p_verify.add_argument("npz")
+    p_verify.add_argument("--games", type=int, default=20)
+    args = parser.parse_args()
+
+    if args.cmd == "export":
+        out = args.out or args.model.removesuffix(".zip") + ".npz"
+        export(args.model, out)
+        print(f"已导出 -> {out}")
+    else:
+        same, total = verify(args.model, args.npz, args.games)
+        print(f"{same}/{total} 个局面动作一致")
+        if same != total:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
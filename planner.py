@@ -0,0 +1,255 @@
+"""
+实时助手用的策略引导 MCTS
+
+- 先验与价值来自 MaskablePPO 策略网络（也可以换成任何 evaluate(obs, masks) -> (priors, values) 函数）
+- 在 SpiderEnv 上用 make_move / unmake_move 推演，不复制环境
+- 翻开未知盖牌、发牌这类随机事件不往下展开：该边作为叶子，用“翻牌前”的局面估值
+- 叶子攒成一批统一过一次网络（虚拟损失把同一批的模拟分散到不同分支）
+- 每步有墙钟预算；走完一步后，若新局面就在上次的树里，直接沿用那棵子树
+"""
+import math
+import time
+
+import numpy as np
+
+# 与 SpiderEnv.step 的奖励结算一致（不含退回惩罚）
+STEP_COST = -0.05
+MOVE_REWARD = 1.0
+FLIP_REWARD = 50.0
+STACK_REWARD = 5.0
+COMPLETE_REWARD = 300.0
+WIN_REWARD = 1000.0
+DEAL_REWARD = 20.0
+
+
+def move_reward(env, undo, dest_len):
+    """按 SpiderEnv.step 的规则结算 make_move 这一步的即时奖励；dest_len 是走之前目标列的长度"""
+    if undo[0] == 100:
+        return STEP_COST + DEAL_REWARD
+    _, _, src_flipped, head, _ = undo
+    reward = STEP_COST + MOVE_REWARD
+    if src_flipped:
+        reward += FLIP_REWARD
+    if dest_len > 0:
+        reward += STACK_REWARD
+    if head:
+        reward += COMPLETE_REWARD
+        if env.deck_size == 0 and not any(env.lengths):
+            reward += WIN_REWARD
+    return reward
+
+
+def policy_evaluator(model):
+    """把 MaskablePPO 包成批量估值函数：输入 (B, 600) 观察与 (B, 101) 掩码，输出先验与价值"""
+    import torch
+
+    policy = model.policy
+    policy.set_training_mode(False)
+
+    def evaluate(obs, masks):
+        with torch.no_grad():
+            obs_tensor, _ = policy.obs_to_tensor(obs)
+            features = policy.extract_features(obs_tensor)
+            latent_pi, latent_vf = policy.mlp_extractor(features)
+            logits = policy.action_net(latent_pi).cpu().numpy()
+            values = policy.value_net(latent_vf).cpu().numpy()[:, 0]
+        return masked_softmax(logits, masks), values
+
+    return evaluate
+
+
+def masked_softmax(logits, masks):
+    """按掩码归一的概率；整行都不合法时给全 0"""
+    logits = np.where(masks, logits, -np.inf)
+    peak = logits.max(axis=1, keepdims=True)
+    probs = np.exp(logits - np.where(np.isfinite(peak), peak, 0))
+    total = probs.sum(axis=1, keepdims=True)
+    return probs / np.where(total > 0, total, 1)
+
+
+class _Node:
+    """树节点：每条出边（合法动作）一组统计量"""
+
+    def __init__(self, key, actions, priors, value):
+        self.key = key
+        self.actions = actions
+        self.priors = priors
+        self.value = value
+        self.visits = np.zeros(len(actions))
+        self.value_sum = np.zeros(len(actions))
+        self.rewards = np.zeros(len(actions))
+        # 子节点；随机事件 / 终局的边不建节点，只在 leaf_values 里记叶子估值
+        self.children = {}
+        self.leaf_values = {}
+
+
+class MCTSPlanner:
+    def __init__(self, evaluate, budget_ms=200, batch_size=16, c_puct=1.5, gamma=0.99,
+                 max_depth=60, virtual_loss=1.0):
+        self.evaluate = evaluate
+        self.budget_ms = budget_ms
+        self.batch_size = batch_size
+        self.c_puct = c_puct
+        self.gamma = gamma
+        self.max_depth = max_depth
+        self.virtual_loss = virtual_loss
+        self.root = None
+        # 上一次搜索里各局面对应的节点，用来在下一步复用子树
+        self._nodes = {}
+        # Q 值的最小 / 最大值，用于把奖励尺度归一到 [0, 1]
+        self._q_min = math.inf
+        self._q_max = -math.inf
+
+    def reset(self):
+        """开新局时丢掉旧树"""
+        self.root = None
+        self._nodes = {}
+        self._q_min, self._q_max = math.inf, -math.inf
+
+    def plan(self, env, budget_ms=None):
+        """在 env 当前局面上搜索，返回访问次数最多的动作（无合法动作时返回 None）"""
+        budget_ms = self.budget_ms if budget_ms is None else budget_ms
+        deadline = time.perf_counter() + budget_ms / 1000
+
+        root = self._nodes.get(env.state_key)
+        if root is None:
+            mask = env.action_masks()
+            if not mask.any():
+                return None
+            priors, values = self.evaluate(env._get_obs(copy=True)[None], mask[None])
+            actions = np.flatnonzero(mask)
+            root = _Node(env.state_key, actions, priors[0, actions], float(values[0]))
+        self.root = root
+        # 只保留新根下面的子树
+        self._nodes = {}
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            self._nodes[node.key] = node
+            stack.extend(node.children.values())
+
+        while True:
+            self._simulate_batch(env)
+            if time.perf_counter() >= deadline:
+                break
+        return int(root.actions[np.argmax(root.visits)])
+
+    def action_visits(self):
+        """根节点各动作的访问次数（调试 / 展示用）"""
+        if self.root is None:
+            return {}
+        return {int(a): int(n) for a, n in zip(self.root.actions, self.root.visits)}
+
+    def _score(self, node):
+        total = node.visits.sum()
+        q = np.where(node.visits > 0, node.value_sum / np.maximum(node.visits, 1), node.value)
+        if self._q_max > self._q_min:
+            q = (q - self._q_min) / (self._q_max - self._q_min)
+        else:
+            q = np.full_like(q, 0.5)
+        u = self.c_puct * node.priors * math.sqrt(total + 1) / (1 + node.visits)
+        return q + u
+
+    def _simulate_batch(self, env):
+        """沿 PUCT 选出一批叶子，一次网络前向后统一回传"""
+        pending, obs_batch, mask_batch = [], [], []
+        claimed = set()
+        for _ in range(self.batch_size):
+            path, leaf = self._descend(env, claimed)
+            if path is None:
+                break
+            pending.append((path, leaf))
+            if leaf[0] == "eval":
+                obs_batch.append(leaf[1])
+                mask_batch.append(leaf[2])
+
+        if obs_batch:
+            priors, values = self.evaluate(np.stack(obs_batch), np.stack(mask_batch))
+        k = 0
+        for path, leaf in pending:
+            kind = leaf[0]
+            if kind == "eval":
+                _, _, mask, node, idx, key, expand = leaf
+                value = float(values[k])
+                if expand:
+                    actions = np.flatnonzero(mask)
+                    child = _Node(key, actions, priors[k, actions], value)
+                    node.children[idx] = child
+                    self._nodes[key] = child
+                else:
+                    node.leaf_values[idx] = value
+                k += 1
+            else:
+                value = leaf[1]
+            self._backup(path, value)
+
+    def _descend(self, env, claimed):
+        """从根走到一个叶子，返回 (路径, 叶子信息)；路径上加虚拟损失，返回前把 env 复原"""
+        node = self.root
+        path, undos = [], []
+        try:
+            for _ in range(self.max_depth):
+                idx = int(np.argmax(self._score(node)))
+                if (id(node), idx) in claimed:
+                    # 这条边本批已经在等网络估值了：撤掉这次下探的虚拟损失，本批到此为止
+                    for n, i in path:
+                        n.visits[i] -= 1
+                        n.value_sum[i] += self.virtual_loss
+                    return None, None
+                action = int(node.actions[idx])
+                node.visits[idx] += 1
+                node.value_sum[idx] -= self.virtual_loss
+                path.append((node, idx))
+
+                if idx in node.children:
+                    undos.append(env.make_move(action))
+                    node = node.children[idx]
+                    continue
+                if idx in node.leaf_values:
+                    return path, ("value", node.leaf_values[idx])
+
+                # 第一次走这条边：推演一步，结算即时奖励
+                dest_len = env.lengths[action % 10] if action < 100 else 0
+                undo = env.make_move(action)
+                undos.append(undo)
+                node.rewards[idx] = move_reward(env, undo, dest_len)
+                # 直接得出值的边（胜局 / 无路可走）写进 leaf_values 就结束了，不占 claimed；
+                # 只有要等本批网络估值的边才标记，免得同批后面的下探走到它时白白提前收批
+                if env.deck_size == 0 and not any(env.lengths):
+                    node.leaf_values[idx] = 0.0
+                    return path, ("value", 0.0)
+                if action == 100:
+                    # 发出的牌未知：用发牌前的局面估值
+                    env.unmake_move(undos.pop())
+                    mask = env.action_masks()
+                    claimed.add((id(node), idx))
+                    return path, ("eval", env._get_obs(copy=True), mask, node, idx, None, False)
+                flipped = [c for c, f in ((action // 10, undo[2]), (action % 10, undo[4])) if f]
+                if flipped:
+                    # 翻开的牌未知：把它重新盖上再估值
+                    for col in flipped:
+                        env._unflip_top(col)
+                    obs = env._get_obs(copy=True)
+                    for col in flipped:
+                        env._flip_top(col)
+                    claimed.add((id(node), idx))
+                    return path, ("eval", obs, env.action_masks(), node, idx, None, False)
+                mask = env.action_masks()
+                if not mask.any():
+                    node.leaf_values[idx] = 0.0
+                    return path, ("value", 0.0)
+                claimed.add((id(node), idx))
+                return path, ("eval", env._get_obs(copy=True), mask, node, idx, env.state_key, True)
+            # 超过最大深度：用当前节点的估值截断
+            return path, ("value", node.value)
+        finally:
+            while undos:
+                env.unmake_move(undos.pop())
+
+    def _backup(self, path, value):
+        for node, idx in reversed(path):
+            value = node.rewards[idx] + self.gamma * value
+            # 撤掉虚拟损失，记入真实回报
+            node.value_sum[idx] += self.virtual_loss + value
+            self._q_min = min(self._q_min, value)
+            self._q_max = max(self._q_max, value)
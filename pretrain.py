@@ -0,0 +1,128 @@
+"""
+行为克隆预训练
+
+从 recorder.py 写的轨迹文件里流式读取 (观察, 动作掩码, 动作)，
+用掩码交叉熵（被掩掉的动作不参与 softmax）训练与 train.py 同结构的策略（默认 MlpPolicy net_arch=[256, 256, 256]，
+--features embed 时为 features.py 的卡牌嵌入），
+存成 MaskablePPO 模型；train.py --init-from 载入这份权重后再用 PPO 微调。
+
+示范数据通常来自求解器：
+    python solver.py --seeds 0 5000 --record expert.sptr
+    python pretrain.py expert.sptr --epochs 5 --out pretrained
+    python train.py --init-from pretrained.zip
+"""
+import argparse
+import glob
+
+import numpy as np
+import torch
+from sb3_contrib import MaskablePPO
+
+import features
+import logic
+from recorder import TrajectoryReader, step_masks, step_observations
+
+
+def iter_batches(paths, batch_size, obs_mode="full", shuffle_chunks=8, rng=None):
+    """
+    流式产出 (obs, masks, actions) 批次
+    每次攒 shuffle_chunks 个块一起打乱，内存占用只与块数有关；非法的记录动作直接丢掉
+    """
+    rng = rng or np.random.default_rng()
+    columns = ["state", "deck_size", "mask", "action"]
+    pool = []
+
+    def drain(final):
+        obs = np.concatenate([p[0] for p in pool])
+        masks = np.concatenate([p[1] for p in pool])
+        actions = np.concatenate([p[2] for p in pool])
+        pool.clear()
+        order = rng.permutation(len(actions))
+        stop = len(order) if final else len(order) - len(order) % batch_size
+        for lo in range(0, stop, batch_size):
+            idx = order[lo:lo + batch_size]
+            yield obs[idx], masks[idx], actions[idx]
+        if stop < len(order):
+            # 凑不满一批的尾巴留到下一轮
+            rest = order[stop:]
+            pool.append((obs[rest], masks[rest], actions[rest]))
+
+    for path in paths:
+        for chunk in TrajectoryReader(path).iter_steps(columns):
+            masks = step_masks(chunk)
+            actions = chunk["action"].astype(np.int64)
+            legal = masks[np.arange(len(actions)), actions]
+            chunk = {col: arr[legal] for col, arr in chunk.items()}
+            pool.append((step_observations(chunk, obs_mode), masks[legal], actions[legal]))
+            if len(pool) >= shuffle_chunks:
+                yield from drain(final=False)
+    if pool:
+        yield from drain(final=True)
+
+
+def pretrain(paths, obs_mode="full", epochs=5, batch_size=4096, learning_rate=1e-3, device="auto", seed=0,
+             features_mode="mlp"):
+    """训练并返回 MaskablePPO 模型（只动策略分支，价值分支留给 PPO）"""
+    model = MaskablePPO(
+        "MlpPolicy",
+        logic.SpiderEnv(obs_mode=obs_mode),
+        device=device,
+        policy_kwargs=(features.policy_kwargs(obs_mode) if features_mode == "embed"
+                       else dict(net_arch=[256, 256, 256])),
+        seed=seed,
+    )
+    policy = model.policy
+    policy.set_training_mode(True)
+    optimizer = torch.optim.Adam(policy.parameters(), lr=learning_rate)
+    rng = np.random.default_rng(seed)
+
+    for epoch in range(epochs):
+        total_loss, correct, seen = 0.0, 0, 0
+        for obs, masks, actions in iter_batches(paths, batch_size, obs_mode, rng=rng):
+            obs_tensor, _ = policy.obs_to_tensor(obs)
+            distribution = policy.get_distribution(obs_tensor, action_masks=masks)
+            action_tensor = torch.as_tensor(actions, device=policy.device)
+            loss = -distribution.log_prob(action_tensor).mean()
+
+            optimizer.zero_grad()
+            loss.backward()
+            torch.nn.utils.clip_grad_norm_(policy.parameters(), 0.5)
+            optimizer.step()
+
+            total_loss += loss.item() * len(actions)
+            predicted = distribution.distribution.logits.argmax(dim=1)
+            correct += int((predicted == action_tensor).sum())
+            seen += len(actions)
+        if seen == 0:
+            raise ValueError("轨迹文件里没有可用的步")
+        print(f"epoch {epoch + 1}/{epochs}: loss {total_loss / seen:.4f}  准确率 {correct / seen:.1%}  ({seen} 步)")
+
+    policy.set_training_mode(False)
+    return model
+
+
+def main():
+    parser = argparse.ArgumentParser(description="从轨迹文件做行为克隆预训练")
+    parser.add_argument("paths", nargs="+", help="轨迹文件（支持通配符）")
+    parser.add_argument("--obs-mode", choices=logic.OBS_MODES, default="full")
+    parser.add_argument("--epochs", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=4096)
+    parser.add_argument("--lr", type=float, default=1e-3)
+    parser.add_argument("--device", default="auto", help="auto 时有 GPU 用 GPU，否则用 CPU")
+    parser.add_argument("--features", choices=["mlp", "embed"], default="mlp", help="与 train.py --features 保持一致")
+    parser.add_argument("--out", default="pretrained")
+    args = parser.parse_args()
+    if args.features == "embed" and args.obs_mode not in features.EMBED_OBS_MODES:
+        parser.error(f"--features embed 只支持 {' / '.join(features.EMBED_OBS_MODES)} 观察编码")
+
+    paths = sorted({p for pattern in args.paths for p in glob.glob(pattern)})
+    if not paths:
+        parser.error("没有找到轨迹文件")
+    model = pretrain(paths, args.obs_mode, args.epochs, args.batch_size, args.lr, args.device,
+                     features_mode=args.features)
+    model.save(args.out)
+    print(f"已保存 -> {args.out}.zip，用 python train.py --init-from {args.out}.zip 接着做 PPO")
+
+
+if __name__ == "__main__":
+    main()
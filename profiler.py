@@ -0,0 +1,130 @@
+"""
+SpiderEnv 的分阶段计时器
+
+开启后把 env 的几个热点方法换成带计时的同名实例属性，按阶段累计调用次数与“自身耗时”
+（扣掉嵌套在里面的其它阶段，各阶段相加正好是总耗时）；不开启时 env 上什么都不挂，没有任何额外开销。
+rules 阶段（SpiderEnv._step）的自身耗时就是奖励结算、退回检测、循环检测等没有单独拆出来的逻辑，
+step 阶段的自身耗时是外层的宏动作循环与对局结束时的统计。
+
+    env = SpiderEnv(profile=True)
+    ...
+    env.profiler.report()   # {"action_masks": {"calls": ..., "ms": ..., "share": ...}, ...}
+"""
+import time
+
+# (阶段名, SpiderEnv 方法名)
+PHASES = (
+    ("step", "step"),
+    ("rules", "_step"),
+    ("macro", "_macro_action"),
+    ("action_masks", "action_masks"),
+    ("check_move", "_check_move"),
+    ("move_cards", "_move_cards"),
+    ("flip", "_flip_top"),
+    ("remove_sequence", "_remove_complete_sequence"),
+    ("deal", "_deal_cards"),
+    ("get_obs", "_get_obs"),
+)
+
+
+class PhaseProfiler:
+    def __init__(self):
+        self.calls = {}
+        self.self_ns = {}
+        # 当前这层调用里，嵌套阶段已经花掉的时间
+        self._inner = 0
+
+    def attach(self, env):
+        """给 env 的各阶段方法套上计时"""
+        for phase, name in PHASES:
+            setattr(env, name, _Timed(self, phase, env, name))
+        self.reset()
+
+    def reset(self):
+        self.calls = {phase: 0 for phase, _ in PHASES}
+        self.self_ns = {phase: 0 for phase, _ in PHASES}
+        self._inner = 0
+
+    def report(self):
+        """各阶段的调用次数、自身耗时（毫秒）与占总耗时的比例"""
+        total = sum(self.self_ns.values()) or 1
+        return {
+            phase: {
+                "calls": self.calls[phase],
+                "ms": self.self_ns[phase] / 1e6,
+                "share": self.self_ns[phase] / total,
+            }
+            for phase, _ in PHASES
+        }
+
+
+class _Timed:
+    """
+    带计时的 env.name：调用类上的原方法，耗时记进 profiler 的 phase
+    用类而不用闭包，是为了能被 pickle（shm 向量环境的 get_attr 会把 env.action_masks 发回主进程）
+    """
+
+    def __init__(self, profiler, phase, env, name):
+        self.profiler = profiler
+        self.phase = phase
+        self.env = env
+        self.fn = getattr(type(env), name)
+
+    def __call__(self, *args, **kwargs):
+        profiler = self.profiler
+        outer = profiler._inner
+        profiler._inner = 0
+        start = time.perf_counter_ns()
+        try:
+            return self.fn(self.env, *args, **kwargs)
+        finally:
+            elapsed = time.perf_counter_ns() - start
+            profiler.self_ns[self.phase] += elapsed - profiler._inner
+            profiler.calls[self.phase] += 1
+            profiler._inner = outer + elapsed
+
+
+def format_report(report):
+    lines = [f"{'阶段':<16}{'调用':>10}{'总耗时 ms':>12}{'单次 us':>10}{'占比':>8}"]
+    for phase, row in sorted(report.items(), key=lambda kv: -kv[1]["ms"]):
+        per_call = row["ms"] * 1000 / row["calls"] if row["calls"] else 0.0
+        lines.append(f"{phase:<16}{row['calls']:>10}{row['ms']:>12.1f}{per_call:>10.2f}{row['share']:>8.1%}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    import numpy as np
+
+    from logic import SpiderEnv
+
+    # 随机合法走法跑几局，打印每局统计与累计的分阶段耗时
+    env = SpiderEnv(profile=True)
+    rng = np.random.default_rng(0)
+    for seed in range(20):
+        env.reset(seed=seed)
+        while True:
+            legal = np.flatnonzero(env.action_masks())
+            if len(legal) == 0:
+                break
+            _, _, terminated, truncated, _ = env.step(int(rng.choice(legal)))
+            if terminated or truncated:
+                break
+        print(f"seed {seed:>3}: {env.episode_stats()}")
+    print(format_report(env.profiler.report()))
+
+    # shm 向量环境：MaskablePPO 会 has_attr / get_attr("action_masks")，计时后的方法要能 pickle 回主进程
+    from functools import partial
+
+    from shm_vec_env import SharedMemVecEnv
+
+    vec_env = SharedMemVecEnv([partial(SpiderEnv, profile=True) for _ in range(2)], n_workers=2)
+    try:
+        vec_env.reset()
+        assert vec_env.has_attr("action_masks")
+        for _ in range(20):
+            masks = vec_env.action_masks()
+            vec_env.step(np.array([int(rng.choice(np.flatnonzero(m))) for m in masks]))
+        reports = vec_env.env_method("episode_stats")
+        print(f"shm + profile: {len(reports)} 个环境正常推进")
+    finally:
+        vec_env.close()
@@ -0,0 +1,345 @@
+"""
+对局轨迹的流式记录与重放
+
+文件格式（只追加、按块分列存储）：
+    [块][块][块]...
+    每块 = b"SPTR" + uint32 头长度 + JSON 头 + 各列 zlib 压缩后的原始字节
+    JSON 头: {"table": "steps" | "episodes", "rows": n, "columns": [[名字, dtype, 每行形状, 压缩后字节数], ...]}
+
+steps 表每步一行：所属对局、局内步号、动作、奖励、打包的动作掩码（101 位 -> 13 字节）、
+执行动作前的局面（encode_variable 的 114 个牌符号）和剩余牌堆张数。
+episodes 表每局一行：deal id（没有为 -1）和整副牌（未知时全 0，例如实时助手）。
+
+写入端攒满 chunk_rows 行就压缩落盘，内存占用与记录总量无关；读取端逐块解压，
+训练数据可以边读边用。知道整副牌时，重放器按动作序列在 SpiderEnv 上重走到任意一步，
+得到完整局面（包括盖牌）；否则用记录的牌符号载入可见局面。观察不落盘，需要时按任意 obs_mode 现算。
+
+用法:
+    python recorder.py info runs/train.sptr
+    python recorder.py show runs/train.sptr --episode 3 --step 40
+"""
+import argparse
+import json
+import struct
+import zlib
+
+import gymnasium as gym
+import numpy as np
+
+import logic
+from cards import VAL_MASK, SUIT_SHIFT
+
+MAGIC = b"SPTR"
+
+STEP_COLUMNS = [
+    ("episode", np.uint32, ()),
+    ("t", np.uint16, ()),
+    ("action", np.uint8, ()),
+    ("reward", np.float32, ()),
+    ("mask", np.uint8, (13,)),
+    ("state", np.int8, (logic.VARIABLE_SIZE,)),
+    ("deck_size", np.uint8, ()),
+]
+EPISODE_COLUMNS = [
+    ("episode", np.uint32, ()),
+    ("deal_id", np.int64, ()),
+    ("deck", np.int8, (104,)),
+]
+
+
+class _Table:
+    """一张表的写缓冲：预分配 chunk_rows 行"""
+
+    def __init__(self, name, columns, chunk_rows):
+        self.name = name
+        self.columns = columns
+        self.buffers = {col: np.zeros((chunk_rows, *shape), dtype=dtype) for col, dtype, shape in columns}
+        self.rows = 0
+
+    def full(self):
+        return self.rows == len(self.buffers["episode"])
+
+
+class TrajectoryWriter:
+    """
+    追加写入轨迹文件
+    begin_episode 开新局，record / append 记一步；步缓冲满 chunk_rows 行时压缩落盘
+    """
+
+    def __init__(self, path, chunk_rows=4096, level=1):
+        self.path = path
+        self.level = level
+        self._file = open(path, "ab")
+        self._steps = _Table("steps", STEP_COLUMNS, chunk_rows)
+        self._episodes = _Table("episodes", EPISODE_COLUMNS, 256)
+        # 续写已有文件时，对局编号接着往后排
+        self.episode = TrajectoryReader(path).num_episodes - 1 if self._file.tell() else -1
+        self.t = 0
+
+    def begin_episode(self, deal_id=None, deck=None):
+        self.episode += 1
+        self.t = 0
+        table = self._episodes
+        row = table.rows
+        table.buffers["episode"][row] = self.episode
+        table.buffers["deal_id"][row] = -1 if deal_id is None else deal_id
+        table.buffers["deck"][row] = 0 if deck is None else deck
+        table.rows += 1
+        if table.full():
+            self._flush(table)
+
+    def record(self, env, action, reward, mask=None):
+        """记下 env 当前局面（动作执行之前）上的一步"""
+        if mask is None:
+            mask = env.action_masks()
+        self.append(action, reward, mask, logic.encode_variable(env.cards, env.lengths, env.hidden), env.deck_size)
+
+    def append(self, action, reward, mask, state, deck_size):
+        """直接写一行：state 是 encode_variable 的牌符号"""
+        if self.episode < 0:
+            raise RuntimeError("记录步之前需要先 begin_episode")
+        table = self._steps
+        row = table.rows
+        buffers = table.buffers
+        buffers["episode"][row] = self.episode
+        buffers["t"][row] = self.t
+        buffers["action"][row] = action
+        buffers["reward"][row] = reward
+        buffers["mask"][row] = np.packbits(mask)
+        buffers["state"][row] = state
+        buffers["deck_size"][row] = deck_size
+        table.rows += 1
+        self.t += 1
+        if table.full():
+            self.flush()
+
+    def _flush(self, table):
+        if table.rows == 0:
+            return
+        header = {"table": table.name, "rows": table.rows, "columns": []}
+        payload = []
+        for col, dtype, shape in table.columns:
+            data = zlib.compress(table.buffers[col][:table.rows].tobytes(), self.level)
+            header["columns"].append([col, np.dtype(dtype).str, list(shape), len(data)])
+            payload.append(data)
+        head = json.dumps(header).encode()
+        self._file.write(MAGIC + struct.pack("<I", len(head)) + head)
+        for data in payload:
+            self._file.write(data)
+        self._file.flush()
+        table.rows = 0
+
+    def flush(self):
+        # 先落对局表：读取端拿到某局的步时，该局的 deal / 牌一定已经在文件里
+        self._flush(self._episodes)
+        self._flush(self._steps)
+
+    def close(self):
+        if not self._file.closed:
+            self.flush()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class RecordingWrapper(gym.Wrapper):
+    """
+    把 SpiderEnv 的每一步写进 TrajectoryWriter（局面与掩码取动作执行之前的）
+    env 开了 macro 时每行是一个决策点，自动走的子步不单独记录，奖励是累加后的
+    """
+
+    def __init__(self, env, writer):
+        super().__init__(env)
+        self.writer = writer
+
+    def reset(self, **kwargs):
+        obs, info = self.env.reset(**kwargs)
+        spider = self.env.unwrapped
+        self.writer.begin_episode(spider.deal_id, spider.deck)
+        return obs, info
+
+    def step(self, action):
+        spider = self.env.unwrapped
+        mask = spider.action_masks()
+        state = logic.encode_variable(spider.cards, spider.lengths, spider.hidden)
+        deck_size = spider.deck_size
+        obs, reward, terminated, truncated, info = self.env.step(action)
+        self.writer.append(action, reward, mask, state, deck_size)
+        return obs, reward, terminated, truncated, info
+
+    def close(self):
+        self.writer.close()
+        super().close()
+
+
+def _read_chunks(path):
+    """逐块产出 (表名, 行数, [(列名, dtype, 形状, 文件偏移, 字节数), ...])"""
+    with open(path, "rb") as f:
+        while True:
+            magic = f.read(4)
+            if not magic:
+                return
+            if magic != MAGIC:
+                raise ValueError(f"{path} 在偏移 {f.tell() - 4} 处不是轨迹块")
+            (size,) = struct.unpack("<I", f.read(4))
+            header = json.loads(f.read(size))
+            offset = f.tell()
+            columns = []
+            for col, dtype, shape, nbytes in header["columns"]:
+                columns.append((col, np.dtype(dtype), tuple(shape), offset, nbytes))
+                offset += nbytes
+            f.seek(offset)
+            yield header["table"], header["rows"], columns
+
+
+class TrajectoryReader:
+    """读取轨迹文件：逐块流式读取步数据，或者重建任意一步的局面"""
+
+    def __init__(self, path):
+        self.path = path
+        self._chunks = list(_read_chunks(path))
+        self._episodes = None
+
+    @property
+    def num_steps(self):
+        return sum(rows for table, rows, _ in self._chunks if table == "steps")
+
+    @property
+    def num_episodes(self):
+        return sum(rows for table, rows, _ in self._chunks if table == "episodes")
+
+    def _load(self, f, rows, columns, names=None):
+        out = {}
+        for col, dtype, shape, offset, nbytes in columns:
+            if names is not None and col not in names:
+                continue
+            f.seek(offset)
+            out[col] = np.frombuffer(zlib.decompress(f.read(nbytes)), dtype=dtype).reshape(rows, *shape)
+        return out
+
+    def iter_steps(self, columns=None):
+        """逐块产出步数据 dict（列名 -> 数组），只解压 columns 里列出的列"""
+        with open(self.path, "rb") as f:
+            for table, rows, cols in self._chunks:
+                if table == "steps":
+                    yield self._load(f, rows, cols, columns)
+
+    def episodes(self):
+        """整张对局表（每局一行，数据量很小）"""
+        if self._episodes is None:
+            parts = []
+            with open(self.path, "rb") as f:
+                for table, rows, cols in self._chunks:
+                    if table == "episodes":
+                        parts.append(self._load(f, rows, cols))
+            self._episodes = {
+                col: np.concatenate([p[col] for p in parts]) if parts else np.zeros((0, *shape), dtype=dtype)
+                for col, dtype, shape in EPISODE_COLUMNS
+            }
+        return self._episodes
+
+    def episode_steps(self, episode):
+        """某一局的全部步数据"""
+        parts = []
+        for chunk in self.iter_steps():
+            sel = chunk["episode"] == episode
+            if sel.any():
+                parts.append({col: arr[sel] for col, arr in chunk.items()})
+        if not parts:
+            raise IndexError(f"文件里没有第 {episode} 局的步数据")
+        return {col: np.concatenate([p[col] for p in parts]) for col in parts[0]}
+
+    def rebuild(self, episode, t, env=None):
+        """
+        返回处于第 episode 局第 t 步（执行该步动作之前）局面的 SpiderEnv
+        有整副牌时按动作重走，局面完整；否则按记录的牌符号载入，盖牌点数未知
+        macro 模式录的轨迹要传入同样 macro 规则的 env，重走时才会补上自动走的子步
+        """
+        episodes = self.episodes()
+        row = np.flatnonzero(episodes["episode"] == episode)
+        if len(row) == 0:
+            raise IndexError(f"文件里没有第 {episode} 局")
+        steps = self.episode_steps(episode)
+        env = env or logic.SpiderEnv()
+        deck = episodes["deck"][row[0]]
+        if deck.any():
+            env._load_deck(np.array(deck))
+            env.current_step = 0
+            for action in steps["action"][:t].tolist():
+                env.make_move(action)
+                for _ in range(logic.MACRO_LIMIT if env.macro else 0):
+                    sub_action = env._macro_action()
+                    if sub_action is None:
+                        break
+                    env.make_move(sub_action)
+        else:
+            cards, lengths, hidden = logic.decode_variable(steps["state"][t])
+            env.set_state(tokens_to_columns(cards, lengths, hidden), int(steps["deck_size"][t]) // 10)
+        return env
+
+
+def tokens_to_columns(cards, lengths, hidden):
+    """decode_variable 的结果转成 set_state 用的字典列表（盖牌点数未知写 -1）"""
+    columns = []
+    for i in range(10):
+        columns.append([
+            {'val': -1, 'suit': 0, 'face_up': False} if j < hidden[i]
+            else {'val': c & VAL_MASK, 'suit': c >> SUIT_SHIFT, 'face_up': True}
+            for j, c in enumerate(cards[i, :lengths[i]].tolist())
+        ])
+    return columns
+
+
+def step_observations(chunk, obs_mode="full"):
+    """由一块步数据里的牌符号直接算出观察（不用重走对局），返回 (rows, obs_dim) 的 int8 数组"""
+    space = logic.observation_space(obs_mode)
+    if obs_mode == "variable":
+        return np.array(chunk["state"])
+    out = np.zeros((len(chunk["state"]), *space.shape), dtype=np.int8)
+    for k, tokens in enumerate(chunk["state"]):
+        cards, lengths, hidden = logic.decode_variable(tokens)
+        if obs_mode == "full":
+            logic.encode_obs(cards, lengths, hidden, out[k].reshape(10, logic.OBS_DEPTH, 2))
+        elif obs_mode == "index":
+            out[k] = logic.encode_index(cards, lengths, hidden)
+        else:
+            runs = [logic.run_length(cards[i], lengths[i], hidden[i]) for i in range(10)]
+            out[k] = logic.encode_compact(cards, lengths, hidden, runs, int(chunk["deck_size"][k]))
+    return out
+
+
+def step_masks(chunk):
+    """解包一块步数据里的动作掩码，返回 (rows, 101) 的布尔数组"""
+    return np.unpackbits(chunk["mask"], axis=1, count=101).astype(bool)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="查看轨迹文件")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_info = sub.add_parser("info", help="统计局数、步数与奖励")
+    p_info.add_argument("path")
+    p_show = sub.add_parser("show", help="重建并打印某一步的局面")
+    p_show.add_argument("path")
+    p_show.add_argument("--episode", type=int, default=0)
+    p_show.add_argument("--step", type=int, default=0)
+    args = parser.parse_args()
+
+    reader = TrajectoryReader(args.path)
+    if args.cmd == "info":
+        total = 0.0
+        for chunk in reader.iter_steps(["reward"]):
+            total += float(chunk["reward"].sum())
+        print(f"{reader.num_episodes} 局，{reader.num_steps} 步，总奖励 {total:.1f}")
+    else:
+        steps = reader.episode_steps(args.episode)
+        env = reader.rebuild(args.episode, args.step)
+        env.render()
+        print(f"动作: {int(steps['action'][args.step])}  奖励: {float(steps['reward'][args.step]):.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+import multiprocessing as mp
+
+import numpy as np
+from stable_baselines3.common.vec_env.base_vec_env import CloudpickleWrapper, VecEnv
+
+
+def _shared(ctx, dtype, shape):
+    """分配一块可以被子进程继承的共享内存，返回 (RawArray, 形状, dtype)"""
+    dtype = np.dtype(dtype)
+    raw = ctx.RawArray("b", int(np.prod(shape)) * dtype.itemsize)
+    return raw, shape, dtype
+
+
+def _view(block):
+    raw, shape, dtype = block
+    return np.frombuffer(raw, dtype=dtype).reshape(shape)
+
+
+def _worker(remote, parent_remote, env_fns_wrapper, lo, blocks):
+    """
+    每个工作进程负责 [lo, lo+len(env_fns)) 这一段环境，
+    观察 / 奖励 / done / 动作掩码直接写进共享内存，管道里只传命令和非空的 info
+    """
+    from stable_baselines3.common.env_util import is_wrapped
+
+    parent_remote.close()
+    envs = [fn() for fn in env_fns_wrapper.var]
+    hi = lo + len(envs)
+    obs, rewards, dones, masks, actions = (_view(b)[lo:hi] for b in blocks)
+    mask_fns = [env.get_wrapper_attr("action_masks") for env in envs]
+
+    while True:
+        try:
+            cmd, data = remote.recv()
+            if cmd == "step":
+                infos = []
+                for k, env in enumerate(envs):
+                    ob, reward, terminated, truncated, info = env.step(actions[k])
+                    done = terminated or truncated
+                    if done:
+                        info["TimeLimit.truncated"] = truncated and not terminated
+                        info["terminal_observation"] = ob
+                        ob, _ = env.reset()
+                    obs[k] = ob
+                    rewards[k] = reward
+                    dones[k] = done
+                    masks[k] = mask_fns[k]()
+                    # 大多数步的 info 只有空的 msg，不回传，主进程补成空字典
+                    if done or any(info.values()):
+                        infos.append((lo + k, info))
+                remote.send(infos)
+            elif cmd == "reset":
+                for k, env in enumerate(envs):
+                    seed, options = data[k]
+                    maybe_options = {"options": options} if options else {}
+                    obs[k], _ = env.reset(seed=seed, **maybe_options)
+                    masks[k] = mask_fns[k]()
+                remote.send(None)
+            elif cmd == "close":
+                for env in envs:
+                    env.close()
+                remote.close()
+                break
+            elif cmd == "env_method":
+                indices, name, args, kwargs = data
+                remote.send([envs[i - lo].get_wrapper_attr(name)(*args, **kwargs) for i in indices])
+            elif cmd == "get_attr":
+                indices, name = data
+                remote.send([envs[i - lo].get_wrapper_attr(name) for i in indices])
+            elif cmd == "set_attr":
+                indices, name, value = data
+                for i in indices:
+                    setattr(envs[i - lo], name, value)
+                remote.send([])
+            elif cmd == "is_wrapped":
+                indices, wrapper_class = data
+                remote.send([is_wrapped(envs[i - lo], wrapper_class) for i in indices])
+            else:
+                raise NotImplementedError(f"`{cmd}` is not implemented in the worker")
+        except (EOFError, KeyboardInterrupt):
+            break
+
+
+class SharedMemVecEnv(VecEnv):
+    """
+    多进程环境池：n_envs 个环境平均分给 n_workers 个进程，每个进程顺序推进自己那一段。
+    与 SubprocVecEnv 不同，观察、奖励、done 和动作掩码都通过共享内存交换，
+    不经过管道 pickle，环境数远大于核数时开销依然很小。
+    """
+
+    def __init__(self, env_fns, n_workers=None, start_method=None):
+        n_envs = len(env_fns)
+        n_workers = min(n_workers or mp.cpu_count(), n_envs)
+        if start_method is None:
+            start_method = "forkserver" if "forkserver" in mp.get_all_start_methods() else "spawn"
+        ctx = mp.get_context(start_method)
+
+        # 在主进程里临时建一个环境，只为读取空间定义
+        probe = env_fns[0]()
+        observation_space, action_space = probe.observation_space, probe.action_space
+        mask_size = len(probe.get_wrapper_attr("action_masks")())
+        probe.close()
+
+        self._blocks = [
+            _shared(ctx, observation_space.dtype, (n_envs, *observation_space.shape)),
+            _shared(ctx, np.float32, (n_envs,)),
+            _shared(ctx, bool, (n_envs,)),
+            _shared(ctx, bool, (n_envs, mask_size)),
+            _shared(ctx, np.int64, (n_envs,)),
+        ]
+        self._obs, self._rewards, self._dones, self._masks, self._actions = (_view(b) for b in self._blocks)
+
+        # 按工作进程切分环境下标
+        bounds = np.linspace(0, n_envs, n_workers + 1).astype(int)
+        self._slices = [(int(lo), int(hi)) for lo, hi in zip(bounds[:-1], bounds[1:])]
+        self.remotes, self.processes = [], []
+        for lo, hi in self._slices:
+            remote, work_remote = ctx.Pipe()
+            args = (work_remote, remote, CloudpickleWrapper(env_fns[lo:hi]), lo, self._blocks)
+            # daemon=True：主进程崩溃时不会留下挂起的子进程
+            process = ctx.Process(target=_worker, args=args, daemon=True)
+            process.start()
+            work_remote.close()
+            self.remotes.append(remote)
+            self.processes.append(process)
+        self.closed = False
+
+        super().__init__(n_envs, observation_space, action_space)
+
+    def _worker_of(self, index):
+        for w, (lo, hi) in enumerate(self._slices):
+            if lo <= index < hi:
+                return w
+        raise IndexError(index)
+
+    def _call(self, cmd, indices, *payload):
+        """把命令按下标分发给对应的工作进程，结果按调用方给出的下标顺序拼回（下标可以乱序）"""
+        indices = list(self._get_indices(indices))
+        # 每个工作进程：(要处理的下标, 这些下标在 indices 里的位置)
+        groups = {}
+        for pos, i in enumerate(indices):
+            idx, positions = groups.setdefault(self._worker_of(i), ([], []))
+            idx.append(i)
+            positions.append(pos)
+        for w, (idx, _) in groups.items():
+            self.remotes[w].send((cmd, (idx, *payload)))
+        results = [None] * len(indices)
+        for w, (_, positions) in groups.items():
+            for pos, result in zip(positions, self.remotes[w].recv()):
+                results[pos] = result
+        return results
+
+    def reset(self):
+        for w, (lo, hi) in enumerate(self._slices):
+            self.remotes[w].send(("reset", [(self._seeds[i], self._options[i]) for i in range(lo, hi)]))
+        for remote in self.remotes:
+            remote.recv()
+        self._reset_seeds()
+        self._reset_options()
+        return self._obs.copy()
+
+    def step_async(self, actions):
+        self._actions[:] = actions
+        for remote in self.remotes:
+            remote.send(("step", None))
+
+    def step_wait(self):
+        infos = [{} for _ in range(self.num_envs)]
+        for remote in self.remotes:
+            for i, info in remote.recv():
+                infos[i] = info
+        return self._obs.copy(), self._rewards.copy(), self._dones.copy(), infos
+
+    def action_masks(self):
+        """工作进程在每次 step / reset 后已经把掩码写进共享内存"""
+        return self._masks.copy()
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        if method_name == "action_masks":
+            masks = self.action_masks()
+            return [masks[i] for i in self._get_indices(indices)]
+        return self._call("env_method", indices, method_name, method_args, method_kwargs)
+
+    def get_attr(self, attr_name, indices=None):
+        return self._call("get_attr", indices, attr_name)
+
+    def set_attr(self, attr_name, value, indices=None):
+        self._call("set_attr", indices, attr_name, value)
+
+    def env_is_wrapped(self, wrapper_class, indices=None):
+        return self._call("is_wrapped", indices, wrapper_class)
+
+    def close(self):
+        if self.closed:
+            return
+        for remote in self.remotes:
+            remote.send(("close", None))
+        for process in self.processes:
+            process.join()
+        self.closed = True
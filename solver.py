@@ -0,0 +1,218 @@
+"""
+蜘蛛纸牌求解器（完全信息：盖牌和牌堆都按真实牌局展开）
+
+在 SpiderEnv 的规则上做深度优先搜索：
+- 用 make_move / unmake_move 就地推进与回退，不复制环境
+- 置换表以 state_key 为键，记下到达该局面时已走的移动步数，更晚到达的重复局面直接剪掉
+- 每个局面的候选走法按启发式排序（收牌 > 同花色叠放 / 翻牌 > 普通叠放 > 移到空列 > 发牌），
+  整列搬到空列这类无意义的走法不展开
+- 节点数 / 时间预算用完即停，区分“已证明无解”与“预算内没找到”
+
+求出的解是 env 的 0-100 动作序列，移动步数不超过 env 的 1000 步上限，可直接在同一局上重放；
+可以作为专家示范，也可以作为 PPO 胜率的上限参考。
+
+用法:
+    python solver.py --seeds 0 100 --out solutions.jsonl
+    python solver.py --corpus deals.npy --seeds 0 1000 --workers 8 --max-nodes 500000
+    python solver.py --seeds 0 5000 --record expert.sptr   # 解出的对局写成示范轨迹
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import logic
+from cards import VAL_MASK
+from recorder import RecordingWrapper, TrajectoryWriter
+
+# 与 env 的截断上限一致：发牌不计步
+MAX_MOVES = 1000
+
+
+def _won(env):
+    return env.deck_size == 0 and not any(env.lengths)
+
+
+def _ordered_moves(env):
+    """当前局面的合法走法，按启发式分数升序排列（列表末尾最优，直接 pop）"""
+    lengths, hidden, runs = env.lengths, env.hidden, env._runs
+    scored = []
+    for action in np.flatnonzero(env.action_masks()).tolist():
+        if action == 100:
+            scored.append((-100, action))
+            continue
+        src, dest = action // 10, action % 10
+        n, run = lengths[src], runs[src]
+        rest = n - run
+        if lengths[dest] == 0:
+            # 整列搬到空列不改变任何东西
+            if rest == 0:
+                continue
+            score = 30 if rest == hidden[src] else -20
+        else:
+            score = 0
+            head = int(env.cards[src, rest])
+            if int(env.cards[dest, lengths[dest] - 1]) == head + 1:
+                # 同花色接上：能凑成 K-A 的最优先
+                score += 100 if runs[dest] + run >= 13 else 20
+            elif rest > hidden[src] and (int(env.cards[src, rest - 1]) & VAL_MASK) == (head & VAL_MASK) + 1:
+                # 只是从一张“点数大 1”的牌挪到另一张上，没有任何收获
+                score -= 15
+            if rest == hidden[src] and rest > 0:
+                score += 30
+            elif rest == 0:
+                score += 15
+        scored.append((score, action))
+    scored.sort()
+    return [action for _, action in scored]
+
+
+def solve(env, max_nodes=200_000, time_limit=None):
+    """
+    从 env 当前局面出发求解，返回 dict：
+    - status: "solved" / "unsolvable"（搜索空间已穷尽）/ "budget"（预算用完）
+    - actions: 求得的动作序列（未解出时为空）
+    - nodes: 展开的局面数，seconds: 用时
+    env 在返回前恢复到调用时的局面
+    """
+    start = time.perf_counter()
+    deadline = None if time_limit is None else start + time_limit
+    blob = env.snapshot()
+
+    # 置换表：局面 -> 到达时已走的移动步数
+    seen = {env.state_key: 0}
+    actions, undos = [], []
+    moves = 0
+    frontier = [_ordered_moves(env)]
+    nodes = 0
+    status = "unsolvable"
+
+    if _won(env):
+        status = "solved"
+        frontier = []
+    while frontier:
+        candidates = frontier[-1]
+        if not candidates:
+            # 该局面所有走法都试过了，回退一步
+            frontier.pop()
+            if undos:
+                env.unmake_move(undos.pop())
+                if actions.pop() != 100:
+                    moves -= 1
+            continue
+
+        action = candidates.pop()
+        next_moves = moves + (action != 100)
+        if next_moves > MAX_MOVES:
+            continue
+        undo = env.make_move(action)
+        key = env.state_key
+        if seen.get(key, MAX_MOVES + 1) <= next_moves:
+            env.unmake_move(undo)
+            continue
+        seen[key] = next_moves
+        undos.append(undo)
+        actions.append(action)
+        moves = next_moves
+        nodes += 1
+
+        if _won(env):
+            status = "solved"
+            break
+        if nodes >= max_nodes or (deadline is not None and (nodes & 255) == 0 and time.perf_counter() > deadline):
+            status = "budget"
+            break
+        frontier.append(_ordered_moves(env))
+
+    env.restore(blob)
+    return {
+        "status": status,
+        "actions": actions if status == "solved" else [],
+        "nodes": nodes,
+        "seconds": time.perf_counter() - start,
+    }
+
+
+# 每个工作进程只建一次环境
+_worker_env = None
+
+
+def _init_worker(num_suits, corpus):
+    global _worker_env
+    _worker_env = logic.SpiderEnv(num_suits=num_suits, deal_corpus=corpus)
+
+
+def _solve_one(job):
+    seed, max_nodes, time_limit = job
+    env = _worker_env
+    if env.deal_corpus is not None:
+        env.reset(seed=seed, options={"deal_id": seed})
+    else:
+        env.reset(seed=seed)
+    result = solve(env, max_nodes=max_nodes, time_limit=time_limit)
+    result["seed"] = seed
+    result["deal_id"] = env.deal_id
+    return result
+
+
+def solve_deals(seeds, num_suits=1, corpus=None, max_nodes=200_000, time_limit=None, workers=None):
+    """
+    在进程池里并行求解一批牌局，按 seeds 的顺序逐个产出结果
+    有语料时 seeds 即 deal id，否则是 env.reset 的种子
+    """
+    jobs = [(seed, max_nodes, time_limit) for seed in seeds]
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count(),
+                             initializer=_init_worker, initargs=(num_suits, corpus)) as pool:
+        yield from pool.map(_solve_one, jobs, chunksize=1)
+
+
+def record_solution(env, result):
+    """在 (RecordingWrapper 包着的) env 上按解重走一遍，轨迹随之写入文件"""
+    if env.unwrapped.deal_corpus is not None:
+        env.reset(seed=result["seed"], options={"deal_id": result["seed"]})
+    else:
+        env.reset(seed=result["seed"])
+    for action in result["actions"]:
+        env.step(action)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="蜘蛛纸牌求解器")
+    parser.add_argument("--seeds", type=int, nargs=2, default=[0, 100], metavar=("START", "STOP"),
+                        help="求解 [START, STOP) 的种子（或语料 deal id）")
+    parser.add_argument("--suits", type=int, choices=[1, 2, 4], default=1)
+    parser.add_argument("--corpus", default=None, help="牌局语料路径")
+    parser.add_argument("--max-nodes", type=int, default=200_000, help="每局最多展开的局面数")
+    parser.add_argument("--time-limit", type=float, default=None, help="每局最多用时（秒）")
+    parser.add_argument("--workers", type=int, default=None, help="进程数，默认为 CPU 核数")
+    parser.add_argument("--out", default="solutions.jsonl")
+    parser.add_argument("--record", default=None, help="把解出的对局追加写进这个轨迹文件")
+    args = parser.parse_args()
+
+    recording = None
+    if args.record:
+        recording = RecordingWrapper(logic.SpiderEnv(num_suits=args.suits, deal_corpus=args.corpus),
+                                     TrajectoryWriter(args.record))
+    counts = {"solved": 0, "unsolvable": 0, "budget": 0}
+    with open(args.out, "w", encoding="utf-8") as f:
+        for result in solve_deals(range(*args.seeds), args.suits, args.corpus,
+                                  args.max_nodes, args.time_limit, args.workers):
+            counts[result["status"]] += 1
+            f.write(json.dumps(result) + "\n")
+            if recording is not None and result["status"] == "solved":
+                record_solution(recording, result)
+            print(f"seed {result['seed']:>6}: {result['status']:<10} "
+                  f"{len(result['actions']):>4} 步  {result['nodes']:>7} 节点  {result['seconds']:.1f}s")
+
+    if recording is not None:
+        recording.close()
+    total = sum(counts.values())
+    print(f"\n共 {total} 局：解出 {counts['solved']}，无解 {counts['unsolvable']}，超预算 {counts['budget']}"
+          f"（解出率 {counts['solved'] / max(total, 1):.1%}）-> {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+实时助手的预测缓存
+
+助手每走一步，常常要停下来等用户输入刚翻开的牌。翻开的牌只可能是 13 种点数之一，
+所以等输入的这段时间里，后台线程先把每种可能点数下的局面都载入环境、算好推荐动作，
+按局面的 state_key 存起来；用户输完后局面对上了就直接给出动作，重型的规划器也不用让用户干等。
+
+发牌一次出 10 张牌，组合太多，不做预测。
+"""
+import threading
+from itertools import product
+
+from logic import SpiderEnv
+
+# 单花色每种点数共 8 张
+COPIES = 8
+
+
+def reveal_candidates(columns):
+    """按“还剩几张没露面”从多到少排列的可能点数（已经露面 8 张的点数不可能再翻出来）"""
+    seen = [0] * 14
+    for col in columns:
+        for card in col:
+            if card["face_up"] and 1 <= card["val"] <= 13:
+                seen[card["val"]] += 1
+    values = [v for v in range(1, 14) if seen[v] < COPIES]
+    return sorted(values, key=lambda v: seen[v])
+
+
+class Speculator:
+    """
+    decide(env) -> action 是助手的决策函数（策略网络或规划器）
+    start 在后台线程里逐个假设局面调用 decide，take 取出与当前局面匹配的结果
+    后台线程有自己的 env；take 会先停掉后台线程，之后主线程才能安全地用同一个 decide
+    """
+
+    def __init__(self, decide):
+        self.decide = decide
+        self.env = SpiderEnv()
+        self.cache = {}
+        self._thread = None
+        self._stop = threading.Event()
+
+    def start(self, columns, deals_left, reveal_cols):
+        """reveal_cols 这几列的顶牌刚翻开、点数未知：枚举各种点数组合，提前算好每个局面的动作"""
+        self.stop()
+        self.cache = {}
+        if not reveal_cols:
+            return
+        values = reveal_candidates(columns)
+        # 先复制一份，用户随后修改 columns 不影响后台线程
+        base = [[dict(card) for card in col] for col in columns]
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(base, deals_left, reveal_cols, values), daemon=True)
+        self._thread.start()
+
+    def _run(self, columns, deals_left, reveal_cols, values):
+        for combo in product(values, repeat=len(reveal_cols)):
+            if self._stop.is_set():
+                return
+            for col_idx, val in zip(reveal_cols, combo):
+                columns[col_idx][-1] = {"val": val, "suit": 0, "face_up": True}
+            try:
+                self.env.set_state(columns, deals_left)
+            except ValueError:
+                # 这种点数组合与已知的牌数矛盾
+                continue
+            if not self.env.action_masks().any():
+                continue
+            self.cache[self.env.state_key] = int(self.decide(self.env))
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def take(self, key):
+        """停掉后台线程，返回局面 key 的预算结果（没有算到时返回 None）"""
+        self.stop()
+        return self.cache.get(key)
@@ -0,0 +1,81 @@
+"""
+SpiderEnv 的增量掩码 / 哈希校验
+
+action_masks 用每列缓存的走法状态生成，_scan_action_mask 不走任何缓存、逐对从 cards / hidden 重数；
+固定种子的 1 / 2 / 4 花色随机对局里每一步都要逐位一致，另外单独覆盖发牌和收牌这两种会批量改列的情况。
+
+    python -m pytest -q test_logic.py
+"""
+import numpy as np
+import pytest
+
+from logic import SpiderEnv
+
+
+def card(val, face_up=True):
+    return {"val": val, "suit": 0, "face_up": face_up}
+
+
+def check_position(env):
+    """当前局面：掩码与参考扫描、增量哈希与重新计算一致，每个合法动作 make / unmake 后原样还原"""
+    mask = env.action_masks()
+    assert (mask == env._scan_action_mask()).all()
+    assert env.state_key == env._compute_hash()
+    before = (env.cards.copy(), list(env.lengths), list(env.hidden), env.deck_size, env.state_key)
+    for action in np.flatnonzero(mask):
+        env.unmake_move(env.make_move(int(action)))
+        assert (env.cards == before[0]).all()
+        assert before[1:] == (env.lengths, env.hidden, env.deck_size, env.state_key)
+    return mask
+
+
+@pytest.mark.parametrize("num_suits", [1, 2, 4])
+def test_masks_match_reference_on_random_games(num_suits):
+    env = SpiderEnv(num_suits=num_suits)
+    rng = np.random.default_rng(num_suits)
+    deals = 0
+    for seed in range(10):
+        env.reset(seed=seed)
+        while True:
+            mask = check_position(env)
+            legal = np.flatnonzero(mask)
+            if len(legal) == 0:
+                break
+            # 能发牌时一半概率发牌，保证每局都走到发牌
+            action = 100 if mask[100] and rng.random() < 0.5 else int(rng.choice(legal))
+            deals += action == 100
+            _, _, terminated, truncated, _ = env.step(action)
+            if terminated or truncated:
+                break
+    assert deals > 0
+
+
+def test_mask_after_completing_a_sequence():
+    # 第 0 列盖牌上是 K..2，第 1 列是 A：1->0 收走一套并翻开盖牌
+    columns = [[card(-1, False)] + [card(v) for v in range(13, 1, -1)], [card(5), card(1)]]
+    columns += [[card(v)] for v in (9, 9, 9, 9, 11, 11, 11, 11)]
+    env = SpiderEnv()
+    env.set_state(columns, 0)
+    check_position(env)
+    assert env.action_masks()[10]
+    env.step(10)
+    assert env.episode_stats()["sequences"] == 1
+    assert env.lengths[0] == 1 and env.hidden[0] == 0
+    check_position(env)
+
+
+def test_mask_after_a_deal_that_builds_a_full_run():
+    # 第 3 列是 K..2，牌堆顶给第 3 列发的是 A：发牌后列顶是整套 K-A（环境规则里发牌不自动收牌）
+    columns = [[card(v)] for v in (9, 9, 9, 9, 11, 11, 11, 11, 4, 4)]
+    columns[3] = [card(6)] + [card(v) for v in range(13, 1, -1)]
+    env = SpiderEnv()
+    env.set_state(columns, 1)
+    deck = env.deck.copy()
+    deck[env.deck_size - 1 - 3] = 1
+    deck[env.deck_size - 10:env.deck_size][deck[env.deck_size - 10:env.deck_size] == 0] = 12
+    env.deck = deck
+    env._hash = env._compute_hash()
+    check_position(env)
+    env.step(100)
+    assert env._runs[3] == 13 and env.lengths[3] == 14
+    check_position(env)
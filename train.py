@@ -1,34 +1,262 @@
+import argparse
+import json
+import os
+from collections import deque
+from functools import partial
+
+import numpy as np
+import torch
 from sb3_contrib import MaskablePPO
-from stable_baselines3.common.callbacks import CheckpointCallback
+from stable_baselines3.common.callbacks import BaseCallback, CallbackList, CheckpointCallback
 from stable_baselines3.common.env_util import make_vec_env
+from stable_baselines3.common.logger import TensorBoardOutputFormat
+from stable_baselines3.common.monitor import Monitor
+from stable_baselines3.common.vec_env import DummyVecEnv, VecMonitor
+import features
 import logic
+from evaluate import EvalWorker
+from recorder import RecordingWrapper, TrajectoryWriter
+from shm_vec_env import SharedMemVecEnv
+from vec_env import SpiderVecEnv
+
+
+def make_monitored_env(rank=0, record_dir=None, **env_kwargs):
+    env = logic.SpiderEnv(**env_kwargs)
+    if record_dir:
+        # 每个环境写自己的轨迹文件，互不加锁
+        env = RecordingWrapper(env, TrajectoryWriter(os.path.join(record_dir, f"env_{rank:03d}.sptr")))
+    return Monitor(env)
+
+
+class EpisodeStatsCallback(BaseCallback):
+    """
+    把对局结束时 info 里的本局统计（episode_stats）和分阶段耗时（profile，需 --profile-env）
+    按局取平均写进 TensorBoard，与 rollout/ep_rew_mean 等一起在每次 rollout 后落盘
+    """
+
+    def _on_step(self):
+        for info in self.locals["infos"]:
+            stats = info.get("episode_stats")
+            if stats is None:
+                continue
+            for name, value in stats.items():
+                self.logger.record_mean(f"episode/{name}", value)
+            for phase, row in info.get("profile", {}).items():
+                if row["calls"]:
+                    self.logger.record_mean(f"profile/{phase}_us", row["ms"] * 1000 / row["calls"])
+                self.logger.record_mean(f"profile/{phase}_share", row["share"])
+        return True
+
+
+class AsyncEvalCallback(CheckpointCallback):
+    """
+    存检查点的同时把它交给后台评估进程（evaluate.EvalWorker），学习进程不等评估结果
+    评估进程在固定种子的牌局上确定性地打完，胜率等指标写进本次训练的 TensorBoard 目录（eval/ 下）
+    """
+
+    def __init__(self, eval_seeds, env_kwargs, **kwargs):
+        super().__init__(**kwargs)
+        self.eval_seeds = eval_seeds
+        self.env_kwargs = env_kwargs
+        self.worker = None
+
+    def _on_training_start(self):
+        # 没开 TensorBoard 时评估进程只打印结果
+        tensorboard = any(isinstance(f, TensorBoardOutputFormat) for f in self.logger.output_formats)
+        log_dir = self.logger.get_dir() if tensorboard else None
+        self.worker = EvalWorker(log_dir, self.eval_seeds, **self.env_kwargs)
+
+    def _on_step(self):
+        super()._on_step()
+        if self.n_calls % self.save_freq == 0:
+            self.worker.submit(self._checkpoint_path(extension="zip"), self.num_timesteps)
+        return True
+
+    def _on_training_end(self):
+        # 等排队中的检查点评估完，最后一批结果也能写进 TensorBoard
+        self.worker.close()
+
+
+class CurriculumCallback(BaseCallback):
+    """
+    按最近 window 局的平均收牌比例（收牌套数 / 8，赢下一局即为 1）调整课程难度：
+    高于 promote 时 level 加 step，低于 demote 时减 step，变化后通过 env_method 下发给所有环境
+    """
+
+    def __init__(self, level=0.1, step=0.05, promote=0.5, demote=0.2, window=200):
+        super().__init__()
+        self.level = level
+        self.step = step
+        self.promote = promote
+        self.demote = demote
+        self.scores = deque(maxlen=window)
+
+    def _on_training_start(self):
+        self.training_env.env_method("set_curriculum_level", self.level)
+
+    def _on_step(self):
+        for info in self.locals["infos"]:
+            stats = info.get("episode_stats")
+            if stats is not None:
+                self.scores.append(stats["sequences"] / 8)
+        if len(self.scores) == self.scores.maxlen:
+            score = np.mean(self.scores)
+            level = self.level
+            if score >= self.promote:
+                level = min(level + self.step, 1.0)
+            elif score < self.demote:
+                level = max(level - self.step, self.step)
+            if level != self.level:
+                self.level = level
+                self.training_env.env_method("set_curriculum_level", level)
+                # 换了难度后重新攒一个窗口再判断
+                self.scores.clear()
+        self.logger.record("curriculum/level", self.level)
+        return True
+
+
+def build_env(args):
+    # dummy: 环境在学习进程里依次推进
+    # native: SpiderVecEnv 在 NumPy 里批量推进成百上千局
+    # shm: 环境分给多个工作进程，观察 / 奖励 / 掩码走共享内存
+    # 循环检测参数与观察编码只有单局环境支持
+    env_kwargs = dict(num_suits=args.num_suits, repeat_penalty=args.repeat_penalty, stall_limit=args.stall_limit, obs_mode=args.obs_mode,
+                      profile=args.profile_env, deal_corpus=args.corpus, curriculum=args.curriculum, macro=args.macro)
+    if args.vec_env == "native":
+        return VecMonitor(SpiderVecEnv(args.n_envs, num_suits=args.num_suits, deal_corpus=args.corpus))
+    env_fns = [partial(make_monitored_env, rank, args.record_dir, **env_kwargs) for rank in range(args.n_envs)]
+    if args.vec_env == "shm":
+        return SharedMemVecEnv(env_fns, n_workers=args.workers)
+    if args.record_dir:
+        return DummyVecEnv(env_fns)
+    return make_vec_env(logic.SpiderEnv, n_envs=args.n_envs, env_kwargs=env_kwargs)
+
+
+def resolve_device(device):
+    """auto 时有 GPU 用 GPU；指定了 cuda 但没有可用的 GPU 时退回 CPU"""
+    if device == "auto" or (device.startswith("cuda") and not torch.cuda.is_available()):
+        if device != "auto":
+            print(f"CUDA 不可用，{device} 改用 cpu")
+        return "cuda" if torch.cuda.is_available() else "cpu"
+    return device
+
+
+def build_model(args, env, **overrides):
+    """train.py 的 MaskablePPO 配置；autotune.py 的试跑也用它，保证测的就是实际训练的设置"""
+    kwargs = dict(
+        device=resolve_device(args.device),
+        learning_rate=2e-4,
+        n_steps=args.n_steps,
+        batch_size=args.batch_size,
+        ent_coef=0.01,
+        # embed：卡牌嵌入 + 共享列编码器（features.py），否则是原始观察直接进的三层 MLP
+        policy_kwargs=(features.policy_kwargs(args.obs_mode) if args.features == "embed"
+                       else dict(net_arch=[256, 256, 256])),
+        verbose=1,
+        tensorboard_log="./spider_tensorboard/"
+    )
+    kwargs.update(overrides)
+    return MaskablePPO("MlpPolicy", env, **kwargs)
+
+
+def load_config(path):
+    """读 autotune.py 写出的配置，返回可以直接交给 parser.set_defaults 的字典"""
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)["config"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Marcuspider MaskablePPO 训练")
+    parser.add_argument("--config", default=None,
+                        help="autotune.py 写出的配置文件，作为 vec-env / n-envs / n-steps 等的默认值")
+    parser.add_argument("--vec-env", choices=["dummy", "native", "shm"], default="dummy")
+    parser.add_argument("--n-envs", type=int, default=8)
+    parser.add_argument("--n-steps", type=int, default=4096)
+    parser.add_argument("--batch-size", type=int, default=1024)
+    parser.add_argument("--device", default="auto", help="auto / cpu / cuda；没有 GPU 时自动用 CPU")
+    parser.add_argument("--workers", type=int, default=None, help="shm 模式的工作进程数，默认为 CPU 核数")
+    parser.add_argument("--repeat-penalty", type=float, default=0.0, help="走回本局旧局面时的额外惩罚")
+    parser.add_argument("--stall-limit", type=int, default=None, help="连续多少步只走到旧局面就截断对局")
+    parser.add_argument("--num-suits", type=int, choices=(1, 2, 4), default=1,
+                        help="花色数；--corpus 给出的牌局语料必须是同样的花色数")
+    parser.add_argument("--obs-mode", choices=logic.OBS_MODES, default="full", help="观察编码")
+    parser.add_argument("--macro", nargs="*", choices=logic.MACRO_RULES, default=None,
+                        help="在 step 里自动走强制 / 占优走法；不跟规则名时启用全部规则")
+    parser.add_argument("--features", choices=["mlp", "embed"], default="mlp",
+                        help="策略网络的输入处理：mlp 直接吃原始观察，embed 用卡牌嵌入（只支持 full / index 观察）")
+    parser.add_argument("--record-dir", default=None, help="把 rollout 轨迹写进这个目录（每个环境一个文件）")
+    parser.add_argument("--profile-env", action="store_true", help="统计环境各阶段耗时并写进 TensorBoard")
+    parser.add_argument("--corpus", default=None, help="牌局语料路径（deals.py 生成），每局从中抽取")
+    parser.add_argument("--curriculum", default=None, help="curriculum.py 生成的难度索引，按从易到难抽局")
+    parser.add_argument("--curriculum-start", type=float, default=0.1, help="开始时只抽最容易的这部分牌局")
+    parser.add_argument("--curriculum-promote", type=float, default=0.5,
+                        help="最近若干局平均收牌比例高于此值时加大难度")
+    parser.add_argument("--curriculum-demote", type=float, default=0.2,
+                        help="最近若干局平均收牌比例低于此值时降低难度")
+    parser.add_argument("--checkpoint-steps", type=int, default=800_000, help="每隔多少环境步存一次检查点")
+    parser.add_argument("--eval-games", type=int, default=0,
+                        help="每个检查点在后台进程里评估的固定种子局数（0 表示不评估）")
+    parser.add_argument("--init-from", default=None, help="从 pretrain.py 存的模型载入初始权重")
+    args = parser.parse_args()
+    if args.config:
+        # 配置文件只改默认值，命令行上显式给出的参数仍然优先
+        parser.set_defaults(**load_config(args.config))
+        args = parser.parse_args()
+    if args.record_dir:
+        if args.vec_env == "native":
+            parser.error("native 向量环境不支持轨迹记录")
+        os.makedirs(args.record_dir, exist_ok=True)
+    if args.vec_env == "native" and (args.repeat_penalty or args.stall_limit is not None):
+        parser.error("native 向量环境不支持循环检测参数")
+    if args.vec_env == "native" and args.obs_mode != "full":
+        parser.error("native 向量环境只支持 full 观察编码")
+    if args.vec_env == "native" and args.profile_env:
+        parser.error("native 向量环境不支持分阶段计时")
+    if args.macro == []:
+        args.macro = logic.MACRO_RULES
+    if args.features == "embed" and args.obs_mode not in features.EMBED_OBS_MODES:
+        parser.error(f"--features embed 只支持 {' / '.join(features.EMBED_OBS_MODES)} 观察编码")
+    if args.vec_env == "native" and args.macro:
+        parser.error("native 向量环境不支持宏动作")
+    if args.curriculum and not args.corpus:
+        parser.error("--curriculum 需要同时给出 --corpus")
+    if args.vec_env == "native" and args.curriculum:
+        parser.error("native 向量环境不支持课程抽局")
+
+    env = build_env(args)
+
+    # save_freq 按 vec_env.step 调用次数计：换算成每 checkpoint_steps 个环境步存一次
+    checkpoint_kwargs = dict(
+      save_freq=max(args.checkpoint_steps // args.n_envs, 1),
+      save_path='./models/',
+      name_prefix='marcuspider'
+    )
+    if args.eval_games:
+        eval_env_kwargs = dict(num_suits=args.num_suits, obs_mode=args.obs_mode, macro=args.macro)
+        checkpoint_callback = AsyncEvalCallback(range(args.eval_games), eval_env_kwargs, **checkpoint_kwargs)
+    else:
+        checkpoint_callback = CheckpointCallback(**checkpoint_kwargs)
+
+    model = build_model(args, env)
+    if args.init_from:
+        # 行为克隆预训练得到的权重（网络结构必须一致）
+        model.set_parameters(args.init_from, device=model.device)
+
+    callbacks = [checkpoint_callback, EpisodeStatsCallback()]
+    if args.curriculum:
+        callbacks.append(CurriculumCallback(args.curriculum_start, promote=args.curriculum_promote,
+                                            demote=args.curriculum_demote))
+
+    model.learn(
+        total_timesteps=1000000,
+        tb_log_name="spider_v2",
+        log_interval=1,
+        progress_bar=True,
+        callback=CallbackList(callbacks)
+    )
+    model.save("marcuspider_final")
+    env.close()
+
 
-env = make_vec_env(logic.SpiderEnv, n_envs=8)
-
-checkpoint_callback = CheckpointCallback(
-  save_freq=100_000,
-  save_path='./models/',
-  name_prefix='marcuspider'
-)
-
-model = MaskablePPO(
-    "MlpPolicy",
-    env,
-    device="cuda",
-    learning_rate=2e-4,
-    n_steps=4096,
-    batch_size=1024,
-    ent_coef=0.01,
-    policy_kwargs=dict(net_arch=[256, 256, 256]),
-    verbose=1,
-    tensorboard_log="./spider_tensorboard/"
-)
-
-model.learn(
-    total_timesteps=1000000,
-    tb_log_name="spider_v2",
-    log_interval=1,
-    progress_bar=True,
-    callback=checkpoint_callback
-)
-model.save("marcuspider_final")
+if __name__ == "__main__":
+    main()
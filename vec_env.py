@@ -0,0 +1,326 @@
+import numpy as np
+from gymnasium import spaces
+from stable_baselines3.common.vec_env import VecEnv
+
+from cards import VAL_MASK, max_card_byte, shuffled_decks
+from deals import load_corpus
+from logic import SpiderEnv, MAX_DEPTH
+
+# 初始发牌布局：第 k 张被 pop 出的牌 deck[103-k] 落在 (列, 槽位)
+# 前4列每列6张，后6列每列5张，与 SpiderEnv._load_deck 一致
+INIT_LENGTHS = np.array([6] * 4 + [5] * 6, dtype=np.int16)
+INIT_COLS = np.repeat(np.arange(10), INIT_LENGTHS)
+INIT_SLOTS = np.concatenate([np.arange(n) for n in INIT_LENGTHS])
+INIT_POS = 103 - np.arange(len(INIT_COLS))
+
+OBS_DEPTH = np.arange(30, dtype=np.int16)
+RUN_OFFSETS = np.arange(13)
+NOT_SELF = ~np.eye(10, dtype=bool)
+
+
+class SpiderVecEnv(VecEnv):
+    """
+    N 局蜘蛛纸牌放在同一组堆叠的 NumPy 数组里批量推进。
+    规则、奖励、终止条件与 SpiderEnv.step 完全一致；结束的对局自动重开，
+    info 里带 terminal_observation，可以直接交给 MaskablePPO 使用。
+    """
+
+    def __init__(self, num_envs, num_suits=1, seed=None, deal_corpus=None):
+        self.num_suits = num_suits
+        self.render_mode = None
+        self.rng = np.random.default_rng(seed)
+        # 牌局语料：给定后每局从语料中抽取，deal_ids 记录每局的编号（-1 表示随机洗牌）
+        self.deal_corpus = load_corpus(deal_corpus)
+        if self.deal_corpus is not None and self.deal_corpus.num_suits != num_suits:
+            raise ValueError(f"牌局语料是 {self.deal_corpus.num_suits} 花色，环境是 {num_suits} 花色")
+
+        n = num_envs
+        self.cards = np.zeros((n, 10, MAX_DEPTH), dtype=np.int8)
+        self.lengths = np.zeros((n, 10), dtype=np.int16)
+        self.hidden = np.zeros((n, 10), dtype=np.int16)
+        self.runs = np.zeros((n, 10), dtype=np.int16)
+        self.deck = np.zeros((n, 104), dtype=np.int8)
+        self.deck_size = np.zeros(n, dtype=np.int16)
+        self.deal_ids = np.full(n, -1, dtype=np.int64)
+        self.last_action = np.full(n, -1, dtype=np.int16)  # -1 表示没有上一个有效动作
+        self.current_step = np.zeros(n, dtype=np.int32)
+        self.actions = np.zeros(n, dtype=np.int64)
+
+        observation_space = spaces.Box(low=-1, high=max_card_byte(num_suits), shape=(600,), dtype=np.int8)
+        super().__init__(n, observation_space, spaces.Discrete(101))
+
+    # ---------- 牌局 ----------
+
+    def _reset_games(self, games, decks=None, deal_ids=None):
+        """
+        重开指定的若干局（games 为下标数组）
+        decks 为空时从语料抽局（deal_ids 中 -1 的位置随机抽），没有语料则随机洗牌
+        """
+        if deal_ids is None:
+            deal_ids = np.full(len(games), -1, dtype=np.int64)
+        if decks is None:
+            if self.deal_corpus is None:
+                decks = shuffled_decks(self.rng, len(games), self.num_suits)
+            else:
+                deal_ids = np.where(deal_ids < 0, self.rng.integers(len(self.deal_corpus), size=len(games)), deal_ids)
+                decks = self.deal_corpus.decks[deal_ids]
+        self.deal_ids[games] = deal_ids
+        self.deck[games] = decks
+        self.cards[games] = 0
+        self.cards[games[:, None], INIT_COLS, INIT_SLOTS] = decks[:, INIT_POS]
+        self.lengths[games] = INIT_LENGTHS
+        self.hidden[games] = INIT_LENGTHS - 1
+        self.runs[games] = 1
+        self.deck_size[games] = 104 - len(INIT_COLS)
+        self.last_action[games] = -1
+        self.current_step[games] = 0
+
+    def load_decks(self, decks, games=None):
+        """用给定的洗牌结果（每行 104 张）重开对局，便于和 SpiderEnv 对照同一副牌"""
+        games = np.arange(self.num_envs) if games is None else np.asarray(games)
+        self._reset_games(games, np.asarray(decks, dtype=np.int8))
+        return self._get_obs()
+
+    def _update_runs(self, games, cols):
+        """重新计算 (局, 列) 对上列顶可移动序列的长度"""
+        lengths = self.lengths[games, cols]
+        width = int(lengths.max(initial=0))
+        if width <= 1:
+            self.runs[games, cols] = lengths
+            return
+        rows = self.cards[games, cols, :width]
+        # link[j]：第 j 张与第 j+1 张同花色且点数大 1
+        link = rows[:, :-1] == rows[:, 1:] + 1
+        j = np.arange(width - 1)
+        brk = (~link | (j < self.hidden[games, cols][:, None])) & (j <= (lengths - 2)[:, None])
+        last_brk = np.where(brk.any(axis=1), width - 2 - np.argmax(brk[:, ::-1], axis=1), -1)
+        self.runs[games, cols] = np.where(lengths > 0, lengths - 1 - last_brk, 0)
+
+    def _can_deal(self):
+        return (self.deck_size >= 10) & (self.lengths > 0).all(axis=1)
+
+    def _deal(self, games):
+        sizes = self.deck_size[games]
+        dealt = self.deck[games[:, None], sizes[:, None] - 1 - np.arange(10)]
+        self.cards[games[:, None], np.arange(10), self.lengths[games]] = dealt
+        self.lengths[games] += 1
+        self.deck_size[games] -= 10
+        self._update_runs(np.repeat(games, 10), np.tile(np.arange(10), len(games)))
+
+    def _flip(self, games, cols):
+        """列顶是盖牌的翻开，返回每个 (局, 列) 是否翻了牌"""
+        lengths = self.lengths[games, cols]
+        flip = (lengths > 0) & (self.hidden[games, cols] == lengths)
+        self.hidden[games[flip], cols[flip]] -= 1
+        return flip
+
+    def _remove_complete(self, games, cols):
+        """收走列顶完整的 K-A 序列，返回每个 (局, 列) 是否收走了"""
+        lengths = self.lengths[games, cols]
+        top = self.cards[games, cols, lengths - 1] & VAL_MASK
+        done = (lengths >= 13) & (top == 1) & (self.runs[games, cols] == 13)
+        g, c, n = games[done], cols[done], lengths[done]
+        self.cards[g[:, None], c[:, None], n[:, None] - 1 - RUN_OFFSETS] = 0
+        self.lengths[g, c] -= 13
+        self._flip(g, c)
+        self._update_runs(g, c)
+        return done
+
+    def _get_obs(self):
+        obs = np.zeros((self.num_envs, 10, 30, 2), dtype=np.int8)
+        below = OBS_DEPTH < self.hidden[:, :, None]
+        vals = self.cards[:, :, :30].copy()
+        np.copyto(vals, -1, where=below)
+        obs[..., 0] = vals
+        obs[..., 1] = ~below & (OBS_DEPTH < self.lengths[:, :, None])
+        return obs.reshape(self.num_envs, -1)
+
+    def action_masks(self):
+        """(N, 101) 的合法动作掩码，与 SpiderEnv.action_masks 逐位相同"""
+        lengths = self.lengths[:, :, None]
+        nonempty = self.lengths > 0
+        tops = np.take_along_axis(self.cards, np.maximum(lengths - 1, 0), axis=2)[:, :, 0] & VAL_MASK
+        heads = np.take_along_axis(self.cards, np.maximum(lengths - self.runs[:, :, None], 0), axis=2)[:, :, 0] & VAL_MASK
+        # [局, 源列, 目标列]：目标为空列，或目标顶牌 = 源序列首牌 + 1
+        legal = (tops[:, None, :] == heads[:, :, None] + 1) | ~nonempty[:, None, :]
+        legal &= nonempty[:, :, None] & NOT_SELF
+
+        mask = np.empty((self.num_envs, 101), dtype=bool)
+        mask[:, :100] = legal.reshape(self.num_envs, 100)
+        mask[:, 100] = self._can_deal()
+        return mask
+
+    # ---------- VecEnv 接口 ----------
+
+    def reset(self):
+        """每局的 options 可带 deal_id（通过 set_options 设置），从语料中取指定的牌局"""
+        if self._seeds[0] is not None:
+            self.rng = np.random.default_rng(self._seeds[0])
+        deal_ids = np.array([(options or {}).get("deal_id", -1) for options in self._options], dtype=np.int64)
+        if (deal_ids >= 0).any() and self.deal_corpus is None:
+            raise ValueError("指定 deal_id 需要先给环境配置 deal_corpus")
+        self._reset_seeds()
+        self._reset_options()
+        self._reset_games(np.arange(self.num_envs), deal_ids=deal_ids)
+        return self._get_obs()
+
+    def step_async(self, actions):
+        self.actions = np.asarray(actions, dtype=np.int64).reshape(self.num_envs)
+
+    def step_wait(self):
+        n = self.num_envs
+        actions = self.actions
+        rewards = np.full(n, -0.05)
+        terminated = np.zeros(n, dtype=bool)
+        infos = [{} for _ in range(n)]
+
+        # 发牌动作 (100)
+        is_deal = actions == 100
+        can_deal = self._can_deal()
+        dealing = np.flatnonzero(is_deal & can_deal)
+        self._deal(dealing)
+        rewards[dealing] += 20.0
+        self.last_action[dealing] = 100
+        rewards[is_deal & ~can_deal] -= 10.0
+
+        # 移动动作
+        moving = np.flatnonzero(~is_deal)
+        src = actions[moving] // 10
+        dest = actions[moving] % 10
+        src_len = self.lengths[moving, src]
+        dest_len = self.lengths[moving, dest]
+        run = self.runs[moving, src]
+        head = self.cards[moving, src, src_len - run] & VAL_MASK
+        top = self.cards[moving, dest, dest_len - 1] & VAL_MASK
+        valid = (src != dest) & (src_len > 0) & ((dest_len == 0) | (head == top - 1))
+
+        rewards[moving[~valid]] -= 2.0
+        self.last_action[moving[~valid]] = -1
+
+        g = moving[valid]
+        src, dest, run = src[valid], dest[valid], run[valid]
+        src_len, dest_len = src_len[valid], dest_len[valid]
+
+        # 退回上一步的移动重罚
+        last = self.last_action[g]
+        back_forth = (last >= 0) & (last < 100) & (src == last % 10) & (dest == last // 10)
+        rewards[g[back_forth]] -= 15.0
+        for i in g[back_forth]:
+            infos[i]["msg"] = "back_forth_penalty"
+
+        # 整段搬运
+        src_had_hidden = self.hidden[g, src] > 0
+        m, k = np.nonzero(RUN_OFFSETS < run[:, None])
+        from_slot = src_len[m] - run[m] + k
+        to_slot = dest_len[m] + k
+        self.cards[g[m], dest[m], to_slot] = self.cards[g[m], src[m], from_slot]
+        self.cards[g[m], src[m], from_slot] = 0
+        self.lengths[g, src] -= run
+        self.lengths[g, dest] += run
+        self.last_action[g] = actions[g]
+
+        rewards[g] += 1.0
+        rewards[g] += 50.0 * self._flip(g, src)
+        rewards[g] += 30.0 * ((self.lengths[g, src] == 0) & src_had_hidden)
+        rewards[g] += 5.0 * (self.lengths[g, dest] > run)
+        self._update_runs(np.concatenate([g, g]), np.concatenate([src, dest]))
+
+        completed = self._remove_complete(g, dest)
+        rewards[g] += 300.0 * completed
+        won = g[completed]
+        won = won[~self.lengths[won].any(axis=1) & (self.deck_size[won] == 0)]
+        rewards[won] += 1000.0
+        terminated[won] = True
+
+        self.current_step[moving] += 1
+        truncated = np.zeros(n, dtype=bool)
+        truncated[moving] = self.current_step[moving] >= 1000
+        dones = terminated | truncated
+
+        obs = self._get_obs()
+        finished = np.flatnonzero(dones)
+        if len(finished):
+            for i in finished:
+                infos[i]["terminal_observation"] = obs[i].copy()
+                infos[i]["TimeLimit.truncated"] = bool(truncated[i] and not terminated[i])
+            self._reset_games(finished)
+            obs = self._get_obs()
+
+        return obs, rewards.astype(np.float32), dones, infos
+
+    def close(self):
+        pass
+
+    def _indices(self, indices):
+        return list(self._get_indices(indices))
+
+    def get_attr(self, attr_name, indices=None):
+        value = getattr(self, attr_name)
+        return [value for _ in self._indices(indices)]
+
+    def set_attr(self, attr_name, value, indices=None):
+        setattr(self, attr_name, value)
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        # 向量环境上的方法都是批量的（如 action_masks），按行拆给各局
+        result = getattr(self, method_name)(*method_args, **method_kwargs)
+        return [result[i] for i in self._indices(indices)]
+
+    def env_is_wrapped(self, wrapper_class, indices=None):
+        return [False for _ in self._indices(indices)]
+
+
+if __name__ == "__main__":
+    import time
+
+    # 同一副牌下与 SpiderEnv 逐步对照：观察、掩码、奖励、终止必须完全一致
+    for num_suits in (1, 2, 4):
+        num_games = 16
+        vec = SpiderVecEnv(num_games, num_suits=num_suits, seed=0)
+        vec.reset()
+        singles = [SpiderEnv(num_suits=num_suits) for _ in range(num_games)]
+
+        def sync(i):
+            singles[i]._load_deck(vec.deck[i].copy())
+            singles[i].current_step = 0
+            singles[i].last_action = None
+
+        for i in range(num_games):
+            sync(i)
+
+        rng = np.random.default_rng(1)
+        for step_num in range(3000):
+            masks = vec.action_masks()
+            actions = np.zeros(num_games, dtype=np.int64)
+            for i, env in enumerate(singles):
+                assert (masks[i] == env.action_masks()).all(), "掩码不一致"
+                legal = np.flatnonzero(masks[i])
+                # 偶尔故意走非法动作，覆盖惩罚分支；无路可走时也只能走非法动作
+                if len(legal) == 0 or rng.random() < 0.05:
+                    actions[i] = rng.integers(101)
+                else:
+                    actions[i] = rng.choice(legal)
+
+            obs, rewards, dones, infos = vec.step(actions)
+            for i, env in enumerate(singles):
+                s_obs, s_rew, s_term, s_trunc, _ = env.step(int(actions[i]))
+                assert np.float32(s_rew) == rewards[i], "奖励不一致"
+                assert (s_term or s_trunc) == dones[i], "终止不一致"
+                if dones[i]:
+                    assert (infos[i]["terminal_observation"] == s_obs).all()
+                    sync(i)
+                else:
+                    assert (obs[i] == s_obs).all(), "观察不一致"
+        print(f"{num_suits} 花色：与 SpiderEnv 对照通过")
+
+    for num_games in (256, 1024):
+        vec = SpiderVecEnv(num_games, seed=0)
+        vec.reset()
+        start = time.perf_counter()
+        for _ in range(200):
+            masks = vec.action_masks()
+            # 每局随机挑一个合法动作（没有则发牌）
+            scores = rng.random(masks.shape) * masks
+            vec.step(scores.argmax(axis=1))
+        elapsed = time.perf_counter() - start
+        print(f"{num_games} 局并行: {200 * num_games / elapsed:.0f} env steps/s")